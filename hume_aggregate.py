@@ -0,0 +1,156 @@
+"""Aggregation of per-segment emotion predictions into one response.
+
+Hume returns a score for every emotion for every segment of the input, such
+as each sentence of a text or each vocal burst in a recording. These helpers
+load the scores into a NumPy matrix (segments x emotions), optionally
+regroup audio segments into fixed time windows, and combine the rows with
+``mean``, ``max`` or ``recency`` (an exponentially weighted mean favouring
+later segments). Only the ``top_k`` emotions are returned; they are found
+with a partial selection instead of sorting every score. NumPy is imported
+by the first aggregation rather than with the module, to keep server start
+fast.
+"""
+import os
+
+AGGREGATIONS = ("mean", "max", "recency")
+
+# Emotions returned per response unless the request asks for another number; 0 returns all
+DEFAULT_TOP_K = int(os.getenv('HUME_EMOTION_TOP_K', 5))
+
+# With recency weighting, a segment counts half as much as one this many segments later
+RECENCY_HALF_LIFE = float(os.getenv('HUME_EMOTION_RECENCY_HALF_LIFE', 2))
+
+
+class InvalidOptions(ValueError):
+    """Raised for aggregation options a request cannot use."""
+
+
+def parse_options(params):
+    """Keyword arguments for ``summarize`` from request parameters.
+
+    Reads ``aggregation``, ``topK``, ``window`` (seconds) and ``segments``.
+    """
+    options = {"aggregation": "mean", "top_k": DEFAULT_TOP_K, "window": None, "detail": False}
+    aggregation = params.get('aggregation')
+    if aggregation is not None:
+        if aggregation not in AGGREGATIONS:
+            raise InvalidOptions(f"Unknown aggregation {aggregation!r}; expected one of {', '.join(AGGREGATIONS)}")
+        options["aggregation"] = aggregation
+    try:
+        if params.get('topK') is not None:
+            options["top_k"] = int(params.get('topK'))
+        if params.get('window') is not None:
+            options["window"] = float(params.get('window'))
+    except (TypeError, ValueError):
+        raise InvalidOptions("topK must be an integer and window a number of seconds")
+    if options["top_k"] < 0 or (options["window"] is not None and options["window"] <= 0):
+        raise InvalidOptions("topK must be 0 or more and window greater than 0")
+    options["detail"] = params.get('segments', False) in (True, '1', 'true')
+    return options
+
+
+def score_matrix(segments):
+    """Emotion names and a ``(len(segments), len(names))`` score matrix.
+
+    Hume lists the emotions of every segment in the same order, so the rows
+    are read in one pass; segments listing them differently are realigned
+    by name.
+    """
+    import numpy as np
+
+    if not segments:
+        return (), np.zeros((0, 0))
+    names = tuple(emotion['name'] for emotion in segments[0]['emotions'])
+    if all(tuple(emotion['name'] for emotion in segment['emotions']) == names for segment in segments[1:]):
+        scores = np.fromiter(
+            (emotion['score'] for segment in segments for emotion in segment['emotions']),
+            dtype=np.float64, count=len(segments) * len(names)
+        )
+        return names, scores.reshape(len(segments), len(names))
+
+    columns = {name: index for index, name in enumerate(names)}
+    for segment in segments:
+        for emotion in segment['emotions']:
+            columns.setdefault(emotion['name'], len(columns))
+    matrix = np.zeros((len(segments), len(columns)))
+    for row, segment in enumerate(segments):
+        for emotion in segment['emotions']:
+            matrix[row, columns[emotion['name']]] = emotion['score']
+    return tuple(columns), matrix
+
+
+def time_windows(segments, matrix, window):
+    """Average the rows of segments that start in the same ``window``-second window.
+
+    Returns the window bounds and one row per window that holds a segment.
+    """
+    import numpy as np
+
+    starts = np.array([segment.get('begin') or 0.0 for segment in segments], dtype=np.float64)
+    index = (starts // window).astype(np.int64)
+    occupied, inverse = np.unique(index, return_inverse=True)
+    sums = np.zeros((len(occupied), matrix.shape[1]))
+    np.add.at(sums, inverse, matrix)
+    counts = np.bincount(inverse, minlength=len(occupied))
+    bounds = [{"begin": float(i * window), "end": float((i + 1) * window)} for i in occupied]
+    return bounds, sums / counts[:, None]
+
+
+def aggregate(matrix, method="mean", half_life=None):
+    """Combine the rows of ``matrix`` into one score per emotion."""
+    import numpy as np
+
+    if method == "max":
+        return matrix.max(axis=0)
+    if method == "recency":
+        half_life = RECENCY_HALF_LIFE if half_life is None else half_life
+        age = np.arange(len(matrix) - 1, -1, -1, dtype=np.float64)
+        weights = np.power(0.5, age / half_life) if half_life > 0 else (age == 0).astype(np.float64)
+        return weights @ matrix / weights.sum()
+    return matrix.mean(axis=0)
+
+
+def top_emotions(names, scores, k):
+    """The ``k`` highest scores as ``{"name", "score"}`` dicts, best first; ``k=0`` returns all."""
+    if not len(scores):
+        return []
+    import numpy as np
+
+    if 0 < k < len(scores):
+        # Partial selection of the k best, then an order over those k only
+        selected = np.argpartition(scores, len(scores) - k)[len(scores) - k:]
+    else:
+        selected = np.arange(len(scores))
+    selected = selected[np.argsort(-scores[selected], kind='stable')]
+    return [{'name': names[i], 'score': float(scores[i])} for i in selected]
+
+
+def summarize(segments, aggregation="mean", top_k=DEFAULT_TOP_K, window=None, detail=False):
+    """The response body for a list of segment predictions, defaulting to neutral.
+
+    ``segments`` are dicts with ``emotions`` and optional ``begin``, ``end``
+    and ``text``. With ``window`` (seconds) audio segments are first
+    averaged per time window. With ``detail`` the response also
+    lists each segment, or window, and its dominant emotion.
+    """
+    segments = [segment for segment in segments if segment.get('emotions')]
+    names, matrix = score_matrix(segments)
+    if not matrix.size:
+        result = {"emotions": [], "dominantEmotion": "neutral"}
+        if detail:
+            result["segments"] = []
+        return result
+
+    bounds = [{key: segment[key] for key in ('begin', 'end', 'text') if key in segment} for segment in segments]
+    if window:
+        bounds, matrix = time_windows(segments, matrix, window)
+
+    emotions = top_emotions(names, aggregate(matrix, aggregation), top_k)
+    result = {"emotions": emotions, "dominantEmotion": emotions[0]['name']}
+    if detail:
+        best = matrix.argmax(axis=1)
+        result["segments"] = [
+            dict(bound, dominantEmotion=names[column], score=float(matrix[row, column]))
+            for row, (bound, column) in enumerate(zip(bounds, best))
+        ]
+    return result
@@ -0,0 +1,679 @@
+"""ASGI serving mode for the Hume TTS and emotion server.
+
+Serves the same routes as the Flask app in ``hume_tts_server`` with identical
+request and response contracts, but every handler is a coroutine on the ASGI
+server's event loop. A request waiting on a Hume job therefore costs one
+suspended coroutine instead of a blocked thread, so concurrency is bounded by
+the upstream connection pools rather than by thread count. The caches, job
+tracker, coalescer and pooled Hume client come from ``hume_service``, which
+the Flask app uses as well; only the HTTP layer differs, and Flask is never
+imported.
+
+Usage:
+    uvicorn hume_asgi:app --host 0.0.0.0 --port 5001
+    python hume_asgi.py
+    python hume_workers.py --workers 4    # preforked workers sharing one cache
+"""
+import time
+
+# Cold start is measured from the first import of this module; see /api/ready
+_import_started = time.perf_counter()
+
+import asyncio
+import contextlib
+import hmac
+import logging
+import os
+import secrets
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Match, Route
+from werkzeug.http import parse_options_header
+
+import hume_metrics
+from hume_http import CircuitOpen, get_client
+from hume_audio import FormatError, audio_response, negotiate
+from hume_aggregate import InvalidOptions, parse_options, summarize
+from hume_deadline import DeadlineExceeded, InvalidDeadline, parse_budget, within
+from hume_scheduler import Overloaded
+from hume_service import (
+    AUDIO_MAX_UPLOAD_BYTES,
+    AUDIO_PREPROCESS,
+    EMOTION_BATCH_MAX_TEXTS,
+    EMOTION_CACHE_AUDIO_MAX_BYTES,
+    HUME_ADMIN_TOKEN,
+    HUME_CALLBACK_TOKEN,
+    RESUME_JOBS,
+    TTS_OUTPUT_FORMAT,
+    SSE_HEADERS,
+    accepted_body,
+    analyze_audio_upload,
+    analyze_texts_cached,
+    app_built,
+    audio_job_request,
+    audio_model_config,
+    detect_text_emotion,
+    emotion_cache,
+    entries_limit,
+    emotion_coalescer,
+    fallback_reason,
+    fallback_speech,
+    job_events,
+    job_store,
+    job_tracker,
+    overloaded_body,
+    queue_emotion_job,
+    readiness,
+    resolve_voice,
+    respond_parts,
+    resume_emotion_jobs,
+    stream_and_cache_sentences,
+    stream_and_cache_speech,
+    synthesize_in_format,
+    text_granularity,
+    text_job_request,
+    tts_cache,
+    wants_sentences
+)
+from hume_job_store import job_body
+from hume_logging import log_raw
+from hume_upload import AsyncStreamingUpload, UploadTooLarge
+
+logger = logging.getLogger('hume_asgi')
+
+
+async def read_json(request):
+    """The JSON object in the request body, or ``{}`` when the body is missing, malformed or not an object.
+
+    Bad bodies then fail validation with the same 400 as in Flask mode instead of a 500.
+    """
+    try:
+        data = await request.json()
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+async def detect_emotion(request):
+    start_time = time.time()
+    try:
+        # Get request data
+        data = await read_json(request)
+        text = data.get('text')
+
+        if not text:
+            return JSONResponse({'error': 'Text is required'}, 400)
+
+        # Granularity, aggregation options and latency budget; unknown values are the client's mistake
+        try:
+            granularity = text_granularity(data)
+            options = parse_options(data)
+            budget = parse_budget(request.headers.get('x-deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return JSONResponse({'error': str(e)}, 400)
+
+        logger.info("Detecting emotion for text: %s...", text[:50])
+
+        # A failing Hume or a spent budget gets an immediate neutral answer instead of an error
+        fallback = None
+        try:
+            emotion_predictions, cache_source = await within(detect_text_emotion(text, granularity), budget)
+        except (CircuitOpen, DeadlineExceeded) as e:
+            logger.warning("Answering emotion request with a fallback: %s", e)
+            emotion_predictions, cache_source, fallback = [], "miss", fallback_reason(e)
+
+        # Log the raw response for debugging
+        log_raw(logger, "Raw emotion predictions", emotion_predictions)
+
+        result = summarize(emotion_predictions, **options)
+        headers = {'X-Emotion-Cache': cache_source}
+        if fallback:
+            result["fallback"] = headers['X-Fallback'] = fallback
+            hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+        elif not emotion_predictions:
+            hume_metrics.FALLBACK_RESPONSES.inc(reason="empty")
+
+        elapsed = time.time() - start_time
+        logger.info("Emotion detection completed in %.2f seconds: %s (cache %s)", elapsed, result['dominantEmotion'], cache_source,
+                    extra={"duration": elapsed, "dominant_emotion": result['dominantEmotion'], "cache": cache_source})
+        return JSONResponse(result, headers=headers)
+
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return JSONResponse(body, 429, headers=headers)
+
+    except Exception as e:
+        logger.error("Error in emotion detection: %s", e)
+        logger.info("Failed emotion detection time: %.2f seconds", time.time() - start_time)
+        hume_metrics.FALLBACK_RESPONSES.inc(reason="error")
+
+        # Return a fallback neutral emotion
+        return JSONResponse({
+            "emotions": [],
+            "dominantEmotion": "neutral",
+            "error": str(e)
+        }, 500)
+
+
+async def detect_emotion_batch(request):
+    start_time = time.time()
+    texts = []
+    try:
+        # Get request data
+        data = await read_json(request)
+        texts = data.get('texts')
+
+        if not isinstance(texts, list) or not texts:
+            return JSONResponse({'error': 'texts must be a non-empty list'}, 400)
+        if not all(isinstance(text, str) and text for text in texts):
+            return JSONResponse({'error': 'Every entry in texts must be a non-empty string'}, 400)
+        if len(texts) > EMOTION_BATCH_MAX_TEXTS:
+            return JSONResponse({'error': f'At most {EMOTION_BATCH_MAX_TEXTS} texts are allowed per batch'}, 400)
+        try:
+            granularity = text_granularity(data)
+            options = parse_options(data)
+            budget = parse_budget(request.headers.get('x-deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return JSONResponse({'error': str(e)}, 400)
+
+        logger.info("Detecting emotion for a batch of %s texts", len(texts))
+
+        # Cached texts are answered directly; the rest share a single Hume job
+        fallback = None
+        try:
+            per_text = await within(analyze_texts_cached(texts, granularity), budget)
+        except (CircuitOpen, DeadlineExceeded) as e:
+            # Keep what the cache knows and answer the rest as neutral
+            logger.warning("Answering batch emotion request with fallbacks: %s", e)
+            fallback = fallback_reason(e)
+            per_text = await analyze_texts_cached(texts, granularity, upstream=False)
+        results = [summarize(emotion_predictions, **options) for emotion_predictions in per_text]
+        empty = sum(1 for emotion_predictions in per_text if not emotion_predictions)
+        if empty:
+            hume_metrics.FALLBACK_RESPONSES.inc(empty, reason=fallback or "empty")
+
+        logger.info("Batch emotion detection of %s texts completed in %.2f seconds", len(texts), time.time() - start_time)
+        if fallback:
+            return JSONResponse({"results": results, "fallback": fallback}, headers={'X-Fallback': fallback})
+        return JSONResponse({"results": results})
+
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return JSONResponse(body, 429, headers=headers)
+
+    except Exception as e:
+        logger.error("Error in batch emotion detection: %s", e)
+        logger.info("Failed batch emotion detection time: %.2f seconds", time.time() - start_time)
+
+        # Return a fallback neutral emotion for every text
+        texts = texts if isinstance(texts, list) else []
+        hume_metrics.FALLBACK_RESPONSES.inc(len(texts), reason="error")
+        return JSONResponse({
+            "results": [{"emotions": [], "dominantEmotion": "neutral"} for _ in texts],
+            "error": str(e)
+        }, 500)
+
+
+async def text_to_speech(request):
+    start_time = time.time()
+    try:
+        # Get request data; GET takes the same fields as query parameters so an audio element can load the URL
+        data = await read_json(request) if request.method == 'POST' else request.query_params
+        text = data.get('text')
+        emotion = data.get('emotion', 'neutral').lower()  # Normalize to lowercase
+        agent_name = data.get('agentName', 'Minister Santos')  # Match frontend parameter name
+
+        if not text:
+            return JSONResponse({'error': 'Text is required'}, 400)
+
+        # Output encoding from the format/bitrate parameters or the Accept header
+        try:
+            audio_format = negotiate(
+                request.headers.get('accept'),
+                data.get('format', request.query_params.get('format')),
+                data.get('bitrate', request.query_params.get('bitrate'))
+            )
+            budget = parse_budget(request.headers.get('x-deadline'))
+        except FormatError as e:
+            return JSONResponse({'error': str(e)}, e.status)
+        except InvalidDeadline as e:
+            return JSONResponse({'error': str(e)}, 400)
+
+        logger.info("Generating speech for %s with emotion %s", agent_name, emotion)
+
+        description, voice_id = resolve_voice(agent_name, emotion)
+        download_name = f"{agent_name.replace(' ', '_').lower()}_{emotion}"
+
+        # Streaming mode relays audio to the client as Hume produces it; other formats need the whole clip
+        stream = data.get('stream', request.query_params.get('stream', '')) in (True, '1', 'true')
+        # Lines of several sentences can be synthesized sentence by sentence in parallel, relaying each in order
+        sentences = wants_sentences(data.get('sentences', request.query_params.get('sentences')), text)
+        fallback = None
+        try:
+            if (stream or sentences) and audio_format.native:
+                cache_key = tts_cache.key(text, description, voice_id, TTS_OUTPUT_FORMAT)
+                audio_data, cache_source = await tts_cache.lookup(cache_key)
+                if audio_data is None:
+                    relay = stream_and_cache_sentences if sentences else stream_and_cache_speech
+                    chunks = relay(cache_key, text, description, voice_id)
+                    # Pull the first chunk before sending headers so upstream errors still become a 500 or a fallback;
+                    # the budget bounds the time to the first chunk, not the rest of the stream
+                    try:
+                        first_chunk = await within(chunks.__anext__(), budget)
+                    except StopAsyncIteration:
+                        first_chunk = b''
+                    except BaseException:
+                        await chunks.aclose()
+                        raise
+
+                    async def generate():
+                        logger.info("TTS time to first byte: %.3f seconds (streaming)", time.time() - start_time)
+                        yield first_chunk
+                        async for chunk in chunks:
+                            yield chunk
+                        logger.info("Streaming TTS request completed in %.2f seconds", time.time() - start_time)
+
+                    headers = {
+                        'Content-Disposition': f'inline; filename={download_name}.mp3',
+                        'X-TTS-Format': TTS_OUTPUT_FORMAT,
+                        'X-TTS-Cache': 'miss'
+                    }
+                    return StreamingResponse(generate(), media_type='audio/mpeg', headers=headers)
+            else:
+                # Serve repeated lines from the cache; identical concurrent requests share one synthesis
+                audio_data, cache_source = await within(
+                    synthesize_in_format(text, description, voice_id, audio_format, sentences), budget
+                )
+        except (CircuitOpen, DeadlineExceeded) as e:
+            # Play the pregenerated clip for this emotion rather than keep the player waiting
+            logger.warning("Serving fallback speech for %s: %s", emotion, e)
+            fallback = fallback_reason(e)
+            audio_data, audio_format = await fallback_speech(emotion, audio_format)
+            cache_source = "fallback"
+            hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+
+        elapsed = time.time() - start_time
+        logger.info("TTS request completed in %.2f seconds (cache %s, time to first byte %.3f seconds)", elapsed, cache_source, elapsed,
+                    extra={"duration": elapsed, "ttfb": elapsed, "cache": cache_source, "format": audio_format.key})
+
+        # Return audio straight from memory, or the requested byte range of it
+        status, body, headers = audio_response(
+            audio_data, audio_format, download_name, request.headers.get('range'), request.headers.get('if-range')
+        )
+        headers['X-TTS-Cache'] = cache_source
+        if fallback:
+            headers['X-Fallback'] = fallback
+        return Response(body, status, headers)
+
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return JSONResponse(body, 429, headers=headers)
+
+    except Exception as e:
+        logger.error("Error in TTS: %s", e)
+        logger.info("Failed TTS request time: %.2f seconds", time.time() - start_time)
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def respond(request):
+    start_time = time.time()
+    try:
+        data = await read_json(request)
+        text = data.get('text')
+        agent_name = data.get('agentName', 'Minister Santos')
+
+        if not text:
+            return JSONResponse({'error': 'Text is required'}, 400)
+
+        # Emotion options as for /api/emotion, output encoding as for /api/tts
+        try:
+            granularity = text_granularity(data)
+            options = parse_options(data)
+            audio_format = negotiate(None, data.get('format'), data.get('bitrate'))
+            budget = parse_budget(request.headers.get('x-deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return JSONResponse({'error': str(e)}, 400)
+        except FormatError as e:
+            return JSONResponse({'error': str(e)}, e.status)
+        sentences = wants_sentences(data.get('sentences'), text)
+
+        logger.info("Responding as %s: %s...", agent_name, text[:50])
+
+        # Run the analysis before sending headers so its failures still get a status code
+        boundary = secrets.token_hex(16)
+        parts = respond_parts(text, agent_name, audio_format, granularity, options, budget, boundary, sentences)
+        try:
+            emotion_part = await parts.__anext__()
+        except BaseException:
+            await parts.aclose()
+            raise
+
+        async def generate():
+            logger.info("Respond emotion sent after %.3f seconds", time.time() - start_time)
+            yield emotion_part
+            async for chunk in parts:
+                yield chunk
+            logger.info("Respond request completed in %.2f seconds", time.time() - start_time)
+
+        return StreamingResponse(generate(), media_type=f'multipart/mixed; boundary={boundary}')
+
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return JSONResponse(body, 429, headers=headers)
+
+    except Exception as e:
+        logger.error("Error in respond pipeline: %s", e)
+        logger.info("Failed respond request time: %.2f seconds", time.time() - start_time)
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def detect_emotion_from_audio(request):
+    start_time = time.time()
+    try:
+        # Reject oversized uploads up front when the client declares a length
+        content_length = int(request.headers.get('content-length') or 0)
+        if content_length > AUDIO_MAX_UPLOAD_BYTES:
+            return JSONResponse({'error': f'Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes'}, 413)
+
+        # Parse the multipart body as it arrives from the socket
+        mimetype, params = parse_options_header(request.headers.get('content-type', ''))
+        boundary = params.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            return JSONResponse({'error': 'No audio file provided'}, 400)
+
+        audio_upload = AsyncStreamingUpload(request.stream(), boundary, 'audio', AUDIO_MAX_UPLOAD_BYTES)
+        if not await audio_upload.open():
+            return JSONResponse({'error': 'No audio file provided'}, 400)
+
+        if not audio_upload.filename:
+            return JSONResponse({'error': 'No selected file'}, 400)
+
+        try:
+            options = parse_options(request.query_params)
+            budget = parse_budget(request.headers.get('x-deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return JSONResponse({'error': str(e)}, 400)
+
+        logger.info("Detecting emotion from audio file: %s", audio_upload.filename)
+        preprocess = request.query_params.get('preprocess', '1' if AUDIO_PREPROCESS else '0') in ('1', 'true')
+
+        # Small recordings are hashed up front so repeats can be answered from the cache
+        audio_cache_key = None
+        if await audio_upload.buffer_up_to(EMOTION_CACHE_AUDIO_MAX_BYTES):
+            audio_cache_key = emotion_cache.audio_key(audio_upload.sha256(), audio_model_config(preprocess))
+
+        fallback = None
+        try:
+            emotion_list, cache_source, upload_mode = await within(analyze_audio_upload(audio_upload, audio_cache_key, preprocess), budget)
+        except (CircuitOpen, DeadlineExceeded) as e:
+            logger.warning("Answering audio emotion request with a fallback: %s", e)
+            emotion_list, cache_source, upload_mode, fallback = [], "miss", "none", fallback_reason(e)
+
+        result = summarize(emotion_list, **options)
+        headers = {'X-Emotion-Cache': cache_source, 'X-Audio-Upload-Mode': upload_mode}
+        if fallback:
+            result["fallback"] = headers['X-Fallback'] = fallback
+            hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+        elif not emotion_list:
+            hume_metrics.FALLBACK_RESPONSES.inc(reason="empty")
+
+        elapsed = time.time() - start_time
+        logger.info("Audio emotion detection completed in %.2f seconds: %s (cache %s, %s upload)", elapsed, result['dominantEmotion'], cache_source, upload_mode,
+                    extra={"duration": elapsed, "dominant_emotion": result['dominantEmotion'], "cache": cache_source, "upload_mode": upload_mode})
+        return JSONResponse(result, headers=headers)
+
+    except UploadTooLarge as e:
+        logger.error("Rejected audio upload: %s", e)
+        return JSONResponse({'error': str(e)}, 413)
+
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return JSONResponse(body, 429, headers=headers)
+
+    except Exception as e:
+        logger.error("Error in audio emotion detection: %s", e)
+        logger.info("Failed audio emotion detection time: %.2f seconds", time.time() - start_time)
+        hume_metrics.FALLBACK_RESPONSES.inc(reason="error")
+
+        # Return a fallback neutral emotion
+        return JSONResponse({
+            "emotions": [],
+            "dominantEmotion": "neutral",
+            "error": str(e)
+        }, 500)
+
+
+async def submit_emotion_job(request):
+    # Queue the analysis and answer at once; the result is fetched or streamed later
+    try:
+        job_request = text_job_request(await read_json(request))
+    except InvalidOptions as e:
+        return JSONResponse({'error': str(e)}, 400)
+
+    job = await queue_emotion_job("text", job_request)
+    logger.info("Queued asynchronous emotion job %s for %s texts", job.token, len(job_request["texts"]))
+    return JSONResponse(accepted_body(job), 202, headers={'Location': f"/api/emotion/jobs/{job.token}"})
+
+
+async def submit_audio_emotion_job(request):
+    try:
+        content_length = int(request.headers.get('content-length') or 0)
+        if content_length > AUDIO_MAX_UPLOAD_BYTES:
+            return JSONResponse({'error': f'Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes'}, 413)
+
+        mimetype, params = parse_options_header(request.headers.get('content-type', ''))
+        boundary = params.get('boundary')
+        if mimetype != 'multipart/form-data' or not boundary:
+            return JSONResponse({'error': 'No audio file provided'}, 400)
+
+        audio_upload = AsyncStreamingUpload(request.stream(), boundary, 'audio', AUDIO_MAX_UPLOAD_BYTES)
+        if not await audio_upload.open():
+            return JSONResponse({'error': 'No audio file provided'}, 400)
+
+        if not audio_upload.filename:
+            return JSONResponse({'error': 'No selected file'}, 400)
+
+        try:
+            options = parse_options(request.query_params)
+        except InvalidOptions as e:
+            return JSONResponse({'error': str(e)}, 400)
+        preprocess = request.query_params.get('preprocess', '1' if AUDIO_PREPROCESS else '0') in ('1', 'true')
+
+        # The recording is spooled to disk as it arrives so the job survives a restart before it reaches Hume
+        spooled, audio_sha256, audio_size = await job_store.aspool(audio_upload.aiter_chunks())
+        job_request = audio_job_request(audio_sha256, audio_upload.filename, audio_upload.content_type, preprocess, options)
+        job = await queue_emotion_job("audio", job_request, spooled=spooled)
+        logger.info("Queued asynchronous audio emotion job %s for %s (%s bytes)", job.token, audio_upload.filename, audio_size)
+        return JSONResponse(accepted_body(job), 202, headers={'Location': f"/api/emotion/jobs/{job.token}"})
+
+    except UploadTooLarge as e:
+        logger.error("Rejected audio upload: %s", e)
+        return JSONResponse({'error': str(e)}, 413)
+
+    except Exception as e:
+        logger.error("Error queueing audio emotion job: %s", e)
+        return JSONResponse({'error': str(e)}, 500)
+
+
+async def get_emotion_job(request):
+    job = await asyncio.to_thread(job_store.get, request.path_params['token'])
+    if job is None:
+        return JSONResponse({'error': 'Unknown or expired job'}, 404)
+    return JSONResponse(job_body(job))
+
+
+async def emotion_job_events(request):
+    token = request.path_params['token']
+    if await asyncio.to_thread(job_store.get, token) is None:
+        return JSONResponse({'error': 'Unknown or expired job'}, 404)
+    return StreamingResponse(job_events(token), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def hume_job_callback(request):
+    # Hume calls this when a job submitted with callback_url finishes
+    if HUME_CALLBACK_TOKEN and not hmac.compare_digest(request.query_params.get('token', ''), HUME_CALLBACK_TOKEN):
+        return JSONResponse({'error': 'Invalid callback token'}, 403)
+
+    data = await read_json(request)
+    job_id = data.get('job_id')
+    if not job_id:
+        return JSONResponse({'error': 'job_id is required'}, 400)
+
+    status = data.get('status', 'COMPLETED')
+    failure_reason = data.get('failure_reason') or data.get('message')
+
+    known = job_tracker.notify(job_id, status, failure_reason)
+    return JSONResponse({'received': True, 'known': known})
+
+
+def admin_authorized(request):
+    if HUME_ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), HUME_ADMIN_TOKEN)
+    return request.client is not None and request.client.host in ('127.0.0.1', '::1')
+
+
+async def admin_emotion_cache(request):
+    if not admin_authorized(request):
+        return JSONResponse({'error': 'Forbidden'}, 403)
+
+    kind = request.query_params.get('kind')
+    if kind not in (None, 'text', 'audio'):
+        return JSONResponse({'error': 'kind must be text or audio'}, 400)
+
+    # DELETE flushes the cache, optionally only one kind of entry
+    if request.method == 'DELETE':
+        removed = await asyncio.to_thread(emotion_cache.flush, kind)
+        logger.info("Flushed %s emotion cache entries (kind: %s)", removed, kind or 'all')
+        return JSONResponse({'flushed': removed})
+
+    try:
+        limit = entries_limit(request.query_params.get('limit'))
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, 400)
+    return JSONResponse({
+        'stats': emotion_cache.stats(),
+        'entries': await asyncio.to_thread(emotion_cache.entries, kind, limit)
+    })
+
+
+async def prometheus_metrics(request):
+    # Per-stage latency histograms and per-route counters for Prometheus to scrape
+    return PlainTextResponse(hume_metrics.REGISTRY.render(), headers={'Content-Type': hume_metrics.CONTENT_TYPE})
+
+
+async def upstream_stats(request):
+    # Connection reuse counters for the shared Hume client pool and cache counters
+    return JSONResponse({
+        "http": get_client().stats(),
+        "scheduler": get_client().scheduler.stats(),
+        "tts_cache": tts_cache.stats(),
+        "emotion_coalescer": emotion_coalescer.stats(),
+        "jobs": job_tracker.stats(),
+        "async_jobs": job_store.stats(),
+        "emotion_cache": emotion_cache.stats()
+    })
+
+
+async def ready(request):
+    # Readiness probe for load balancers and the multi-worker entry point
+    body, status = readiness()
+    return JSONResponse(body, status)
+
+
+class MetricsMiddleware:
+    """Labels everything recorded for a request with its route and times the response write."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        route = route_label(scope)
+        token = hume_metrics.current_route.set(route)
+        started = time.perf_counter()
+        handled = None
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal handled, status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                handled = time.perf_counter()
+                hume_metrics.REQUEST_SECONDS.observe(handled - started, route=route)
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                hume_metrics.STAGE_SECONDS.observe(time.perf_counter() - handled, route=route, stage="response_write")
+
+        try:
+            with hume_metrics.REQUESTS_IN_FLIGHT.track(route=route):
+                await self.app(scope, receive, send_with_metrics)
+        finally:
+            hume_metrics.REQUESTS.inc(route=route, status=status)
+            hume_metrics.current_route.reset(token)
+
+
+def route_label(scope):
+    """The path template of the route ``scope`` is for, as Flask reports ``url_rule``."""
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match is not Match.NONE:
+            return route.path
+    return 'unmatched'
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Pick up asynchronous jobs a previous run left unfinished
+    if RESUME_JOBS:
+        await resume_emotion_jobs()
+    yield
+    # Pooled sessions belong to this loop; close them before it stops
+    await get_client().close()
+
+
+app = Starlette(
+    routes=[
+        Route('/api/emotion', detect_emotion, methods=['POST']),
+        Route('/api/emotion/batch', detect_emotion_batch, methods=['POST']),
+        Route('/api/tts', text_to_speech, methods=['GET', 'POST']),
+        Route('/api/respond', respond, methods=['POST']),
+        Route('/api/emotion/audio', detect_emotion_from_audio, methods=['POST']),
+        Route('/api/emotion/jobs', submit_emotion_job, methods=['POST']),
+        Route('/api/emotion/audio/jobs', submit_audio_emotion_job, methods=['POST']),
+        Route('/api/emotion/jobs/{token}', get_emotion_job, methods=['GET']),
+        Route('/api/emotion/jobs/{token}/events', emotion_job_events, methods=['GET']),
+        Route('/api/hume/callback', hume_job_callback, methods=['POST']),
+        Route('/api/admin/emotion-cache', admin_emotion_cache, methods=['GET', 'DELETE']),
+        Route('/api/stats', upstream_stats, methods=['GET']),
+        Route('/api/ready', ready, methods=['GET']),
+        Route('/metrics', prometheus_metrics, methods=['GET']),
+    ],
+    # Enable CORS for all routes, matching flask_cors defaults
+    middleware=[
+        Middleware(MetricsMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])
+    ],
+    lifespan=lifespan
+)
+
+# Time spent importing this module and building the app, reported by /api/ready and /metrics
+app_built(_import_started)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    # Get port from environment variable for production environments
+    port = int(os.environ.get('PORT', 5001))
+    # Without uvicorn's own logging config its loggers go through the queue handler too
+    uvicorn.run(app, host='0.0.0.0', port=port, log_config=None)
@@ -0,0 +1,287 @@
+"""Output formats for synthesized speech: negotiation, transcoding and byte ranges.
+
+Hume returns MP3 at its own bitrate. Clients can ask for a more compact
+encoding with ``format``/``bitrate`` request parameters or the ``Accept``
+header; ``negotiate`` picks the format and ``transcode`` converts the clip
+with ffmpeg. ffmpeg is optional: without it (``HUME_FFMPEG`` names the
+binary, default ``ffmpeg`` on the PATH) only the native MP3 is offered.
+
+``byte_range`` answers single-range ``Range`` requests, so an audio element
+can start playback and seek without downloading the whole clip.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from collections import namedtuple
+
+import hume_metrics
+
+logger = logging.getLogger(__name__)
+
+# Encodings offered besides the native clip; bitrates are in kbit/s
+CODECS = {
+    "mp3": {
+        "mimetype": "audio/mpeg",
+        "extension": "mp3",
+        "args": ["-c:a", "libmp3lame", "-f", "mp3"],
+        "bitrates": (32, 192),
+        "default_bitrate": 64,
+    },
+    "opus": {
+        "mimetype": "audio/webm",
+        "extension": "webm",
+        "args": ["-c:a", "libopus", "-application", "voip", "-f", "webm"],
+        "bitrates": (12, 128),
+        "default_bitrate": 24,
+    },
+    "ogg": {
+        "mimetype": "audio/ogg",
+        "extension": "ogg",
+        "args": ["-c:a", "libopus", "-application", "voip", "-f", "ogg"],
+        "bitrates": (12, 128),
+        "default_bitrate": 24,
+    },
+    # Only the pregenerated fallback clips are WAV; it is never offered to clients
+    "wav": {
+        "mimetype": "audio/wav",
+        "extension": "wav",
+    },
+}
+
+# Names accepted for the ``format`` parameter
+FORMAT_ALIASES = {"mp3": "mp3", "mpeg": "mp3", "opus": "opus", "webm": "opus", "ogg": "ogg"}
+
+# Media types recognised in ``Accept``, mapped to codecs
+ACCEPT_TYPES = {"audio/mpeg": "mp3", "audio/mp3": "mp3", "audio/webm": "opus", "audio/ogg": "ogg"}
+
+
+class AudioFormat(namedtuple('AudioFormat', 'codec bitrate')):
+    """An output encoding; a ``bitrate`` of ``None`` means the clip exactly as Hume sent it."""
+
+    @property
+    def native(self):
+        return self.bitrate is None
+
+    @property
+    def key(self):
+        """Cache key component, e.g. ``mp3`` for the native clip or ``opus-24k``."""
+        return self.codec if self.native else f"{self.codec}-{self.bitrate}k"
+
+    @property
+    def mimetype(self):
+        return CODECS[self.codec]["mimetype"]
+
+    @property
+    def extension(self):
+        return CODECS[self.codec]["extension"]
+
+
+NATIVE_FORMAT = AudioFormat("mp3", None)
+WAV_FORMAT = AudioFormat("wav", None)
+
+
+class FormatError(ValueError):
+    """Raised for a format request that is invalid (400) or cannot be served (406)."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a ``Range`` header lies entirely outside the clip."""
+
+    def __init__(self, length):
+        super().__init__(f"Requested range not satisfiable for {length} bytes")
+        self.length = length
+
+
+def ffmpeg_path():
+    """Path of the ffmpeg binary, or ``None`` if it is not installed."""
+    return shutil.which(os.getenv('HUME_FFMPEG', 'ffmpeg'))
+
+
+_FFMPEG = ffmpeg_path()
+
+# ffmpeg processes allowed to run at once
+TRANSCODE_CONCURRENCY = int(os.getenv('HUME_TRANSCODE_CONCURRENCY', os.cpu_count() or 2))
+_transcode_slots = asyncio.Semaphore(TRANSCODE_CONCURRENCY)
+
+
+def transcoding_available():
+    return _FFMPEG is not None
+
+
+def _parse_bitrate(value, codec):
+    match = re.fullmatch(r'\s*(\d+)\s*k?\s*', str(value).lower())
+    if not match:
+        raise FormatError(f"Invalid bitrate {value!r}; expected kbit/s such as 32k")
+    bitrate = int(match.group(1))
+    low, high = CODECS[codec]["bitrates"]
+    if not low <= bitrate <= high:
+        raise FormatError(f"Bitrate for {codec} must be between {low}k and {high}k")
+    return bitrate
+
+
+def _parse_accept(header):
+    """``(media_type, q)`` pairs from an ``Accept`` header, best first."""
+    entries = []
+    for position, part in enumerate((header or '').split(',')):
+        media_type, *params = [item.strip() for item in part.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type:
+            entries.append((-quality, position, media_type.lower()))
+    return [(media_type, -quality) for quality, _, media_type in sorted(entries)]
+
+
+def negotiate(accept=None, format_name=None, bitrate=None):
+    """Choose the output format from request parameters, then ``Accept``.
+
+    An explicit ``format`` or ``bitrate`` must be servable, otherwise
+    ``FormatError`` is raised. ``Accept`` is only a preference: the first
+    acceptable type that can be produced wins, and anything else gets the
+    native clip. Requests without either get the native clip.
+    """
+    if format_name or bitrate:
+        codec = FORMAT_ALIASES.get(str(format_name or 'mp3').lower())
+        if codec is None:
+            raise FormatError(f"Unsupported format {format_name!r}; expected one of {', '.join(FORMAT_ALIASES)}")
+        if codec == "mp3" and not bitrate:
+            return NATIVE_FORMAT
+        audio_format = AudioFormat(codec, _parse_bitrate(bitrate, codec) if bitrate else CODECS[codec]["default_bitrate"])
+        if not transcoding_available():
+            raise FormatError(f"{audio_format.key} needs ffmpeg, which is not installed; only mp3 is available", 406)
+        return audio_format
+
+    for media_type, quality in _parse_accept(accept):
+        if quality <= 0:
+            continue
+        codec = ACCEPT_TYPES.get(media_type)
+        if codec == "mp3" or media_type in ('audio/*', '*/*'):
+            return NATIVE_FORMAT
+        if codec is not None and transcoding_available():
+            return AudioFormat(codec, CODECS[codec]["default_bitrate"])
+    return NATIVE_FORMAT
+
+
+async def transcode(audio, audio_format):
+    """Re-encode an MP3 clip into ``audio_format`` with ffmpeg and return the bytes.
+
+    The output goes to a temporary file rather than a pipe so the muxer can
+    seek back and write the duration and seek index, which players need to
+    seek in WebM and to show the length of VBR MP3.
+    """
+    if audio_format.native:
+        return audio
+    if not transcoding_available():
+        raise FormatError(f"{audio_format.key} needs ffmpeg, which is not installed", 406)
+    async with _transcode_slots:
+        with hume_metrics.STAGE_SECONDS.time(stage="transcode"):
+            fd, output_path = tempfile.mkstemp(suffix='.' + audio_format.extension)
+            os.close(fd)
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    _FFMPEG, '-hide_banner', '-loglevel', 'error', '-y',
+                    '-i', 'pipe:0', '-vn', '-ac', '1',
+                    *CODECS[audio_format.codec]["args"], '-b:a', f'{audio_format.bitrate}k',
+                    output_path,
+                    stdin=asyncio.subprocess.PIPE,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                _, errors = await process.communicate(audio)
+                if process.returncode != 0:
+                    raise RuntimeError(f"ffmpeg failed to produce {audio_format.key}: {errors.decode(errors='replace').strip()}")
+                with open(output_path, 'rb') as f:
+                    transcoded = f.read()
+            finally:
+                os.unlink(output_path)
+    logger.debug("Transcoded %s bytes of mp3 to %s bytes of %s", len(audio), len(transcoded), audio_format.key)
+    return transcoded
+
+
+def strip_id3(clip):
+    """``clip`` without a leading ID3v2 tag, so it can follow another MP3 clip in one stream."""
+    if len(clip) < 10 or clip[:3] != b'ID3':
+        return clip
+    # The tag size is a 28-bit "synchsafe" integer, 7 bits per byte; a footer adds 10 bytes
+    size = (clip[6] & 0x7f) << 21 | (clip[7] & 0x7f) << 14 | (clip[8] & 0x7f) << 7 | (clip[9] & 0x7f)
+    footer = 10 if clip[5] & 0x10 else 0
+    return clip[10 + size + footer:]
+
+
+def join_mp3(clips):
+    """One MP3 stream playing ``clips`` in order; only the first keeps its ID3 tag."""
+    return b''.join(clip if index == 0 else strip_id3(clip) for index, clip in enumerate(clips))
+
+
+def etag(audio):
+    """Strong validator for a clip, derived from its content."""
+    return '"' + hashlib.sha256(audio).hexdigest()[:32] + '"'
+
+
+def byte_range(range_header, if_range, tag, length):
+    """The ``(start, end)`` slice to serve for a ``Range`` header, or ``None`` for the whole clip.
+
+    Only single byte ranges are honoured. The whole clip is served, as
+    RFC 9110 allows, for multiple ranges, malformed headers, ranges whose
+    last byte precedes the first (invalid rather than unsatisfiable), and an
+    ``If-Range`` that no longer matches ``tag``. Raises
+    ``RangeNotSatisfiable`` when the range starts at or beyond the end of
+    the clip. ``end`` is exclusive.
+    """
+    if not range_header or (if_range and if_range != tag):
+        return None
+    match = re.fullmatch(r'\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*', range_header)
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        # Suffix range: the final N bytes
+        suffix = int(last)
+        if suffix == 0:
+            raise RangeNotSatisfiable(length)
+        return max(0, length - suffix), length
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= length:
+        raise RangeNotSatisfiable(length)
+    return start, min(int(last) + 1, length) if last else length
+
+
+def audio_response(audio, audio_format, download_name, range_header=None, if_range=None):
+    """Status, body and headers for serving ``audio``, honouring a byte range.
+
+    Shared by both serving modes so they answer range requests identically.
+    """
+    tag = etag(audio)
+    headers = {
+        'Content-Type': audio_format.mimetype,
+        'Content-Disposition': f'inline; filename={download_name}.{audio_format.extension}',
+        'Accept-Ranges': 'bytes',
+        'ETag': tag,
+        'Vary': 'Accept',
+        'X-TTS-Format': audio_format.key,
+    }
+    try:
+        selected = byte_range(range_header, if_range, tag, len(audio))
+    except RangeNotSatisfiable:
+        headers['Content-Range'] = f'bytes */{len(audio)}'
+        return 416, b'', headers
+    if selected is None:
+        return 200, audio, headers
+    start, end = selected
+    headers['Content-Range'] = f'bytes {start}-{end - 1}/{len(audio)}'
+    return 206, audio[start:end], headers
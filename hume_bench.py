@@ -0,0 +1,633 @@
+"""Load benchmarks for the Hume server, and its logging overhead.
+
+Drives ``/api/emotion``, ``/api/tts`` and ``/api/emotion/audio`` at one or
+more concurrency levels and reports throughput, p50/p95/p99 latency, errors,
+and the peak threads and resident memory of the server process. Every request
+uses a distinct text or recording, so the caches never answer them.
+``--upload-modes`` instead posts one long stereo recording with each audio
+upload mode and reports the bytes sent to Hume per request.
+
+With ``--compare`` the harness starts each serving mode (Flask and ASGI) with
+caches disabled. Unless ``--upstream`` is given, it also starts the local
+Hume API stand-in from ``hume_fake_api`` with ``--fake-profile``, so no API
+quota is spent. ``--save`` stores the run as JSON under ``bench_results/``,
+and ``--baseline`` compares against an earlier run, flagging regressions.
+
+``--logging`` measures how long the log statements of one emotion request and
+one TTS request take on the request thread, as they were before the move to
+lazy, queued logging and as they are now.
+
+Every started server is timed from launch until ``/api/ready`` answers
+(``ready_ms``). ``--startup`` only measures start-up: for each mode it
+times a bare import of the server module in a fresh interpreter
+(``import_ms``), the launch until ready, and the build time the server
+reports itself (``startup_ms``). The ``workers`` mode runs
+``hume_workers.py`` with ``--workers`` preforked workers; its threads and
+memory are summed over the master and its workers, with ``peak_pss_mb``
+counting pages shared between them once.
+
+Usage:
+    python hume_bench.py --compare --concurrency 10,50,200 --save
+    python hume_bench.py --compare --modes asgi --baseline latest --fail-on-regression
+    python hume_bench.py --compare --upstream http://127.0.0.1:9100
+    python hume_bench.py --compare --modes flask --upload-modes raw,preprocessed,segmented
+    python hume_bench.py --url http://localhost:5001 --requests 500 --concurrency 100
+    python hume_bench.py --logging --iterations 2000
+    python hume_bench.py --startup --modes flask,asgi,workers --iterations 5
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import glob
+import io
+import json
+import logging
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import wave
+
+import aiohttp
+import numpy as np
+
+from hume_fake_api import EMOTION_NAMES, PROFILES, load_config, parse_overrides
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(ROOT_DIR, 'bench_results')
+
+SERVERS = {
+    "flask": [sys.executable, os.path.join(ROOT_DIR, 'hume_tts_server.py')],
+    "asgi": [sys.executable, os.path.join(ROOT_DIR, 'hume_asgi.py')],
+    "workers": [sys.executable, os.path.join(ROOT_DIR, 'hume_workers.py')],
+}
+
+# Module each mode imports to build its app, for --startup
+SERVER_MODULES = {"flask": "hume_tts_server", "asgi": "hume_asgi", "workers": "hume_asgi"}
+
+# Modes measured by --compare unless --modes says otherwise
+DEFAULT_MODES = ("flask", "asgi")
+
+# "recording" posts one long stereo recording, for comparing upload modes
+ROUTES = ("emotion", "tts", "audio", "recording")
+DEFAULT_ROUTES = ("emotion", "tts", "audio")
+
+# Server settings for each upload mode of /api/emotion/audio
+UPLOAD_MODES = {
+    "raw": {"HUME_AUDIO_PREPROCESS": "0"},
+    "preprocessed": {"HUME_AUDIO_PREPROCESS": "1", "HUME_AUDIO_SEGMENT_SECONDS": "0"},
+    "segmented": {"HUME_AUDIO_PREPROCESS": "1"},
+}
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wav(seed, seconds=0.5, rate=16000):
+    """A short mono recording whose content differs for every ``seed``."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as recording:
+        recording.setnchannels(1)
+        recording.setsampwidth(2)
+        recording.setframerate(rate)
+        recording.writeframes(seed.encode('utf-8').ljust(int(seconds * rate) * 2, b'\0'))
+    return buffer.getvalue()
+
+
+@functools.lru_cache(maxsize=1)
+def _recording(seconds=90, rate=44100, silence=5):
+    """A long 16-bit stereo recording with silence at both ends, like a raw browser capture."""
+    times = np.arange(int(seconds * rate)) / rate
+    # Bursts of a voiced tone, half a second on and half off
+    signal = 0.3 * np.sin(2 * np.pi * 180 * times) * (np.sin(2 * np.pi * times) > 0)
+    signal[:silence * rate] = 0
+    signal[-silence * rate:] = 0
+    stereo = np.stack([signal, 0.8 * signal], axis=1)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as recording:
+        recording.setnchannels(2)
+        recording.setsampwidth(2)
+        recording.setframerate(rate)
+        recording.writeframes((stereo * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+async def _call(session, base_url, route, index):
+    line = f"Bench line {index} {uuid.uuid4().hex}: we must protect refugee education."
+    if route == "emotion":
+        request = session.post(f"{base_url}/api/emotion", json={"text": line})
+    elif route == "tts":
+        request = session.post(f"{base_url}/api/tts", json={"text": line, "emotion": "concern", "agentName": "Dr. Chen"})
+    else:
+        form = aiohttp.FormData()
+        audio = _recording() if route == "recording" else _wav(line)
+        form.add_field('audio', audio, filename=f"bench-{index}.wav", content_type='audio/wav')
+        request = session.post(f"{base_url}/api/emotion/audio", data=form)
+    async with request as response:
+        await response.read()
+        return response.status
+
+
+def _percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run_load(base_url, route, requests, concurrency):
+    """Send ``requests`` calls to ``route`` with ``concurrency`` in flight; return a summary."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async def one(index):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await _call(session, base_url, route, index)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    timeout = aiohttp.ClientTimeout(total=120)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "route": route,
+        "requests": requests,
+        "concurrency": concurrency,
+        "rps": requests / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p95_ms": _percentile(latencies, 0.95) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "max_ms": max(latencies) * 1000,
+        "errors": sum(count for status, count in statuses.items() if status != 200),
+        "statuses": statuses,
+    }
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _process_usage(pid):
+    """Threads, resident memory and proportional set size (MiB) of ``pid`` and its children, from /proc on Linux.
+
+    Resident memory counts pages shared by the processes once per process;
+    the proportional set size splits them between the processes sharing them.
+    """
+    usage = {"threads": 0, "rss_mb": 0.0, "pss_mb": 0.0}
+    for process in [pid] + _children(pid):
+        try:
+            with open(f"/proc/{process}/status") as f:
+                for line in f:
+                    if line.startswith("Threads:"):
+                        usage["threads"] += int(line.split()[1])
+                    elif line.startswith("VmRSS:"):
+                        usage["rss_mb"] += int(line.split()[1]) / 1024
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        usage["pss_mb"] += int(line.split()[1]) / 1024
+        except OSError:
+            pass
+    return usage
+
+
+async def _watch(pid, peak, stop):
+    while not stop.is_set():
+        usage = _process_usage(pid)
+        for name, value in usage.items():
+            peak[name] = max(peak[name], value)
+        try:
+            await asyncio.wait_for(stop.wait(), 0.1)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _wait_ready(base_url, process, timeout=30):
+    """Poll ``/api/ready`` until it answers 200 and return its body."""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            try:
+                async with session.get(f"{base_url}/api/ready") as response:
+                    if response.status == 200:
+                        return await response.json()
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.02)
+    raise RuntimeError(f"Server at {base_url} did not become ready")
+
+
+async def _upload_bytes(base_url):
+    """Audio bytes the server has sent to Hume so far, from its /metrics endpoint."""
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f"{base_url}/metrics") as response:
+            text = await response.text()
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('hume_audio_upload_bytes_total{'))
+
+
+def _server_command(mode, workers):
+    return SERVERS[mode] + (['--workers', str(workers)] if mode == "workers" else [])
+
+
+async def bench_server(mode, upstream, routes, requests, levels, upload_mode=None, workers=2):
+    """Start one server mode against ``upstream`` and measure every route at every level.
+
+    ``upload_mode`` selects one of ``UPLOAD_MODES`` for audio uploads.
+    """
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        HUME_API_BASE_URL=upstream,
+        NEXT_PUBLIC_HUME_API_KEY=os.getenv('NEXT_PUBLIC_HUME_API_KEY', 'bench'),
+        HUME_TTS_CACHE_ENABLED='0',
+        HUME_EMOTION_CACHE_ENABLED='0',
+        **UPLOAD_MODES.get(upload_mode, {})
+    )
+    launched = time.perf_counter()
+    process = subprocess.Popen(_server_command(mode, workers), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await _wait_ready(base_url, process)
+        ready_ms = (time.perf_counter() - launched) * 1000
+        results = []
+        for route in routes:
+            for concurrency in levels:
+                peak = {"threads": 0, "rss_mb": 0.0, "pss_mb": 0.0}
+                stop = asyncio.Event()
+                watcher = asyncio.ensure_future(_watch(process.pid, peak, stop))
+                uploaded = await _upload_bytes(base_url)
+                result = await run_load(base_url, route, requests, concurrency)
+                stop.set()
+                await watcher
+                result.update(mode=mode, ready_ms=ready_ms, **{f"peak_{name}": value for name, value in peak.items()})
+                if route in ("audio", "recording"):
+                    result["upload_kb"] = (await _upload_bytes(base_url) - uploaded) / requests / 1024
+                if upload_mode:
+                    result["upload_mode"] = upload_mode
+                results.append(result)
+        return results
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+# Run by a fresh interpreter to time the import of one server module on its own
+IMPORT_TIMER = "import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+
+
+async def bench_startup(modes, iterations, workers=2):
+    """Median cold start of each server mode over ``iterations`` launches, in milliseconds.
+
+    Caches and the job store live in a fresh temporary directory, as on a
+    new instance. ``import_ms`` is the import of the server module alone,
+    ``startup_ms`` the build time the server reports on ``/api/ready`` and
+    ``ready_ms`` the time from launch until ``/api/ready`` answers.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            NEXT_PUBLIC_HUME_API_KEY=os.getenv('NEXT_PUBLIC_HUME_API_KEY', 'bench'),
+            HUME_TTS_CACHE_DIR=os.path.join(directory, 'tts'),
+            HUME_EMOTION_CACHE_DB=os.path.join(directory, 'emotions.sqlite3'),
+            HUME_ASYNC_JOB_DB=os.path.join(directory, 'jobs.sqlite3')
+        )
+        for mode in modes:
+            samples = {"import_ms": [], "startup_ms": [], "ready_ms": []}
+            for _ in range(iterations):
+                timer = subprocess.run([sys.executable, '-c', IMPORT_TIMER.format(module=SERVER_MODULES[mode])],
+                                       cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True)
+                samples["import_ms"].append(float(timer.stdout.split()[-1]) * 1000)
+
+                port = _free_port()
+                launched = time.perf_counter()
+                process = subprocess.Popen(_server_command(mode, workers), cwd=ROOT_DIR, env=dict(env, PORT=str(port)),
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    body = await _wait_ready(f"http://127.0.0.1:{port}", process)
+                    samples["ready_ms"].append((time.perf_counter() - launched) * 1000)
+                    samples["startup_ms"].append(body["startupSeconds"] * 1000)
+                finally:
+                    process.terminate()
+                    process.wait(timeout=10)
+            results.append(dict(mode=mode, iterations=iterations,
+                                **{name: _percentile(values, 0.5) for name, values in samples.items()}))
+    return results
+
+
+def start_fake_upstream(profile, overrides):
+    """Start ``hume_fake_api`` on a free port; return the process and its base URL."""
+    port = _free_port()
+    command = [sys.executable, os.path.join(ROOT_DIR, 'hume_fake_api.py'), '--port', str(port), '--profile', profile]
+    for name, value in overrides.items():
+        command += ['--set', f"{name}={value}"]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Fake Hume API exited with code {process.returncode}")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Fake Hume API did not start")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(run, directory=RESULTS_DIR):
+    """Write ``run`` to ``directory`` as ``<timestamp>-<commit>.json`` and return the path."""
+    os.makedirs(directory, exist_ok=True)
+    stamp = run["started"].replace(':', '').replace('-', '')[:15]
+    path = os.path.join(directory, f"{stamp}-{run['commit'] or 'unknown'}.json")
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2, sort_keys=True)
+        f.write('\n')
+    return path
+
+
+def load_baseline(reference, directory=RESULTS_DIR):
+    """Load a stored run; ``latest`` picks the newest file in ``directory``."""
+    if reference == 'latest':
+        runs = sorted(glob.glob(os.path.join(directory, '*.json')))
+        if not runs:
+            raise FileNotFoundError(f"No stored runs in {directory}")
+        reference = runs[-1]
+    with open(reference) as f:
+        return reference, json.load(f)
+
+
+def compare_runs(baseline, results, tolerance):
+    """Print per-scenario changes against ``baseline``; return the regressed scenarios.
+
+    A scenario regresses when throughput drops, or p95 latency grows, by more
+    than ``tolerance`` (a fraction).
+    """
+    previous = {(r["mode"], r["route"], r["concurrency"], r.get("upload_mode")): r for r in baseline["results"]}
+    regressions = []
+    print(f"{'mode':>8}  {'route':>8}  {'conc':>6}  {'rps':>18}  {'p95_ms':>20}  {'rss_mb':>16}")
+    for result in results:
+        key = (result["mode"], result["route"], result["concurrency"], result.get("upload_mode"))
+        before = previous.get(key)
+        if before is None:
+            continue
+        rps_change = result["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        p95_change = result["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        regressed = rps_change < -tolerance or p95_change > tolerance
+        if regressed:
+            regressions.append(key)
+        print(f"{key[0]:>8}  {key[1]:>8}  {key[2]:>6}  "
+              f"{before['rps']:>7.1f} -> {result['rps']:>7.1f}  "
+              f"{before['p95_ms']:>8.1f} -> {result['p95_ms']:>8.1f}  "
+              f"{before.get('peak_rss_mb', 0):>6.1f} -> {result.get('peak_rss_mb', 0):>6.1f}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def _legacy_request_logs(logger, text, predictions, result, payload, start_time):
+    """Log statements of one emotion and one TTS request before the logging overhaul."""
+    logger.info(f"Detecting emotion for text: {text[:50]}...")
+    logger.info(f"Raw response (miss): {predictions}")
+    logger.info(f"Emotion detection completed in {time.time() - start_time:.2f} seconds")
+    logger.info(f"Dominant emotion: {result['dominantEmotion']}")
+
+    logger.info(f"Generating speech for Dr. Chen with emotion concern")
+    logger.info(f"Using voice ID: {payload['utterances'][0]['voice']['id']} for agent: Dr. Chen")
+    logger.info(f"Using description: concerned")
+    logger.info(f"TTS request payload: {json.dumps(payload)[:200]}...")
+    logger.info(f"Response content type: application/json")
+    logger.info(f"TTS response keys: {['generations', 'request_id']}")
+    logger.info(f"Found audio in generations[0].audio")
+    logger.info(f"TTS audio source: miss")
+    logger.info(f"TTS time to first byte: {time.time() - start_time:.3f} seconds")
+    logger.info(f"TTS request completed in {time.time() - start_time:.2f} seconds")
+
+
+def _current_request_logs(logger, text, predictions, result, payload, start_time):
+    """The same requests' log statements as the handlers make them now."""
+    from hume_logging import log_raw
+
+    logger.info("Detecting emotion for text: %s...", text[:50])
+    log_raw(logger, "Raw emotion predictions", predictions)
+    elapsed = time.time() - start_time
+    logger.info("Emotion detection completed in %.2f seconds: %s (cache %s)", elapsed, result['dominantEmotion'], "miss",
+                extra={"duration": elapsed, "dominant_emotion": result['dominantEmotion'], "cache": "miss"})
+
+    logger.info("Generating speech for %s with emotion %s", "Dr. Chen", "concern")
+    logger.debug("Using voice ID %s and description %s for agent %s", payload['utterances'][0]['voice']['id'], "concerned", "Dr. Chen")
+    log_raw(logger, "TTS request payload", payload)
+    logger.debug("Response content type: %s", "application/json")
+    logger.debug("Found audio in generations[0].audio")
+    elapsed = time.time() - start_time
+    logger.info("TTS request completed in %.2f seconds (cache %s, time to first byte %.3f seconds)", elapsed, "miss", elapsed,
+                extra={"duration": elapsed, "ttfb": elapsed, "cache": "miss"})
+
+
+def bench_logging(iterations):
+    """Per-request time spent logging on the request thread, before and after, in microseconds."""
+    from hume_logging import TEXT_FORMAT, configure_logging, stop_logging
+    from hume_aggregate import summarize
+    from hume_service import build_tts_payload
+
+    text = "We cannot accept more refugees without more funding for teachers and classrooms."
+    predictions = [{"name": name, "score": (index * 0.37) % 1} for index, name in enumerate(EMOTION_NAMES)]
+    result = summarize([{"emotions": predictions}])
+    payload = build_tts_payload(text, "concerned", "5bb7de05-c8fe-426a-8fcc-ba4fc4ce9f9c")
+    logger = logging.getLogger('hume_bench.requests')
+    root = logging.getLogger()
+
+    def measure(request_logs):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            request_logs(logger, text, predictions, result, payload, time.time())
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # Before: basicConfig-style handler writing synchronously on the calling thread
+        with open(os.path.join(directory, 'legacy.log'), 'w') as log_file:
+            stop_logging()
+            for existing in list(root.handlers):
+                root.removeHandler(existing)
+            handler = logging.StreamHandler(log_file)
+            handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+            root.addHandler(handler)
+            root.setLevel(logging.INFO)
+            results.append(("before (eager, synchronous)", measure(_legacy_request_logs)))
+            root.removeHandler(handler)
+
+        # After: lazy arguments, raw dumps off, records handed to the listener thread
+        with open(os.path.join(directory, 'current.log'), 'w') as log_file:
+            configure_logging(level='INFO', log_format='text', raw_sample_rate=0, stream=log_file)
+            results.append(("after (lazy, queued)", measure(_current_request_logs)))
+            configure_logging(level='INFO', log_format='json', raw_sample_rate=0, stream=log_file)
+            results.append(("after, JSON format", measure(_current_request_logs)))
+            configure_logging(level='INFO', log_format='text', raw_sample_rate=0.01, stream=log_file)
+            results.append(("after, 1% raw sampling", measure(_current_request_logs)))
+            stop_logging()
+
+    print(f"{'logging setup':>30}  {'us per request':>15}")
+    for name, per_request in results:
+        print(f"{name:>30}  {per_request:>15.1f}")
+
+
+def print_table(results, columns=None):
+    columns = columns or ("mode", "route", "concurrency", "rps", "p50_ms", "p95_ms", "p99_ms", "errors",
+                          "peak_threads", "peak_rss_mb", "peak_pss_mb", "ready_ms")
+    if any("upload_mode" in result for result in results):
+        columns = columns[:2] + ("upload_mode",) + columns[2:] + ("upload_kb",)
+    print("  ".join(f"{column:>12}" for column in columns))
+    for result in results:
+        cells = []
+        for column in columns:
+            value = result.get(column, "")
+            cells.append(f"{value:>12.1f}" if isinstance(value, float) else f"{value!s:>12}")
+        print("  ".join(cells))
+
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Hume server")
+    parser.add_argument('--url', help="Benchmark an already running server instead of starting one")
+    parser.add_argument('--compare', action='store_true', help="Start each serving mode and measure it")
+    parser.add_argument('--modes', default=",".join(DEFAULT_MODES),
+                        help=f"Comma-separated modes for --compare and --startup: {', '.join(SERVERS)}")
+    parser.add_argument('--workers', type=int, default=2, help="Worker processes of the workers mode")
+    parser.add_argument('--upstream', default=None,
+                        help="Hume API base URL for --compare; by default a fake upstream is started")
+    parser.add_argument('--fake-profile', default='default', choices=sorted(PROFILES),
+                        help="hume_fake_api profile for the started upstream")
+    parser.add_argument('--fake-set', action='append', metavar='NAME=VALUE',
+                        help="Override one fake upstream setting, e.g. job_duration=fixed:0.5")
+    parser.add_argument('--routes', default=",".join(DEFAULT_ROUTES),
+                        help=f"Comma-separated routes: {', '.join(ROUTES)}")
+    parser.add_argument('--upload-modes', help=f"Compare audio upload modes ({', '.join(UPLOAD_MODES)}) "
+                                               "on the recording route")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per route and concurrency level")
+    parser.add_argument('--concurrency', default="50", help="Comma-separated concurrency levels, e.g. 10,50,200")
+    parser.add_argument('--save', nargs='?', const=RESULTS_DIR, metavar='DIR',
+                        help=f"Store the run as JSON (default directory: {os.path.relpath(RESULTS_DIR)})")
+    parser.add_argument('--baseline', metavar='FILE', help="Compare against a stored run, or 'latest'")
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help="Allowed throughput drop or p95 growth before a scenario counts as a regression")
+    parser.add_argument('--fail-on-regression', action='store_true', help="Exit with status 1 on any regression")
+    parser.add_argument('--logging', action='store_true', help="Measure per-request logging overhead instead")
+    parser.add_argument('--startup', action='store_true', help="Measure import and start-up time instead")
+    parser.add_argument('--iterations', type=int,
+                        help="Simulated requests for --logging (default 2000), launches per mode for --startup (default 5)")
+    args = parser.parse_args()
+
+    if args.logging:
+        bench_logging(args.iterations or 2000)
+        return
+
+    routes = _split(args.routes)
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"Unknown routes: {', '.join(sorted(unknown))}")
+    modes = _split(args.modes)
+    if set(modes) - set(SERVERS):
+        parser.error(f"Unknown modes: {', '.join(sorted(set(modes) - set(SERVERS)))}")
+    levels = [int(level) for level in _split(args.concurrency)]
+    upload_modes = _split(args.upload_modes) if args.upload_modes else [None]
+    if args.upload_modes:
+        if set(upload_modes) - set(UPLOAD_MODES):
+            parser.error(f"Unknown upload modes: {', '.join(sorted(set(upload_modes) - set(UPLOAD_MODES)))}")
+        if args.routes == parser.get_default('routes'):
+            routes = ["recording"]
+
+    run = {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "requests": args.requests,
+        "concurrency": levels,
+    }
+    if args.startup:
+        run["iterations"] = args.iterations or 5
+        run["startup"] = asyncio.run(bench_startup(modes, run["iterations"], args.workers))
+        run["results"] = []
+        print_table(run["startup"], ("mode", "import_ms", "startup_ms", "ready_ms"))
+        if args.save:
+            print(f"\nSaved results to {os.path.relpath(save_results(run, args.save))}")
+        return
+    if args.compare:
+        fake = None
+        upstream = args.upstream
+        if not upstream:
+            overrides = parse_overrides(args.fake_set)
+            fake, upstream = start_fake_upstream(args.fake_profile, overrides)
+            run["upstream"] = {"fake_profile": args.fake_profile, "config": load_config(args.fake_profile, overrides)}
+        else:
+            run["upstream"] = {"url": upstream}
+        try:
+            results = []
+            for mode in modes:
+                for upload_mode in upload_modes:
+                    results += asyncio.run(bench_server(mode, upstream, routes, args.requests, levels, upload_mode,
+                                                        args.workers))
+        finally:
+            if fake is not None:
+                fake.terminate()
+                fake.wait(timeout=10)
+    elif args.url:
+        run["upstream"] = {"server": args.url}
+        results = [dict(asyncio.run(run_load(args.url.rstrip('/'), route, args.requests, concurrency)), mode="-")
+                   for route in routes for concurrency in levels]
+    else:
+        parser.error("Pass --compare, --url, --startup or --logging")
+
+    run["results"] = results
+    print_table(results)
+
+    regressions = []
+    if args.baseline:
+        path, baseline = load_baseline(args.baseline, args.save or RESULTS_DIR)
+        print(f"\nCompared with {os.path.relpath(path)} (commit {baseline.get('commit')}):")
+        regressions = compare_runs(baseline, results, args.tolerance)
+    if args.save:
+        print(f"\nSaved results to {os.path.relpath(save_results(run, args.save))}")
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
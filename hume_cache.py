@@ -0,0 +1,646 @@
+"""Content-addressed caches for results fetched from the Hume API.
+
+``TTSAudioCache`` keeps synthesized clips in two tiers: a bounded in-memory
+LRU for the hottest lines and an on-disk tier evicted by total size and age.
+A read-only bundle of pre-synthesized lines (see ``hume_warmup.py``) can be
+loaded beneath both tiers so known script lines never wait on synthesis.
+``EmotionResultCache`` keeps emotion predictions for a limited time in memory
+backed by SQLite, so they survive restarts. Identical concurrent requests
+share one upstream call via ``InflightRequests``.
+
+Several worker processes on one host (see ``hume_workers.py``) can share
+both caches: the on-disk tier and the SQLite file are read and written by
+all of them, and in shared mode the disk tier's size is kept in a
+memory-mapped ``SharedCounter`` so eviction sees every worker's writes.
+"""
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.hume_cache')
+
+# Pre-synthesized TTS bundle written by hume_warmup.py
+DEFAULT_BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hume_output', 'tts_bundle')
+BUNDLE_MANIFEST = 'manifest.json'
+BUNDLE_VERSION = 1
+
+# Eviction frees the disk tier down to this fraction of its budget, so a full cache is not rescanned on every write
+EVICT_LOW_WATER = float(os.getenv('HUME_TTS_CACHE_EVICT_TO', 0.9))
+
+
+def read_bundle_manifest(directory):
+    """Return the bundle manifest in ``directory``, or an empty one if missing."""
+    try:
+        with open(os.path.join(directory, BUNDLE_MANIFEST), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {"version": BUNDLE_VERSION, "entries": {}}
+    if manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported TTS bundle version: {manifest.get('version')}")
+    return manifest
+
+
+def write_bundle_manifest(directory, manifest):
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, BUNDLE_MANIFEST + '.tmp')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True, ensure_ascii=False)
+    os.replace(temp_path, os.path.join(directory, BUNDLE_MANIFEST))
+
+
+def cache_key(*parts):
+    """Stable SHA-256 key for an ordered tuple of JSON-serializable parts."""
+    encoded = json.dumps(parts, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def shared_mode():
+    """Whether caches are shared by several worker processes (``HUME_CACHE_SHARED``)."""
+    return os.getenv('HUME_CACHE_SHARED', '0') == '1'
+
+
+class LocalCounter:
+    """Integer counter private to this process."""
+
+    def __init__(self, value=0):
+        self._value = value
+        self._lock = threading.Lock()
+
+    @property
+    def value(self):
+        return self._value
+
+    def add(self, delta):
+        with self._lock:
+            self._value += delta
+            return self._value
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+
+class SharedCounter:
+    """Integer counter in a memory-mapped file, seen and updated by every process on the host.
+
+    Updates take an exclusive ``flock`` on the file, so concurrent ``add``
+    calls from different workers are never lost. ``initial`` is called to
+    compute the starting value only when the file does not exist yet.
+    Unix only.
+    """
+
+    _FORMAT = '<q'
+
+    def __init__(self, path, initial=lambda: 0):
+        import fcntl
+
+        self._fcntl = fcntl
+        self._lock = threading.Lock()
+        self.path = path
+        size = struct.calcsize(self._FORMAT)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            new = os.fstat(self._fd).st_size < size
+            if new:
+                os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+            if new:
+                struct.pack_into(self._FORMAT, self._map, 0, initial())
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # flock excludes other processes; the thread lock, other threads sharing this descriptor
+        with self._lock:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+    @property
+    def value(self):
+        return struct.unpack_from(self._FORMAT, self._map, 0)[0]
+
+    def add(self, delta):
+        with self._locked():
+            value = self.value + delta
+            struct.pack_into(self._FORMAT, self._map, 0, value)
+            return value
+
+    def set(self, value):
+        with self._locked():
+            struct.pack_into(self._FORMAT, self._map, 0, value)
+
+
+class InflightRequests:
+    """Deduplicates concurrent coroutines producing the same key.
+
+    The first caller for a key starts the producer as a task; callers
+    arriving while it is still running await the same task instead of
+    starting another one. A caller that stops waiting, for example when its
+    deadline passes, does not cancel the task, so the result still reaches
+    the others and the cache. Must be used from a single event loop.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self.joins = 0
+
+    async def run(self, key, producer):
+        """Return ``(result, joined)`` where ``joined`` is True for followers."""
+        task = self._pending.get(key)
+        if task is not None:
+            self.joins += 1
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(producer())
+        self._pending[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), False
+
+    def _finished(self, key, task):
+        if self._pending.get(key) is task:
+            del self._pending[key]
+        # Mark the exception retrieved when every caller had stopped waiting
+        if not task.cancelled():
+            task.exception()
+
+
+class MemoryLRU:
+    """Byte-bounded LRU of ``bytes`` values."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._items[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._items),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "evictions": self.evictions
+        }
+
+
+class DiskStore:
+    """Directory of content-addressed files evicted by total size and age.
+
+    Files are sharded by the first two hex characters of their key and
+    written atomically, so concurrent readers never see partial clips.
+    With ``shared`` the total size is a ``SharedCounter`` next to the
+    directory, so processes sharing it evict against one budget and only
+    the first to start scans the files; eviction recounts them. Eviction
+    runs when a write takes the total over ``max_bytes`` and frees it down
+    to ``low_water`` of that, one scan per eviction rather than per write.
+    """
+
+    def __init__(self, directory, max_bytes, max_age, suffix='', shared=False, low_water=EVICT_LOW_WATER):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.low_water = min(max(low_water, 0.0), 1.0)
+        self.max_age = max_age
+        self.suffix = suffix
+        self.hits = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._evicting = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        if shared:
+            self._size = SharedCounter(directory.rstrip(os.sep) + '.size', initial=self._total)
+        else:
+            self._size = LocalCounter(self._total())
+
+    @property
+    def size(self):
+        return self._size.value
+
+    def _total(self):
+        return sum(size for _, size, _ in self._scan())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + self.suffix)
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def _remove(self, path, size):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        self._size.add(-size)
+        with self._lock:
+            self.evictions += 1
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if self.max_age and time.time() - stat.st_mtime > self.max_age:
+            self._remove(path, stat.st_size)
+            return None
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except FileNotFoundError:
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(value)
+        try:
+            previous = os.path.getsize(path)
+        except FileNotFoundError:
+            previous = 0
+        os.replace(temp_path, path)
+        # Writes that land while another thread is evicting leave it to that eviction
+        if self._size.add(len(value) - previous) > self.max_bytes and self._evicting.acquire(blocking=False):
+            try:
+                self.evict()
+            finally:
+                self._evicting.release()
+
+    def evict(self):
+        """Drop expired files, then the oldest files until under the low-water mark."""
+        now = time.time()
+        entries = sorted(self._scan(), key=lambda entry: entry[2])
+        # Other processes and removed files make the running total drift; start again from the files
+        self._size.set(sum(size for _, size, _ in entries))
+        remaining = []
+        for path, size, mtime in entries:
+            if self.max_age and now - mtime > self.max_age:
+                self._remove(path, size)
+            else:
+                remaining.append((path, size))
+        target = self.max_bytes * self.low_water
+        for path, size in remaining:
+            if self.size <= target:
+                break
+            self._remove(path, size)
+
+    def stats(self):
+        return {
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+            "hits": self.hits,
+            "evictions": self.evictions
+        }
+
+
+class TTSAudioCache:
+    """Two-tier cache of synthesized audio keyed on the synthesis inputs.
+
+    When ``shared`` by several workers the memory tier is off unless sized
+    explicitly: each worker would hold its own copy of the same clips, while
+    the disk tier's files sit once in the operating system's page cache.
+    """
+
+    def __init__(self, directory=None, memory_bytes=None, disk_bytes=None, max_age=None, enabled=None, shared=None):
+        self.enabled = enabled if enabled is not None else os.getenv('HUME_TTS_CACHE_ENABLED', '1') != '0'
+        self.shared = shared if shared is not None else shared_mode()
+        directory = directory or os.getenv('HUME_TTS_CACHE_DIR', os.path.join(DEFAULT_CACHE_DIR, 'tts'))
+        if memory_bytes is None:
+            memory_bytes = int(float(os.getenv('HUME_TTS_CACHE_MEMORY_MB', 0 if self.shared else 64)) * 1024 * 1024)
+        if disk_bytes is None:
+            disk_bytes = int(float(os.getenv('HUME_TTS_CACHE_DISK_MB', 1024)) * 1024 * 1024)
+        if max_age is None:
+            max_age = float(os.getenv('HUME_TTS_CACHE_MAX_AGE', 7 * 24 * 3600))
+        self.memory = MemoryLRU(memory_bytes)
+        self.disk = DiskStore(directory, disk_bytes, max_age, shared=self.shared) if self.enabled else None
+        self.inflight = InflightRequests()
+        self.misses = 0
+        self.bundle = {}
+        self.bundle_hits = 0
+
+    def load_bundle(self, directory=None, preload=True):
+        """Register a pre-synthesized bundle; returns the number of clips loaded.
+
+        Bundle clips are never evicted. With ``preload`` they are also copied
+        into the memory tier while it has room.
+        """
+        if not self.enabled:
+            return 0
+        directory = directory or os.getenv('HUME_TTS_BUNDLE_DIR', DEFAULT_BUNDLE_DIR)
+        manifest = read_bundle_manifest(directory)
+        for key, entry in manifest["entries"].items():
+            path = os.path.join(directory, entry["file"])
+            if not os.path.exists(path):
+                continue
+            self.bundle[key] = path
+            if preload and self.memory.size + entry.get("bytes", 0) <= self.memory.max_bytes:
+                with open(path, 'rb') as f:
+                    self.memory.put(key, f.read())
+        if self.bundle:
+            logger.info("Loaded %s pre-synthesized clips from %s", len(self.bundle), directory)
+        return len(self.bundle)
+
+    def _read_bundle(self, key):
+        path = self.bundle.get(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def key(text, description, voice_id, output_format):
+        return cache_key("tts", text, description, voice_id, output_format)
+
+    async def lookup(self, key):
+        """Return ``(audio, tier)`` from memory or disk, or ``(None, None)``."""
+        if not self.enabled:
+            return None, None
+        audio = self.memory.get(key)
+        if audio is not None:
+            return audio, "memory"
+        audio = await asyncio.to_thread(self.disk.get, key)
+        if audio is not None:
+            # Promote to memory so the next request skips the disk read
+            self.memory.put(key, audio)
+            return audio, "disk"
+        if key in self.bundle:
+            audio = await asyncio.to_thread(self._read_bundle, key)
+            if audio is not None:
+                self.bundle_hits += 1
+                self.memory.put(key, audio)
+                return audio, "bundle"
+        return None, None
+
+    async def store(self, key, audio):
+        if not self.enabled:
+            return
+        self.memory.put(key, audio)
+        await asyncio.to_thread(self.disk.put, key, audio)
+
+    async def get_or_create(self, key, producer):
+        """Return ``(audio, source)`` where source is memory, disk, inflight or miss.
+
+        ``producer`` is an async callable that synthesizes the clip; it runs at
+        most once per key no matter how many identical requests are waiting.
+        """
+        if not self.enabled:
+            return await producer(), "miss"
+
+        audio, tier = await self.lookup(key)
+        if audio is not None:
+            return audio, tier
+
+        async def produce_and_store():
+            self.misses += 1
+            produced = await producer()
+            try:
+                await self.store(key, produced)
+            except OSError as e:
+                logger.error("Error writing TTS cache entry %s: %s", key, e)
+            return produced
+
+        audio, joined = await self.inflight.run(key, produce_and_store)
+        return audio, "inflight" if joined else "miss"
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "shared": self.shared,
+            "misses": self.misses,
+            "inflight_joins": self.inflight.joins,
+            "memory": self.memory.stats(),
+            "disk": self.disk.stats() if self.disk else None,
+            "bundle": {"entries": len(self.bundle), "hits": self.bundle_hits}
+        }
+
+
+class EmotionResultCache:
+    """TTL-bounded cache of emotion predictions for text and audio inputs.
+
+    Entries live in a bounded in-memory LRU and in a SQLite table, so results
+    survive restarts and can be shared by several processes on one host.
+    Values are the JSON-serializable segment predictions returned for one input.
+    When ``shared`` by several workers the memory tier is off unless sized
+    explicitly, so every worker reads the one SQLite table and a flush
+    applies to all of them.
+    """
+
+    # Part of every key; bumped when the shape of cached values changes so old entries are not misread
+    VALUE_VERSION = 2
+
+    def __init__(self, path=None, ttl=None, memory_entries=None, enabled=None, shared=None):
+        self.enabled = enabled if enabled is not None else os.getenv('HUME_EMOTION_CACHE_ENABLED', '1') != '0'
+        self.shared = shared if shared is not None else shared_mode()
+        self.path = path or os.getenv('HUME_EMOTION_CACHE_DB', os.path.join(DEFAULT_CACHE_DIR, 'emotions.sqlite3'))
+        self.ttl = ttl if ttl is not None else float(os.getenv('HUME_EMOTION_CACHE_TTL', 24 * 3600))
+        if memory_entries is None:
+            memory_entries = int(os.getenv('HUME_EMOTION_CACHE_MEMORY_ENTRIES', 0 if self.shared else 5000))
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.inflight = InflightRequests()
+        self.counters = {"memory_hits": 0, "store_hits": 0, "misses": 0, "expired": 0}
+        if self.enabled:
+            self._open()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS emotion_results ("
+            "key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, "
+            "created REAL NOT NULL, expires REAL NOT NULL)"
+        )
+        self._db.execute("DELETE FROM emotion_results WHERE expires < ?", (time.time(),))
+
+    @staticmethod
+    def text_key(text, model_config):
+        """Key on whitespace- and Unicode-normalized text plus the model configuration."""
+        normalized = re.sub(r'\s+', ' ', unicodedata.normalize('NFC', text)).strip()
+        return cache_key("text", EmotionResultCache.VALUE_VERSION, normalized, model_config)
+
+    @staticmethod
+    def audio_key(content_sha256, model_config):
+        return cache_key("audio", EmotionResultCache.VALUE_VERSION, content_sha256, model_config)
+
+    def _remember(self, key, kind, value, expires):
+        with self._lock:
+            self._memory[key] = (kind, value, expires)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Return the cached value for ``key``, or None if missing or expired."""
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[2] >= now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[1]
+                del self._memory[key]
+                self.counters["expired"] += 1
+
+            row = self._db.execute(
+                "SELECT kind, value, expires FROM emotion_results WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        kind, value, expires = row
+        if expires < now:
+            self.counters["expired"] += 1
+            with self._lock:
+                self._db.execute("DELETE FROM emotion_results WHERE key = ?", (key,))
+            return None
+        value = json.loads(value)
+        self._remember(key, kind, value, expires)
+        self.counters["store_hits"] += 1
+        return value
+
+    def put(self, key, kind, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        expires = now + self.ttl
+        self._remember(key, kind, value, expires)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO emotion_results (key, kind, value, created, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, json.dumps(value), now, expires)
+            )
+
+    async def get_or_create(self, key, kind, producer):
+        """Return ``(value, source)`` where source is memory/store, inflight or miss."""
+        if not self.enabled:
+            return await producer(), "miss"
+
+        cached = await asyncio.to_thread(self.get, key)
+        if cached is not None:
+            return cached, "hit"
+
+        async def produce_and_store():
+            self.counters["misses"] += 1
+            produced = await producer()
+            # Empty results usually mean the prediction could not be parsed; retry next time
+            if not produced:
+                return produced
+            try:
+                await asyncio.to_thread(self.put, key, kind, produced)
+            except sqlite3.Error as e:
+                logger.error("Error writing emotion cache entry %s: %s", key, e)
+            return produced
+
+        value, joined = await self.inflight.run(key, produce_and_store)
+        return value, "inflight" if joined else "miss"
+
+    def entries(self, kind=None, limit=50):
+        """Most recently stored entries, newest first, for inspection."""
+        if not self.enabled:
+            return []
+        query = "SELECT key, kind, value, created, expires FROM emotion_results"
+        params = ()
+        if kind:
+            query += " WHERE kind = ?"
+            params = (kind,)
+        query += " ORDER BY created DESC LIMIT ?"
+        with self._lock:
+            rows = self._db.execute(query, params + (limit,)).fetchall()
+        return [
+            {"key": key, "kind": kind, "value": json.loads(value), "created": created, "expires": expires}
+            for key, kind, value, created, expires in rows
+        ]
+
+    def flush(self, kind=None):
+        """Delete all entries, or only those of ``kind``; returns how many were stored."""
+        if not self.enabled:
+            return 0
+        with self._lock:
+            if kind:
+                self._memory = OrderedDict(
+                    (key, entry) for key, entry in self._memory.items() if entry[0] != kind
+                )
+                cursor = self._db.execute("DELETE FROM emotion_results WHERE kind = ?", (kind,))
+            else:
+                self._memory.clear()
+                cursor = self._db.execute("DELETE FROM emotion_results")
+        return cursor.rowcount
+
+    def stats(self):
+        stored = {}
+        if self.enabled:
+            with self._lock:
+                stored = dict(self._db.execute(
+                    "SELECT kind, COUNT(*) FROM emotion_results GROUP BY kind"
+                ).fetchall())
+        return dict(
+            self.counters,
+            enabled=self.enabled,
+            shared=self.shared,
+            ttl=self.ttl,
+            inflight_joins=self.inflight.joins,
+            memory_entries=len(self._memory),
+            stored_entries=stored
+        )
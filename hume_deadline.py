@@ -0,0 +1,55 @@
+"""Per-request latency budgets.
+
+A client can send ``X-Deadline`` with the time it is willing to wait, in
+milliseconds (``800``, ``800ms``) or seconds (``1.5s``). Handlers await all
+of their work, from cache lookup and job submission through polling,
+prediction fetch and transcoding, with ``within``. Once the budget is spent
+they stop waiting and answer with a fallback instead of an error. Work
+shared with other requests keeps running (see ``hume_cache.InflightRequests``)
+so its result still reaches the cache.
+"""
+import asyncio
+import os
+import re
+import time
+
+# Budget for requests without X-Deadline (milliseconds); 0 leaves them unbounded
+DEFAULT_BUDGET_MS = float(os.getenv('HUME_DEFAULT_DEADLINE_MS', 0))
+
+
+class InvalidDeadline(ValueError):
+    """Raised for an ``X-Deadline`` header that is not a positive duration."""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's budget runs out before its work is done."""
+
+    def __init__(self, budget):
+        super().__init__(f"Deadline of {budget * 1000:.0f} ms exceeded")
+        self.budget = budget
+        self.status = 504
+
+
+def parse_budget(header):
+    """Seconds allowed by an ``X-Deadline`` header, the default budget if absent, or None for no limit."""
+    if header is None or not header.strip():
+        return DEFAULT_BUDGET_MS / 1000 or None
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*(ms|s)?\s*', header.lower())
+    if not match or float(match.group(1)) <= 0:
+        raise InvalidDeadline(f"Invalid X-Deadline {header!r}; expected a positive duration such as 800ms or 1.5s")
+    value = float(match.group(1))
+    return value if match.group(2) == 's' else value / 1000
+
+
+async def within(awaitable, budget):
+    """Await ``awaitable``, raising ``DeadlineExceeded`` once ``budget`` seconds have passed."""
+    if budget is None:
+        return await awaitable
+    started = time.monotonic()
+    try:
+        return await asyncio.wait_for(awaitable, budget)
+    except asyncio.TimeoutError:
+        # Upstream timeouts raise the same error; only the budget running out is a missed deadline
+        if time.monotonic() - started < budget:
+            raise
+        raise DeadlineExceeded(budget) from None
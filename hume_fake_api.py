@@ -0,0 +1,353 @@
+"""Local stand-in for the Hume API, for load tests that must not spend quota.
+
+Implements the endpoints the server uses: ``/v0/tts`` (JSON with base64
+audio), ``/v0/tts/file``, ``/v0/tts/stream/file``, ``/v0/batch/jobs``
+(text and multipart audio), job status, predictions and completion
+callbacks. Latencies, job durations, failure rates and payload sizes come
+from a named profile and can be overridden per setting. Distributions are
+written ``kind:params``:
+
+    fixed:0.2  uniform:0.1,0.4  normal:0.2,0.05  lognormal:0.2,0.5  exponential:0.2
+
+where ``lognormal`` takes the median and the sigma of the underlying normal.
+
+Usage:
+    python hume_fake_api.py --port 9100 --profile default
+    python hume_fake_api.py --profile flaky --set job_duration=lognormal:3,0.5 --set error_rate=0.1
+
+Then start the server with ``HUME_API_BASE_URL=http://127.0.0.1:9100``.
+``GET /stats`` reports request and injected-failure counters.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import random
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger('hume_fake_api')
+
+PROFILES = {
+    # Roughly what the real API looks like from a nearby region
+    "default": {
+        "tts_latency": "lognormal:0.35,0.3",
+        "job_submit_latency": "lognormal:0.08,0.3",
+        "job_duration": "lognormal:1.2,0.35",
+        "job_seconds_per_mb": 0.5,
+        "status_latency": "lognormal:0.03,0.3",
+        "predictions_latency": "lognormal:0.05,0.3",
+        "audio_bytes": "uniform:20000,80000",
+        "emotions": 53,
+        "stream_chunk_bytes": 4096,
+        "stream_chunk_interval": "fixed:0.02",
+        "error_rate": 0.0,
+        "error_status": 503,
+        "job_failure_rate": 0.0,
+    },
+    # Near-zero upstream cost, to measure the server's own overhead
+    "fast": {
+        "tts_latency": "fixed:0",
+        "job_submit_latency": "fixed:0",
+        "job_duration": "fixed:0.05",
+        "job_seconds_per_mb": 0.0,
+        "status_latency": "fixed:0",
+        "predictions_latency": "fixed:0",
+        "audio_bytes": "fixed:16000",
+        "emotions": 53,
+        "stream_chunk_bytes": 16384,
+        "stream_chunk_interval": "fixed:0",
+        "error_rate": 0.0,
+        "error_status": 503,
+        "job_failure_rate": 0.0,
+    },
+    # Heavy tails and injected failures
+    "flaky": {
+        "tts_latency": "lognormal:0.5,0.8",
+        "job_submit_latency": "lognormal:0.15,0.6",
+        "job_duration": "lognormal:2.5,0.7",
+        "job_seconds_per_mb": 1.0,
+        "status_latency": "lognormal:0.05,0.6",
+        "predictions_latency": "lognormal:0.1,0.6",
+        "audio_bytes": "uniform:20000,200000",
+        "emotions": 53,
+        "stream_chunk_bytes": 4096,
+        "stream_chunk_interval": "exponential:0.03",
+        "error_rate": 0.05,
+        "error_status": 503,
+        "job_failure_rate": 0.05,
+    },
+}
+
+# Emotion names in the order Hume's language model reports them
+EMOTION_NAMES = (
+    "Admiration", "Adoration", "Aesthetic Appreciation", "Amusement", "Anger", "Annoyance", "Anxiety",
+    "Awe", "Awkwardness", "Boredom", "Calmness", "Concentration", "Confusion", "Contemplation",
+    "Contempt", "Contentment", "Craving", "Desire", "Determination", "Disappointment", "Disapproval",
+    "Disgust", "Distress", "Doubt", "Ecstasy", "Embarrassment", "Empathic Pain", "Enthusiasm",
+    "Entrancement", "Envy", "Excitement", "Fear", "Gratitude", "Guilt", "Horror", "Interest", "Joy",
+    "Love", "Nostalgia", "Pain", "Pride", "Realization", "Relief", "Romance", "Sadness", "Sarcasm",
+    "Satisfaction", "Shame", "Surprise (negative)", "Surprise (positive)", "Sympathy", "Tiredness", "Triumph"
+)
+
+# Audio payloads are cut from this block instead of generated per request
+_AUDIO_BLOCK = os.urandom(1024 * 1024)
+
+
+class Distribution:
+    """A non-negative random variable parsed from ``kind:params``."""
+
+    KINDS = {
+        "fixed": lambda value: value,
+        "uniform": lambda low, high: random.uniform(low, high),
+        "normal": lambda mean, sd: random.gauss(mean, sd),
+        "lognormal": lambda median, sigma: median * random.lognormvariate(0, sigma),
+        "exponential": lambda mean: random.expovariate(1 / mean) if mean > 0 else 0.0,
+    }
+
+    def __init__(self, spec):
+        self.spec = str(spec)
+        kind, _, params = self.spec.partition(':')
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown distribution {kind!r}; expected one of {', '.join(self.KINDS)}")
+        self._sample = self.KINDS[kind]
+        self._params = [float(param) for param in params.split(',') if param]
+
+    def sample(self):
+        return max(0.0, self._sample(*self._params))
+
+
+def load_config(profile="default", overrides=None):
+    """Settings for ``profile``, with ``FAKE_HUME_<SETTING>`` variables and ``overrides`` applied."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile {profile!r}; expected one of {', '.join(PROFILES)}")
+    config = dict(PROFILES[profile])
+    for name in config:
+        value = os.getenv(f"FAKE_HUME_{name.upper()}")
+        if value is not None:
+            config[name] = value
+    config.update(overrides or {})
+    for name in ("emotions", "stream_chunk_bytes", "error_status"):
+        config[name] = int(config[name])
+    for name in ("error_rate", "job_failure_rate", "job_seconds_per_mb"):
+        config[name] = float(config[name])
+    return config
+
+
+def _emotions(seed, count):
+    """Deterministic pseudo-random emotion scores for ``seed``."""
+    rng = random.Random(hashlib.sha256(seed.encode('utf-8')).digest())
+    names = [EMOTION_NAMES[index % len(EMOTION_NAMES)] + ("" if index < len(EMOTION_NAMES) else f" {index}")
+             for index in range(count)]
+    return [{"name": name, "score": round(rng.random(), 6)} for name in names]
+
+
+class FakeHumeAPI:
+    def __init__(self, config):
+        self.config = config
+        self.distributions = {
+            name: Distribution(value) for name, value in config.items()
+            if name.endswith(("_latency", "_duration", "_interval", "_bytes")) and name != "stream_chunk_bytes"
+        }
+        self.jobs = {}
+        self._ids = itertools.count()
+        self._tasks = set()
+        self.stats = {
+            "tts": 0, "tts_stream": 0, "jobs": 0, "status": 0, "predictions": 0,
+            "callbacks": 0, "injected_errors": 0, "failed_jobs": 0, "upload_bytes": 0
+        }
+
+    async def _delay(self, name):
+        await asyncio.sleep(self.distributions[name].sample())
+
+    def _injected_error(self):
+        if random.random() < self.config["error_rate"]:
+            self.stats["injected_errors"] += 1
+            return web.json_response({"message": "Injected failure"}, status=self.config["error_status"])
+        return None
+
+    def _audio(self, text):
+        size = int(self.distributions["audio_bytes"].sample())
+        header = b"ID3" + hashlib.sha256(text.encode('utf-8')).digest()
+        size = max(0, size - len(header))
+        return header + _AUDIO_BLOCK * (size // len(_AUDIO_BLOCK)) + _AUDIO_BLOCK[:size % len(_AUDIO_BLOCK)]
+
+    async def tts(self, request):
+        self.stats["tts"] += 1
+        body = await request.json()
+        await self._delay("tts_latency")
+        error = self._injected_error()
+        if error is not None:
+            return error
+        audio = self._audio(body["utterances"][0]["text"])
+        if request.path == "/v0/tts/file":
+            return web.Response(body=audio, content_type="audio/mpeg")
+        return web.json_response({
+            "generations": [{"generation_id": f"gen-{next(self._ids)}", "audio": base64.b64encode(audio).decode('ascii')}],
+            "request_id": f"req-{next(self._ids)}"
+        })
+
+    async def tts_stream(self, request):
+        self.stats["tts_stream"] += 1
+        body = await request.json()
+        await self._delay("tts_latency")
+        error = self._injected_error()
+        if error is not None:
+            return error
+        audio = self._audio(body["utterances"][0]["text"])
+        response = web.StreamResponse(headers={"Content-Type": "audio/mpeg"})
+        await response.prepare(request)
+        chunk_bytes = self.config["stream_chunk_bytes"]
+        for start in range(0, len(audio), chunk_bytes):
+            await response.write(audio[start:start + chunk_bytes])
+            await self._delay("stream_chunk_interval")
+        await response.write_eof()
+        return response
+
+    async def start_job(self, request):
+        self.stats["jobs"] += 1
+        if request.content_type.startswith('multipart/'):
+            form = await request.post()
+            upload_bytes = len(form['file'].file.read())
+            self.stats["upload_bytes"] += upload_bytes
+            job_config = json.loads(form.get('json') or '{}')
+            inputs = [form['file'].filename or "audio"]
+            kind = "burst"
+        else:
+            job_config = await request.json()
+            inputs = list(job_config.get("text") or [])
+            kind = "language"
+            upload_bytes = 0
+
+        await self._delay("job_submit_latency")
+        error = self._injected_error()
+        if error is not None:
+            return error
+
+        job_id = f"job-{next(self._ids)}"
+        loop = asyncio.get_running_loop()
+        failed = random.random() < self.config["job_failure_rate"]
+        self.jobs[job_id] = {
+            "kind": kind,
+            "inputs": inputs,
+            # Audio jobs take longer the more audio they are given
+            "done_at": loop.time() + self.distributions["job_duration"].sample()
+                       + self.config["job_seconds_per_mb"] * upload_bytes / (1024 * 1024),
+            "status": "FAILED" if failed else "COMPLETED",
+        }
+        if failed:
+            self.stats["failed_jobs"] += 1
+        callback_url = job_config.get("callback_url")
+        if callback_url:
+            task = asyncio.ensure_future(self._send_callback(job_id, callback_url))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return web.json_response({"job_id": job_id})
+
+    async def _send_callback(self, job_id, callback_url):
+        job = self.jobs[job_id]
+        await asyncio.sleep(max(0.0, job["done_at"] - asyncio.get_running_loop().time()))
+        body = {"job_id": job_id, "status": job["status"]}
+        if job["status"] == "FAILED":
+            body["failure_reason"] = "Injected job failure"
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(callback_url, json=body) as response:
+                    await response.read()
+            self.stats["callbacks"] += 1
+        except aiohttp.ClientError as e:
+            logger.warning("Callback for %s failed: %s", job_id, e)
+
+    def _job(self, request):
+        job = self.jobs.get(request.match_info['job_id'])
+        if job is None:
+            raise web.HTTPNotFound(text=json.dumps({"message": "Job not found"}), content_type="application/json")
+        return job
+
+    async def job_status(self, request):
+        self.stats["status"] += 1
+        await self._delay("status_latency")
+        job = self._job(request)
+        error = self._injected_error()
+        if error is not None:
+            return error
+        state = {"status": "IN_PROGRESS"}
+        if asyncio.get_running_loop().time() >= job["done_at"]:
+            state = {"status": job["status"]}
+            if job["status"] == "FAILED":
+                state["failure_reason"] = "Injected job failure"
+        return web.json_response({"job_id": request.match_info['job_id'], "state": state})
+
+    async def predictions(self, request):
+        self.stats["predictions"] += 1
+        await self._delay("predictions_latency")
+        job = self._job(request)
+        error = self._injected_error()
+        if error is not None:
+            return error
+        count = self.config["emotions"]
+        if job["kind"] == "language":
+            predictions = [{
+                "file": f"text-{index}.txt",
+                "models": {"language": {"grouped_predictions": [{"id": "unknown", "predictions": [
+                    {"text": text, "position": {"begin": 0, "end": len(text)}, "emotions": _emotions(text, count)}
+                ]}]}}
+            } for index, text in enumerate(job["inputs"])]
+        else:
+            predictions = [{
+                "file": job["inputs"][0],
+                "models": {"burst": {"grouped_predictions": [{"id": "unknown", "predictions": [
+                    {"time": {"begin": 0.0, "end": 1.0}, "emotions": _emotions(job["inputs"][0], count)}
+                ]}]}}
+            }]
+        return web.json_response([{
+            "source": {"type": "file" if job["kind"] == "burst" else "text"},
+            "results": {"predictions": predictions, "errors": []}
+        }])
+
+    async def get_stats(self, request):
+        return web.json_response(dict(self.stats, known_jobs=len(self.jobs), config=self.config))
+
+    def app(self):
+        application = web.Application(client_max_size=512 * 1024 * 1024)
+        application.router.add_post('/v0/tts', self.tts)
+        application.router.add_post('/v0/tts/file', self.tts)
+        application.router.add_post('/v0/tts/stream/file', self.tts_stream)
+        application.router.add_post('/v0/batch/jobs', self.start_job)
+        application.router.add_get('/v0/batch/jobs/{job_id}', self.job_status)
+        application.router.add_get('/v0/batch/jobs/{job_id}/predictions', self.predictions)
+        application.router.add_get('/stats', self.get_stats)
+        return application
+
+
+def parse_overrides(settings):
+    overrides = {}
+    for setting in settings or []:
+        name, separator, value = setting.partition('=')
+        if not separator:
+            raise ValueError(f"Expected name=value, got {setting!r}")
+        overrides[name.strip()] = value.strip()
+    return overrides
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Hume API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('FAKE_HUME_PORT', 9100)))
+    parser.add_argument('--profile', default=os.getenv('FAKE_HUME_PROFILE', 'default'), choices=sorted(PROFILES))
+    parser.add_argument('--set', action='append', metavar='NAME=VALUE', help="Override one profile setting")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    config = load_config(args.profile, parse_overrides(args.set))
+    logger.info("Fake Hume API (%s profile) on http://%s:%s: %s", args.profile, args.host, args.port, config)
+    web.run_app(FakeHumeAPI(config).app(), host=args.host, port=args.port, print=None, access_log=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,395 @@
+"""Shared, long-lived HTTP client layer for all calls to the Hume API.
+
+Every upstream request goes through one process-wide ``HumeHTTPClient`` so
+TCP/TLS connections to api.hume.ai are kept alive and reused instead of being
+rebuilt per request. The client owns one ``aiohttp`` session per upstream
+endpoint, each with its own connection limit, and all of them run on a single
+event loop: a background loop that the synchronous Flask handlers submit work
+to, or the server's own loop in ASGI mode (``hume_asgi``). Each endpoint also
+has a ``CircuitBreaker`` that refuses new work while the endpoint is failing,
+and every call is admitted by one ``hume_scheduler.UpstreamScheduler`` so
+speech is sent ahead of emotion analysis when the quota is tight.
+
+``aiohttp`` is only imported when the first session is opened, so importing
+this module does not slow down server start.
+"""
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+
+import hume_metrics
+import hume_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def _env_number(name, default, cast=float):
+    return cast(os.getenv(name, default))
+
+
+def default_config():
+    """Pool settings, read from the environment when the client is built.
+
+    Reading them lazily means values from ``.env.local`` apply even though
+    this module is imported before ``load_dotenv`` runs.
+    """
+    return {
+        "base_url": os.getenv('HUME_API_BASE_URL', 'https://api.hume.ai').rstrip('/'),
+        # Maximum open connections per upstream endpoint
+        "limits": {
+            "tts": _env_number('HUME_TTS_MAX_CONNECTIONS', 20, int),
+            "batch": _env_number('HUME_BATCH_MAX_CONNECTIONS', 10, int),
+        },
+        # Timeouts (seconds) applied to every upstream request
+        "connect_timeout": _env_number('HUME_HTTP_CONNECT_TIMEOUT', 5),
+        "read_timeout": _env_number('HUME_HTTP_READ_TIMEOUT', 30),
+        "total_timeout": _env_number('HUME_HTTP_TOTAL_TIMEOUT', 60),
+        # How long resolved DNS entries and idle connections are kept
+        "dns_cache_ttl": _env_number('HUME_HTTP_DNS_TTL', 300, int),
+        "keepalive_timeout": _env_number('HUME_HTTP_KEEPALIVE', 60),
+        # Consecutive failures that open an endpoint's circuit, and seconds before it is probed again
+        "breaker_failures": _env_number('HUME_BREAKER_FAILURES', 5, int),
+        "breaker_cooldown": _env_number('HUME_BREAKER_COOLDOWN', 10),
+        "scheduler": hume_scheduler.default_config(),
+    }
+
+
+class HumeAPIError(Exception):
+    """Raised when the Hume API answers with a non-200 status."""
+
+    def __init__(self, status, message):
+        super().__init__(f"Hume API returned status {status}: {message}")
+        self.status = status
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f"Hume '{endpoint}' endpoint is failing; calls resume in {retry_after:.1f} seconds")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        self.status = 503
+
+
+class CircuitBreaker:
+    """Stops sending new work to an endpoint that keeps failing, then probes it.
+
+    ``failure_threshold`` consecutive failures (5xx and 429 responses,
+    connection errors, timeouts) open the circuit and calls are refused with
+    ``CircuitOpen`` for ``cooldown`` seconds. The next call is then let
+    through as a probe: its success closes the circuit, its failure opens it
+    for another cooldown. A probe that ends without either, such as a 4xx
+    answer or a cancelled call, is released so the next call probes again;
+    one that never reports back is replaced after ``probe_timeout`` seconds.
+    Must be used from a single event loop.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _GAUGE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, endpoint, failure_threshold, cooldown, probe_timeout=60, clock=time.monotonic):
+        self.endpoint = endpoint
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_started = None
+        self.counters = {"opened": 0, "rejected": 0}
+        hume_metrics.CIRCUIT_STATE.set(0, endpoint=endpoint)
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.warning("Circuit for Hume '%s' endpoint is now %s", self.endpoint, state)
+            self.state = state
+            hume_metrics.CIRCUIT_STATE.set(self._GAUGE_VALUES[state], endpoint=self.endpoint)
+
+    def retry_after(self):
+        """Seconds until the next call will be let through, 0 if it would be now."""
+        if self.state == self.OPEN:
+            return max(0.0, self.opened_at + self.cooldown - self.clock())
+        if self.state == self.HALF_OPEN and self._probe_started is not None:
+            return max(0.0, self._probe_started + self.probe_timeout - self.clock())
+        return 0.0
+
+    def available(self):
+        """Whether a call would be let through now; unlike ``before_call`` it claims nothing."""
+        return self.retry_after() == 0.0
+
+    def check(self):
+        """Raise ``CircuitOpen`` if a call would be refused now, without claiming the probe."""
+        if not self.available():
+            self.counters["rejected"] += 1
+            raise CircuitOpen(self.endpoint, self.retry_after())
+
+    def before_call(self):
+        """Admit one call, raising ``CircuitOpen`` while the circuit is open or a probe is out.
+
+        Returns a probe token when the call is the probe, else None.
+        """
+        if self.state == self.CLOSED:
+            return None
+        self.check()
+        self._set_state(self.HALF_OPEN)
+        self._probe_started = self.clock()
+        return self._probe_started
+
+    def release_probe(self, probe):
+        """Let the next call probe again after the probe ``probe`` ended without a verdict."""
+        if probe is not None and self._probe_started == probe:
+            self._probe_started = None
+
+    def record_success(self):
+        self.failures = 0
+        self._probe_started = None
+        self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe_started = None
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = self.clock()
+            self.counters["opened"] += 1
+            self._set_state(self.OPEN)
+
+    def stats(self):
+        return dict(self.counters, state=self.state, consecutive_failures=self.failures,
+                    retry_after=round(self.retry_after(), 3))
+
+
+class HumeHTTPClient:
+    """Keeps one pooled ``aiohttp`` session per Hume endpoint.
+
+    Sessions are created lazily on first use so they bind to the event loop
+    that actually runs the requests. Failed responses count against the
+    endpoint's circuit breaker. Successful ones close it for ``tts``; batch
+    status polls keep answering while jobs stall, so the ``batch`` breaker
+    is only reset by completed jobs (see ``hume_jobs.JobTracker``).
+    """
+
+    # Endpoints whose successful responses reset their circuit breaker
+    SUCCESS_RESETS_BREAKER = ("tts",)
+
+    # Priority class of calls that do not name one
+    DEFAULT_PRIORITIES = {"tts": "tts", "batch": "text"}
+
+    def __init__(self, api_key, **overrides):
+        config = dict(default_config(), **overrides)
+        self.api_key = api_key
+        self.base_url = config["base_url"]
+        self.limits = config["limits"]
+        self.dns_cache_ttl = config["dns_cache_ttl"]
+        self.keepalive_timeout = config["keepalive_timeout"]
+        self.timeouts = {
+            "total": config["total_timeout"],
+            "sock_connect": config["connect_timeout"],
+            "sock_read": config["read_timeout"],
+        }
+        self._sessions = {}
+        self.breakers = {
+            endpoint: CircuitBreaker(endpoint, config["breaker_failures"], config["breaker_cooldown"],
+                                     probe_timeout=config["total_timeout"])
+            for endpoint in self.limits
+        }
+        # The scheduler hands out the connection slots, so the connector never queues calls itself
+        self.scheduler = hume_scheduler.UpstreamScheduler(self.limits, **config["scheduler"])
+        self._stats = {
+            endpoint: {"requests": 0, "connections_created": 0, "connections_reused": 0}
+            for endpoint in self.limits
+        }
+
+    def _trace_config(self, endpoint):
+        import aiohttp
+
+        stats = self._stats[endpoint]
+        breaker = self.breakers[endpoint]
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            stats["requests"] += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            stats["connections_created"] += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            stats["connections_reused"] += 1
+
+        async def on_request_end(session, ctx, params):
+            status = params.response.status
+            hume_metrics.UPSTREAM_RESPONSES.inc(endpoint=endpoint, status=status)
+            if status >= 500 or status == 429:
+                breaker.record_failure()
+            elif endpoint in self.SUCCESS_RESETS_BREAKER:
+                # A 4xx is the caller's mistake, but the endpoint did answer
+                breaker.record_success()
+
+        async def on_request_exception(session, ctx, params):
+            if isinstance(params.exception, asyncio.TimeoutError):
+                hume_metrics.UPSTREAM_TIMEOUTS.inc(kind="http")
+            if isinstance(params.exception, (asyncio.TimeoutError, aiohttp.ClientError)):
+                breaker.record_failure()
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        return trace_config
+
+    def session(self, endpoint):
+        """Return the pooled session for ``endpoint``, creating it on first use."""
+        session = self._sessions.get(endpoint)
+        if session is None or session.closed:
+            import aiohttp
+
+            connector = aiohttp.TCPConnector(
+                limit=self.limits[endpoint],
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            session = aiohttp.ClientSession(
+                base_url=self.base_url,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(**self.timeouts),
+                headers={"X-Hume-Api-Key": self.api_key},
+                trace_configs=[self._trace_config(endpoint)]
+            )
+            self._sessions[endpoint] = session
+            logger.info("Opened pooled Hume session for '%s' (limit %s)", endpoint, self.limits[endpoint])
+        return session
+
+    @contextlib.asynccontextmanager
+    async def request(self, endpoint, method, path, guarded=True, priority=None, **kwargs):
+        """Issue a request on the pooled session once the scheduler admits it; use as ``async with``.
+
+        ``priority`` is the scheduler class of the call, by default the
+        endpoint's own. Guarded requests start new work: they are refused
+        with ``CircuitOpen`` while the endpoint's circuit is open and with
+        ``hume_scheduler.Overloaded`` when their queue is full. Requests
+        following up on work already started, such as job status polls,
+        pass ``guarded=False`` and only wait their turn.
+        """
+        breaker = self.breakers[endpoint]
+        if guarded:
+            # Refuse at once rather than queue for an endpoint that is failing
+            breaker.check()
+        await self.scheduler.acquire(priority or self.DEFAULT_PRIORITIES[endpoint], endpoint,
+                                     shed=guarded and hume_scheduler.shed_load.get())
+        probe = None
+        try:
+            if guarded:
+                probe = breaker.before_call()
+            async with self.session(endpoint).request(method, path, **kwargs) as response:
+                yield response
+        finally:
+            # A probe that got no success or failure recorded (a 4xx, a batch answer, a cancellation) must not
+            # keep the circuit refusing calls until probe_timeout
+            breaker.release_probe(probe)
+            self.scheduler.release(endpoint)
+
+    async def get_json(self, endpoint, path, guarded=True, priority=None):
+        async with self.request(endpoint, "GET", path, guarded=guarded, priority=priority) as response:
+            if response.status != 200:
+                raise HumeAPIError(response.status, await response.text())
+            return await response.json()
+
+    async def post_json(self, endpoint, path, payload=None, data=None, priority=None):
+        async with self.request(endpoint, "POST", path, json=payload, data=data, priority=priority) as response:
+            if response.status != 200:
+                raise HumeAPIError(response.status, await response.text())
+            return await response.json()
+
+    def stats(self):
+        """Request and connection counters per endpoint, with reuse ratio."""
+        report = {}
+        for endpoint, stats in self._stats.items():
+            opened = stats["connections_created"] + stats["connections_reused"]
+            report[endpoint] = dict(
+                stats,
+                reuse_ratio=round(stats["connections_reused"] / opened, 3) if opened else 0.0,
+                circuit=self.breakers[endpoint].stats()
+            )
+        return report
+
+    async def close(self):
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+
+
+class BackgroundLoop:
+    """A single event loop running in a daemon thread.
+
+    Synchronous code submits coroutines with ``run`` and blocks for the
+    result, so pooled sessions always live on the same loop.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._loop.run_forever, name="hume-loop", daemon=True)
+                thread.start()
+            return self._loop
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+
+_client = None
+_client_lock = threading.Lock()
+_background_loop = BackgroundLoop()
+
+
+def get_client():
+    """Return the process-wide Hume client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HumeHTTPClient(api_key=os.getenv('NEXT_PUBLIC_HUME_API_KEY'))
+        return _client
+
+
+async def _in_context(context, coro):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def run_async(coro, timeout=None):
+    """Run ``coro`` on the shared background loop and return its result.
+
+    The caller's context variables (such as the metrics route label) are
+    visible to ``coro``.
+    """
+    return _background_loop.run(_in_context(contextvars.copy_context(), coro), timeout)
+
+
+def iterate_async(agen):
+    """Drive an async generator on the shared loop from synchronous code.
+
+    Items are pulled one at a time, so a slow consumer applies backpressure
+    all the way to the upstream socket. Closing the returned generator (for
+    example when the client disconnects) closes ``agen`` as well.
+    """
+    try:
+        while True:
+            try:
+                yield run_async(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_async(agen.aclose())
@@ -0,0 +1,262 @@
+"""Durable store for asynchronous emotion jobs.
+
+Clients that cannot hold a connection open for a whole Hume batch job submit
+their work to ``/api/emotion/jobs`` or ``/api/emotion/audio/jobs`` and get a
+token back at once. The server runs the work in the background and records
+its progress here: the request, the ids of the upstream Hume jobs once they
+are submitted, and finally the result or the error. Clients read the job
+with ``GET /api/emotion/jobs/<token>`` or subscribe to its ``/events``
+stream.
+
+Jobs live in a SQLite table next to the emotion cache, and audio uploads
+are spooled to files until they reach Hume. A restarted server therefore
+resumes waiting on jobs Hume is already running instead of starting over.
+Finished jobs are kept for ``HUME_ASYNC_JOB_TTL`` seconds.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from hume_cache import DEFAULT_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, COMPLETED, FAILED = "queued", "running", "completed", "failed"
+FINISHED = (COMPLETED, FAILED)
+
+# ``request``, ``upstream`` and ``result`` hold the decoded JSON columns
+Job = namedtuple('Job', 'token kind status request upstream result error created updated')
+
+
+def job_body(job):
+    """The JSON body describing ``job`` to clients."""
+    body = {"token": job.token, "kind": job.kind, "status": job.status, "created": job.created, "updated": job.updated}
+    if job.status == COMPLETED:
+        body["result"] = job.result
+    elif job.status == FAILED:
+        body["error"] = job.error
+    return body
+
+
+def sse_event(event, data):
+    """One Server-Sent Events message with a JSON ``data`` line."""
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode('utf-8')
+
+
+class JobStore:
+    """SQLite-backed record of asynchronous jobs and their spooled uploads.
+
+    Blocking methods may be called from any thread; coroutines must run on
+    the event loop that runs the jobs, so ``watch`` can be woken by
+    ``update``.
+    """
+
+    def __init__(self, path=None, ttl=None, spool_dir=None):
+        self.path = path or os.getenv('HUME_ASYNC_JOB_DB', os.path.join(DEFAULT_CACHE_DIR, 'jobs.sqlite3'))
+        self.spool_dir = spool_dir or os.path.join(os.path.dirname(self.path), 'job_uploads')
+        self.ttl = ttl if ttl is not None else float(os.getenv('HUME_ASYNC_JOB_TTL', 3600))
+        self._lock = threading.Lock()
+        self._changed = {}
+        self.counters = {"submitted": 0, "completed": 0, "failed": 0, "resumed": 0}
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS async_jobs ("
+            "token TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, request TEXT NOT NULL, "
+            "upstream TEXT, result TEXT, error TEXT, created REAL NOT NULL, updated REAL NOT NULL, "
+            "expires REAL)"
+        )
+        self.purge()
+
+    def _spool_path(self, token):
+        return os.path.join(self.spool_dir, token)
+
+    def purge(self):
+        """Delete finished jobs past their retention time; returns how many."""
+        with self._lock:
+            tokens = [token for token, in self._db.execute(
+                "SELECT token FROM async_jobs WHERE expires < ?", (time.time(),)
+            )]
+            self._db.executemany("DELETE FROM async_jobs WHERE token = ?", [(token,) for token in tokens])
+        for token in tokens:
+            self.drop_upload(token)
+        return len(tokens)
+
+    def spool(self, chunks):
+        """Write an upload to a spool file chunk by chunk, before its job exists.
+
+        Returns the file's path, for ``create``, and the upload's SHA-256 hex
+        digest and size. The file is removed if reading ``chunks`` fails.
+        """
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.spool_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path, digest.hexdigest(), size
+
+    async def aspool(self, chunks):
+        """``spool`` for an async iterator of chunks; the file writes run in a worker thread."""
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.spool_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return temp_path, digest.hexdigest(), size
+
+    def create(self, kind, request, upload=None, spooled=None):
+        """Record a new queued job and return its token.
+
+        ``upload`` bytes are spooled to disk; ``spooled`` is a file from ``spool`` to take over instead.
+        """
+        token = secrets.token_urlsafe(16)
+        if spooled is not None:
+            os.replace(spooled, self._spool_path(token))
+        elif upload is not None:
+            temp_path = self._spool_path(token) + '.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(upload)
+            os.replace(temp_path, self._spool_path(token))
+        now = time.time()
+        try:
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO async_jobs (token, kind, status, request, created, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                    (token, kind, QUEUED, json.dumps(request), now, now)
+                )
+        except BaseException:
+            # No job row means nothing would ever purge the upload
+            self.drop_upload(token)
+            raise
+        self.counters["submitted"] += 1
+        return token
+
+    def get(self, token):
+        """The job for ``token``, or None if it is unknown or has expired."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT token, kind, status, request, upstream, result, error, created, updated, expires "
+                "FROM async_jobs WHERE token = ?", (token,)
+            ).fetchone()
+        if row is None or (row[9] is not None and row[9] < time.time()):
+            return None
+        return self._job(row[:9])
+
+    @staticmethod
+    def _job(row):
+        token, kind, status, request, upstream, result, error, created, updated = row
+        return Job(
+            token, kind, status, json.loads(request),
+            json.loads(upstream) if upstream else None,
+            json.loads(result) if result else None,
+            error, created, updated
+        )
+
+    def unfinished(self):
+        """Jobs that were queued or running, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT token, kind, status, request, upstream, result, error, created, updated "
+                "FROM async_jobs WHERE status IN (?, ?) ORDER BY created", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._job(row) for row in rows]
+
+    def _write(self, token, status, upstream, result, error):
+        now = time.time()
+        expires = now + self.ttl if status in FINISHED else None
+        with self._lock:
+            self._db.execute(
+                "UPDATE async_jobs SET status = ?, upstream = COALESCE(?, upstream), result = ?, error = ?, "
+                "updated = ?, expires = ? WHERE token = ?",
+                (status, json.dumps(upstream) if upstream is not None else None,
+                 json.dumps(result) if result is not None else None, error, now, expires, token)
+            )
+
+    async def update(self, token, status, upstream=None, result=None, error=None):
+        """Move a job to ``status`` and wake everyone watching it."""
+        await asyncio.to_thread(self._write, token, status, upstream, result, error)
+        if status == COMPLETED:
+            self.counters["completed"] += 1
+        elif status == FAILED:
+            self.counters["failed"] += 1
+        changed = self._changed.pop(token, None)
+        if changed is not None:
+            changed.set()
+
+    def read_upload(self, token):
+        """The spooled upload of ``token``, or None if it is gone."""
+        try:
+            with open(self._spool_path(token), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def drop_upload(self, token):
+        try:
+            os.unlink(self._spool_path(token))
+        except FileNotFoundError:
+            pass
+
+    async def watch(self, token, poll_interval=1.0, heartbeat=15.0):
+        """Yield the job each time its status changes, until it finishes.
+
+        Updates made by this process wake the watcher at once; the store is
+        also re-read every ``poll_interval`` seconds so jobs run by another
+        process on the same host are followed too. ``None`` is yielded when
+        nothing changed for ``heartbeat`` seconds, so callers can keep the
+        connection alive.
+        """
+        last_status = None
+        quiet_since = time.monotonic()
+        while True:
+            job = await asyncio.to_thread(self.get, token)
+            if job is None:
+                return
+            if job.status != last_status:
+                last_status = job.status
+                quiet_since = time.monotonic()
+                yield job
+                if job.status in FINISHED:
+                    return
+            elif time.monotonic() - quiet_since >= heartbeat:
+                quiet_since = time.monotonic()
+                yield None
+            # A change landing before the event is registered is picked up by the next poll
+            changed = self._changed.setdefault(token, asyncio.Event())
+            try:
+                await asyncio.wait_for(changed.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            by_status = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM async_jobs GROUP BY status"
+            ).fetchall())
+        return dict(self.counters, stored=by_status)
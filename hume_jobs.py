@@ -0,0 +1,449 @@
+"""Helpers for the Hume batch job lifecycle: submit, wait, fetch predictions.
+
+Text emotion requests share these helpers so that one job can carry any
+number of texts, and predictions are mapped back to their inputs in order.
+``JobTracker`` watches every outstanding job from one polling loop (or wakes
+waiters from Hume's completion callback), and ``EmotionCoalescer`` packs
+concurrent single-text requests into shared jobs.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+
+import hume_metrics
+
+logger = logging.getLogger(__name__)
+
+# Language model configuration used for every text emotion job
+LANGUAGE_MODELS = {
+    "language": {
+        "granularity": "utterance",
+        "identify_speakers": False,
+        "sentiment": {},  # Enable sentiment analysis
+        "toxicity": {}    # Enable toxicity analysis
+    }
+}
+
+# Granularities a text request may ask for; utterance is the default
+TEXT_GRANULARITIES = ("utterance", "sentence", "passage")
+
+
+def language_models(granularity="utterance"):
+    """``LANGUAGE_MODELS`` with the language model set to ``granularity``."""
+    if granularity == "utterance":
+        return LANGUAGE_MODELS
+    return {"language": dict(LANGUAGE_MODELS["language"], granularity=granularity)}
+
+
+# Burst model configuration used for every audio emotion job
+BURST_MODELS = {
+    "burst": {}  # Only use burst model for audio
+}
+
+# Hume names text inputs text-0.txt, text-1.txt, ... in submission order
+TEXT_SOURCE_PATTERN = re.compile(r'text-(\d+)')
+
+
+class JobFailed(Exception):
+    """Raised when a batch job fails or does not complete in time."""
+
+
+class JobTimeout(JobFailed):
+    """Raised when a batch job does not complete in time."""
+
+
+async def submit_job(client, payload=None, data=None):
+    """Start a batch job from a JSON payload or multipart form and return its id.
+
+    Multipart forms carry recordings, which the scheduler serves after text.
+    """
+    priority = "text" if data is None else "audio"
+    with hume_metrics.STAGE_SECONDS.time(stage="job_submit"):
+        job_response = await client.post_json("batch", "/v0/batch/jobs", payload=payload, data=data, priority=priority)
+    job_id = job_response.get('job_id')
+
+    if not job_id:
+        raise JobFailed("No job_id returned from Hume API")
+
+    logger.info("Job started with ID: %s", job_id)
+    return job_id
+
+
+async def fetch_predictions(client, job_id, priority="text"):
+    logger.debug("Fetching results for job: %s", job_id)
+    with hume_metrics.STAGE_SECONDS.time(stage="prediction_fetch"):
+        return await client.get_json("batch", f"/v0/batch/jobs/{job_id}/predictions", guarded=False, priority=priority)
+
+
+class _TrackedJob:
+    __slots__ = ("future", "timeout", "deadline", "interval", "next_poll")
+
+    def __init__(self, future, timeout, deadline, interval, next_poll):
+        self.future = future
+        self.timeout = timeout
+        self.deadline = deadline
+        self.interval = interval
+        self.next_poll = next_poll
+
+
+class JobTracker:
+    """Single place that learns when outstanding batch jobs finish.
+
+    Waiters register a job id and await its completion. One background task
+    polls every due job together, backing each one off from ``initial_interval``
+    towards ``max_interval`` while it is still running. When ``callback_url``
+    is set, jobs are submitted with it so Hume can call ``notify`` the moment
+    they finish; polling then only runs at ``max_interval`` as a safety net.
+    Completed and timed-out jobs are reported to the client's ``batch``
+    circuit breaker. Status polls are small and free room once a job is
+    done, so they are scheduled in the ``text`` class whatever the job.
+    Must be used from a single event loop.
+    """
+
+    # Callbacks for jobs not yet registered are kept briefly, up to this many
+    MAX_EARLY_NOTIFICATIONS = 1000
+
+    def __init__(self, client_factory, callback_url=None, initial_interval=None,
+                 max_interval=None, backoff=None, timeout=None):
+        self.client_factory = client_factory
+        self.callback_url = callback_url if callback_url is not None else os.getenv('HUME_CALLBACK_URL') or None
+        self.initial_interval = initial_interval or float(os.getenv('HUME_JOB_POLL_INITIAL', 0.25))
+        self.max_interval = max_interval or float(os.getenv('HUME_JOB_POLL_MAX', 2))
+        self.backoff = backoff or float(os.getenv('HUME_JOB_POLL_BACKOFF', 1.5))
+        self.timeout = timeout or float(os.getenv('HUME_JOB_TIMEOUT', 15))
+        if self.callback_url:
+            self.initial_interval = self.max_interval
+        self._jobs = {}
+        self._early = {}
+        self._wakeup = None
+        self._runner = None
+        self.counters = {"completed": 0, "failed": 0, "timed_out": 0, "polls": 0, "callbacks": 0}
+
+    def with_callback(self, config):
+        """Return the job configuration with the callback URL added when enabled."""
+        if not self.callback_url:
+            return config
+        return dict(config, callback_url=self.callback_url)
+
+    async def submit(self, payload=None, data=None):
+        if payload is not None:
+            payload = self.with_callback(payload)
+        return await submit_job(self.client_factory(), payload=payload, data=data)
+
+    async def wait(self, job_id, timeout=None):
+        """Wait for ``job_id`` to finish, raising ``JobFailed`` on failure or timeout."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        now = loop.time()
+
+        early = self._early.pop(job_id, None)
+        if early is not None:
+            self._resolve(future, *early)
+        else:
+            timeout = timeout or self.timeout
+            self._jobs[job_id] = _TrackedJob(
+                future,
+                timeout=timeout,
+                deadline=now + timeout,
+                interval=self.initial_interval,
+                next_poll=now + self.initial_interval
+            )
+            self._ensure_runner()
+        try:
+            with hume_metrics.STAGE_SECONDS.time(stage="poll_wait"):
+                await future
+        except JobTimeout:
+            hume_metrics.UPSTREAM_TIMEOUTS.inc(kind="job")
+            raise
+        finally:
+            self._jobs.pop(job_id, None)
+
+    async def run(self, payload=None, data=None):
+        """Submit a job, wait for it and return its predictions."""
+        job_id = await self.submit(payload=payload, data=data)
+        await self.wait(job_id)
+        return await fetch_predictions(self.client_factory(), job_id, "text" if data is None else "audio")
+
+    def notify(self, job_id, status, failure_reason=None):
+        """Record a completion callback for ``job_id``; returns False if it was unknown."""
+        self.counters["callbacks"] += 1
+        job = self._jobs.pop(job_id, None)
+        if job is None:
+            # The callback beat the waiter's registration; keep it for a moment
+            if len(self._early) >= self.MAX_EARLY_NOTIFICATIONS:
+                self._early.pop(next(iter(self._early)))
+            self._early[job_id] = (status, failure_reason)
+            return False
+        logger.info("Job %s callback received with status %s", job_id, status)
+        self._resolve(job.future, status, failure_reason)
+        return True
+
+    def _resolve(self, future, status, failure_reason=None):
+        if future.done():
+            return
+        if status == "COMPLETED":
+            self.counters["completed"] += 1
+            self.client_factory().breakers["batch"].record_success()
+            future.set_result(None)
+        else:
+            self.counters["failed"] += 1
+            future.set_exception(JobFailed(f"Job failed: {failure_reason or 'Unknown'}"))
+
+    def _ensure_runner(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        # Polls serve every waiter, so they are not attributed to the route that started the runner
+        hume_metrics.current_route.set("job_poller")
+        loop = asyncio.get_running_loop()
+        while self._jobs:
+            now = loop.time()
+            due = [(job_id, job) for job_id, job in self._jobs.items() if job.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self._poll(job_id, job) for job_id, job in due))
+                continue
+
+            next_poll = min(job.next_poll for job in self._jobs.values())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), next_poll - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _poll(self, job_id, job):
+        loop = asyncio.get_running_loop()
+        if job.future.done():
+            self._jobs.pop(job_id, None)
+            return
+        if loop.time() >= job.deadline:
+            self._jobs.pop(job_id, None)
+            self.counters["timed_out"] += 1
+            self.client_factory().breakers["batch"].record_failure()
+            job.future.set_exception(JobTimeout(f"Job did not complete within {job.timeout:g} seconds"))
+            return
+
+        self.counters["polls"] += 1
+        try:
+            job_details = await self.client_factory().get_json("batch", f"/v0/batch/jobs/{job_id}", guarded=False)
+        except Exception as e:
+            self._jobs.pop(job_id, None)
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+
+        state = job_details.get('state', {})
+        status = state.get('status')
+        logger.debug("Job %s status: %s, next check in %.2fs", job_id, status, job.interval)
+
+        if status in ("COMPLETED", "FAILED"):
+            self._jobs.pop(job_id, None)
+            if status == "FAILED":
+                logger.error("Job failed: %s", state.get('failure_reason', 'Unknown'))
+            self._resolve(job.future, status, state.get('failure_reason'))
+            return
+
+        job.next_poll = loop.time() + job.interval
+        job.interval = min(job.interval * self.backoff, self.max_interval)
+
+    def stats(self):
+        return dict(
+            self.counters,
+            outstanding=len(self._jobs),
+            mode="callback" if self.callback_url else "polling"
+        )
+
+
+async def run_text_job(tracker, texts, models=LANGUAGE_MODELS):
+    """Analyse ``texts`` in one batch job and return the raw predictions."""
+    return await tracker.run(payload={"text": list(texts), "models": models})
+
+
+def _segments(grouped, position_key):
+    """Every prediction of every group as ``{"begin", "end", "emotions"}``, plus the text if any."""
+    segments = []
+    for group in grouped:
+        for prediction in group.get('predictions') or []:
+            bounds = prediction.get(position_key) or {}
+            segment = {"begin": bounds.get('begin'), "end": bounds.get('end'), "emotions": prediction.get('emotions', [])}
+            if 'text' in prediction:
+                segment["text"] = prediction['text']
+            segments.append(segment)
+    return segments
+
+
+def split_text_predictions(predictions, count):
+    """Return the language model segments (see ``_segments``) for each of ``count`` inputs, in order.
+
+    There is one segment per sentence, utterance or passage, depending on the
+    granularity of the job. Inputs are matched by their ``text-<n>`` file name
+    when Hume provides one and by position otherwise. Inputs without
+    predictions get an empty list.
+    """
+    per_input = [[] for _ in range(count)]
+    position = 0
+    for source in predictions or []:
+        for prediction in source.get('results', {}).get('predictions', []):
+            match = TEXT_SOURCE_PATTERN.search(prediction.get('file') or '')
+            index = int(match.group(1)) if match else position
+            position += 1
+            if index >= count:
+                continue
+
+            grouped = prediction.get('models', {}).get('language', {}).get('grouped_predictions', [])
+            per_input[index] = _segments(grouped, 'position')
+    return per_input
+
+
+def extract_burst_segments(predictions, offset=0.0):
+    """Return one segment per vocal burst of the first audio prediction, with times in seconds.
+
+    ``offset`` is added to the burst times, for recordings analysed in pieces.
+    """
+    for source in predictions or []:
+        for prediction in source.get('results', {}).get('predictions', []):
+            grouped = prediction.get('models', {}).get('burst', {}).get('grouped_predictions', [])
+            segments = _segments(grouped, 'time')
+            for segment in segments:
+                for key in ("begin", "end"):
+                    if segment[key] is not None:
+                        segment[key] += offset
+            return segments
+    return []
+
+
+class EmotionCoalescer:
+    """Micro-batches concurrent single-text emotion requests into shared jobs.
+
+    Requests arriving within ``window`` seconds of the first queued one, up to
+    ``max_batch_size`` distinct texts, are submitted together in one
+    ``run_text_job`` call and each caller receives its own slice of the
+    predictions. Must be used from a single event loop.
+    """
+
+    # Upper bounds (milliseconds) of the queueing delay histogram buckets
+    DELAY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500)
+
+    def __init__(self, tracker, models=LANGUAGE_MODELS, window=None, max_batch_size=None):
+        if window is None:
+            window = float(os.getenv('HUME_EMOTION_COALESCE_WINDOW_MS', 50)) / 1000
+        if max_batch_size is None:
+            max_batch_size = int(os.getenv('HUME_EMOTION_COALESCE_MAX_BATCH', 16))
+        self.tracker = tracker
+        self.models = models
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+        self.batch_sizes = {}
+        self.delay_histogram = {bucket: 0 for bucket in self.DELAY_BUCKETS_MS + ('+Inf',)}
+        self.delay_total = 0.0
+        self.delay_max = 0.0
+        self.requests = 0
+
+    async def analyze(self, text):
+        """Queue ``text`` for the next batch and return its segment predictions."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future, time.monotonic()))
+        self.requests += 1
+
+        distinct_texts = len({queued_text for queued_text, _, _ in self._pending})
+        if self.window <= 0 or distinct_texts >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        return await future
+
+    def _record_delay(self, delay):
+        delay_ms = delay * 1000
+        self.delay_total += delay
+        self.delay_max = max(self.delay_max, delay)
+        for bucket in self.DELAY_BUCKETS_MS:
+            if delay_ms <= bucket:
+                self.delay_histogram[bucket] += 1
+                return
+        self.delay_histogram['+Inf'] += 1
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        now = time.monotonic()
+        for _, _, queued_at in batch:
+            self._record_delay(now - queued_at)
+        # Keep a reference so the batch task is not garbage collected mid-flight
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch):
+        # Identical texts in one window share a slot in the job
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        self.batch_sizes[len(texts)] = self.batch_sizes.get(len(texts), 0) + 1
+        logger.info("Submitting coalesced emotion batch of %s texts for %s requests", len(texts), len(batch))
+
+        try:
+            predictions = await run_text_job(self.tracker, texts, self.models)
+            per_text = dict(zip(texts, split_text_predictions(predictions, len(texts))))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, future, _ in batch:
+            if not future.done():
+                future.set_result(per_text[text])
+
+    def stats(self):
+        batches = sum(self.batch_sizes.values())
+        delayed = sum(self.delay_histogram.values())
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch_size": self.max_batch_size,
+            "requests": self.requests,
+            "batches": batches,
+            "batch_sizes": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            "queue_delay_ms": {
+                "avg": round(self.delay_total * 1000 / delayed, 3) if delayed else 0.0,
+                "max": round(self.delay_max * 1000, 3),
+                "histogram": {str(bucket): count for bucket, count in self.delay_histogram.items()}
+            }
+        }
+
+
+if __name__ == '__main__':
+    # Fake Hume callback sender for exercising callback mode locally, e.g.
+    #   python hume_jobs.py http://localhost:5001/api/hume/callback <job_id>
+    import argparse
+    import json
+    import urllib.request
+
+    parser = argparse.ArgumentParser(description="Send a fake Hume job completion callback")
+    parser.add_argument('url', help="Callback endpoint, including any token query parameter")
+    parser.add_argument('job_id')
+    parser.add_argument('--status', default="COMPLETED", choices=["COMPLETED", "FAILED"])
+    parser.add_argument('--failure-reason', default=None)
+    args = parser.parse_args()
+
+    body = {"job_id": args.job_id, "status": args.status}
+    if args.failure_reason:
+        body["failure_reason"] = args.failure_reason
+    callback = urllib.request.Request(
+        args.url,
+        data=json.dumps(body).encode('utf-8'),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with urllib.request.urlopen(callback) as response:
+        print(response.status, response.read().decode('utf-8'))
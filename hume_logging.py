@@ -0,0 +1,131 @@
+"""Non-blocking, structured logging for the Hume server.
+
+``configure_logging`` routes every record through a queue: request threads
+and the event loop only enqueue the record, and a listener thread formats it
+and does the I/O. Messages use lazy %-style arguments, so nothing is
+formatted for records that are filtered out, and formatting of the rest
+happens on the listener thread.
+
+Raw upstream payloads are large; ``log_raw`` only renders them when the
+logger is at DEBUG or, at INFO, for a sampled fraction of calls
+(``HUME_LOG_RAW_SAMPLE_RATE``).
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+
+import hume_metrics
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through ``extra``
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'route'}
+
+_listener = None
+
+# Fraction of raw payloads logged at INFO when DEBUG is off
+RAW_SAMPLE_RATE = 0.0
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, including the route and any ``extra`` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "route": getattr(record, 'route', None),
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RouteFilter(logging.Filter):
+    """Tags records with the route being served, from ``hume_metrics.current_route``."""
+
+    def filter(self, record):
+        record.route = hume_metrics.current_route.get()
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues records unformatted so the message is built on the listener thread.
+
+    The stock ``QueueHandler`` formats every record before enqueueing it, which
+    puts the formatting cost back on the caller. Only tracebacks are rendered
+    here, because they reference frames that may change once the caller moves on.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level=None, log_format=None, raw_sample_rate=None, stream=None):
+    """Install the queue handler on the root logger and start its listener.
+
+    ``HUME_LOG_LEVEL`` (default ``INFO``), ``HUME_LOG_FORMAT`` (``text`` or
+    ``json``) and ``HUME_LOG_RAW_SAMPLE_RATE`` (default ``0``) are used unless
+    overridden. Calling it again replaces the previous setup.
+    """
+    global _listener, RAW_SAMPLE_RATE
+    level = level or os.getenv('HUME_LOG_LEVEL', 'INFO').upper()
+    log_format = log_format or os.getenv('HUME_LOG_FORMAT', 'text')
+    if raw_sample_rate is None:
+        raw_sample_rate = float(os.getenv('HUME_LOG_RAW_SAMPLE_RATE', 0))
+    RAW_SAMPLE_RATE = raw_sample_rate
+
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JSONFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    handler.addFilter(RouteFilter())
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return _listener
+
+
+def stop_logging():
+    """Flush queued records and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
+
+def log_raw(logger, label, payload):
+    """Log a raw payload at DEBUG, or at INFO for a sampled fraction of calls.
+
+    ``payload`` is only rendered if the record is actually emitted.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, payload)
+        return
+    if RAW_SAMPLE_RATE > 0 and random.random() < RAW_SAMPLE_RATE and logger.isEnabledFor(logging.INFO):
+        logger.info("%s (sampled): %s", label, payload)
@@ -0,0 +1,235 @@
+"""Process-wide metrics rendered in the Prometheus text exposition format.
+
+Both serving modes expose ``REGISTRY.render()`` at ``GET /metrics``. Metrics
+are labelled with the route being served, which handlers set through
+``current_route``; ``run_async`` carries it onto the background loop, so
+upstream calls made on behalf of a request are attributed to its route.
+"""
+import contextlib
+import contextvars
+import threading
+import time
+
+# Route label for everything recorded while serving a request
+current_route = contextvars.ContextVar('hume_route', default='none')
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if 'route' in self.labelnames and 'route' not in labels:
+            labels = dict(labels, route=current_route.get())
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count. A missing ``route`` label is filled from ``current_route``."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, or is read from ``callback`` at render time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    @contextlib.contextmanager
+    def track(self, **labels):
+        """Count the enclosed block as in progress."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def render(self):
+        lines = self._header()
+        if self.callback is not None:
+            lines.append(f"{self.name} {_format_value(self.callback())}")
+            return lines
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Cumulative histogram of observed values, in seconds for latencies."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][index] += 1
+                    break
+            series["sum"] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock duration of the enclosed block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    labels = _format_labels(self.labelnames, key, [("le", _format_value(bound))])
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text format (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stages: job_submit, poll_wait, prediction_fetch, base64_decode, transcode, preprocess, response_write, upload_read
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'hume_stage_duration_seconds', 'Time spent in each stage of request handling', ['route', 'stage']
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'hume_request_duration_seconds', 'Time to handle a request, up to the response being returned', ['route']
+))
+REQUESTS = REGISTRY.register(Counter(
+    'hume_requests_total', 'Requests served, by response status', ['route', 'status']
+))
+REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'hume_requests_in_flight', 'Requests currently being handled', ['route']
+))
+UPSTREAM_RESPONSES = REGISTRY.register(Counter(
+    'hume_upstream_responses_total', 'Responses received from the Hume API, by status code',
+    ['route', 'endpoint', 'status']
+))
+UPSTREAM_TIMEOUTS = REGISTRY.register(Counter(
+    'hume_upstream_timeouts_total', 'Hume API requests (kind=http) and batch jobs (kind=job) that timed out',
+    ['route', 'kind']
+))
+FALLBACK_RESPONSES = REGISTRY.register(Counter(
+    'hume_fallback_responses_total',
+    'Responses that fell back to the neutral emotion or a pregenerated clip, by reason (error, empty, circuit_open, deadline or overloaded)',
+    ['route', 'reason']
+))
+CIRCUIT_STATE = REGISTRY.register(Gauge(
+    'hume_circuit_state', 'Circuit breaker state per Hume endpoint: 0 closed, 1 half-open, 2 open', ['endpoint']
+))
+SCHEDULER_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'hume_scheduler_queue_depth', 'Hume calls waiting for admission, by priority class (tts, text or audio)', ['priority']
+))
+SCHEDULER_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'hume_scheduler_wait_seconds', 'Time Hume calls waited for admission, by priority class', ['priority']
+))
+SCHEDULER_REJECTED = REGISTRY.register(Counter(
+    'hume_scheduler_rejected_total', 'Hume calls refused under overload, by priority class and reason (queue_full or max_wait)',
+    ['route', 'priority', 'reason']
+))
+RESPOND_SPECULATION = REGISTRY.register(Counter(
+    'hume_respond_speculation_total', 'Neutral takes synthesized during /api/respond analysis, by outcome (used or discarded)',
+    ['route', 'outcome']
+))
+AUDIO_UPLOAD_BYTES = REGISTRY.register(Counter(
+    'hume_audio_upload_bytes_total', 'Audio bytes sent to Hume for burst analysis, by upload mode (raw, preprocessed or segmented)',
+    ['route', 'mode']
+))
+AUDIO_ANALYSIS_SECONDS = REGISTRY.register(Histogram(
+    'hume_audio_analysis_seconds', 'Time from the start of an audio upload to its merged emotions, by upload mode',
+    ['route', 'mode']
+))
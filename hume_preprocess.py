@@ -0,0 +1,215 @@
+"""Preprocessing of player recordings before they are uploaded for burst analysis.
+
+Recordings arrive as whatever the browser produced: often long, stereo, 44.1
+or 48 kHz WAVs with silence at both ends. ``prepare_recording`` decodes one,
+downmixes it to mono, resamples it to ``HUME_AUDIO_TARGET_RATE``, trims the
+leading and trailing silence and re-encodes it as 16-bit WAV. Recordings
+longer than ``HUME_AUDIO_SEGMENT_SECONDS`` are cut into segments, at the
+quietest point near each boundary, so they can be analysed as parallel jobs.
+
+PCM WAV is decoded directly; other containers need ffmpeg (see
+``hume_audio``). Recordings that cannot be decoded raise ``UnsupportedAudio``
+and are uploaded unchanged by the caller.
+"""
+import asyncio
+import io
+import logging
+import os
+import subprocess
+import wave
+from collections import namedtuple
+
+import numpy as np
+
+from hume_audio import ffmpeg_path
+
+logger = logging.getLogger(__name__)
+
+# Sample rate recordings are reduced to; higher rates only add upload bytes
+TARGET_RATE = int(os.getenv('HUME_AUDIO_TARGET_RATE', 16000))
+
+# Frames this many dB below the loudest frame count as silence
+SILENCE_DB = float(os.getenv('HUME_AUDIO_SILENCE_DB', 40))
+
+# Silence kept before the first and after the last sound (seconds)
+SILENCE_PAD = float(os.getenv('HUME_AUDIO_SILENCE_PAD', 0.25))
+
+# Recordings longer than this are split into parallel jobs; 0 disables splitting
+SEGMENT_SECONDS = float(os.getenv('HUME_AUDIO_SEGMENT_SECONDS', 30))
+
+# How far from each nominal boundary a quieter cut point is searched for (seconds)
+SEGMENT_SEARCH_SECONDS = 2.0
+
+# Length of the frames used to measure loudness (seconds)
+FRAME_SECONDS = 0.02
+
+# Recordings decoded at once; each holds a few times its raw size in memory
+PREPROCESS_CONCURRENCY = int(os.getenv('HUME_AUDIO_PREPROCESS_CONCURRENCY', os.cpu_count() or 2))
+_preprocess_slots = asyncio.Semaphore(PREPROCESS_CONCURRENCY)
+
+# ``segments`` holds ``(offset_seconds, wav_bytes)`` pairs; it is empty for a silent recording
+PreparedRecording = namedtuple('PreparedRecording', 'segments rate duration trimmed_seconds')
+
+
+class UnsupportedAudio(ValueError):
+    """Raised for recordings that cannot be decoded here."""
+
+
+def settings():
+    """Settings that change the prepared audio, for use in cache keys."""
+    return {
+        "rate": TARGET_RATE,
+        "silence_db": SILENCE_DB,
+        "silence_pad": SILENCE_PAD,
+        "segment_seconds": SEGMENT_SECONDS,
+    }
+
+
+def _decode_wav(audio):
+    with wave.open(io.BytesIO(audio), 'rb') as recording:
+        channels = recording.getnchannels()
+        width = recording.getsampwidth()
+        rate = recording.getframerate()
+        frames = recording.readframes(recording.getnframes())
+    if width == 1:
+        samples, offset, scale = np.frombuffer(frames, dtype=np.uint8), 128, 128
+    elif width == 2:
+        samples, offset, scale = np.frombuffer(frames, dtype='<i2'), 0, 2 ** 15
+    elif width == 3:
+        # Widen each little-endian 24-bit sample to 32 bits, keeping its sign
+        raw = np.frombuffer(frames[:len(frames) // 3 * 3], dtype=np.uint8).reshape(-1, 3)
+        widened = np.zeros((len(raw), 4), dtype=np.uint8)
+        widened[:, 1:] = raw
+        samples, offset, scale = widened.view('<i4').ravel(), 0, 2 ** 31
+    elif width == 4:
+        samples, offset, scale = np.frombuffer(frames, dtype='<i4'), 0, 2 ** 31
+    else:
+        raise UnsupportedAudio(f"Unsupported WAV sample width: {width} bytes")
+    # Downmix while converting, so no full-size float copy of every channel is made
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels)
+    mono = samples[:, 0].astype(np.float32) if channels == 1 else samples.mean(axis=1, dtype=np.float32)
+    return (mono - offset) / scale, rate
+
+
+def _decode_with_ffmpeg(audio, ffmpeg):
+    # ffmpeg downmixes and resamples on the way out
+    result = subprocess.run(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+         '-vn', '-ac', '1', '-ar', str(TARGET_RATE), '-f', 's16le', 'pipe:1'],
+        input=audio, capture_output=True
+    )
+    if result.returncode != 0:
+        raise UnsupportedAudio(f"ffmpeg could not decode the recording: {result.stderr.decode(errors='replace').strip()}")
+    return np.frombuffer(result.stdout, dtype='<i2').astype(np.float32) / 32768, TARGET_RATE
+
+
+def decode(audio):
+    """Mono samples in [-1, 1] and the sample rate; channels are averaged."""
+    if audio[:4] == b'RIFF' and audio[8:12] == b'WAVE':
+        try:
+            return _decode_wav(audio)
+        except (wave.Error, EOFError) as e:
+            # Float and extensible WAVs are left to ffmpeg
+            logger.debug("Could not decode WAV directly: %s", e)
+    ffmpeg = ffmpeg_path()
+    if ffmpeg is None:
+        raise UnsupportedAudio("Only PCM WAV can be decoded without ffmpeg")
+    return _decode_with_ffmpeg(audio, ffmpeg)
+
+
+def resample(samples, rate, target_rate):
+    """Linear resampling of mono ``samples``, with a box filter against aliasing when downsampling."""
+    if rate <= target_rate or not len(samples):
+        return samples, rate
+    width = int(round(rate / target_rate))
+    if width > 1:
+        samples = np.convolve(samples, np.full(width, 1 / width, dtype=np.float32), mode='same')
+    # Interpolate between neighbouring samples; only output-sized arrays are allocated
+    positions = np.arange(int(len(samples) * target_rate / rate)) * (rate / target_rate)
+    index = positions.astype(np.int64)
+    fraction = (positions - index).astype(np.float32)
+    following = np.minimum(index + 1, len(samples) - 1)
+    return samples[index] * (1 - fraction) + samples[following] * fraction, target_rate
+
+
+def frame_levels(samples, rate):
+    """Loudness of each ``FRAME_SECONDS`` frame in dBFS."""
+    frame = min(len(samples), max(1, int(rate * FRAME_SECONDS)))
+    if not frame:
+        return np.full(1, -200.0)
+    count = len(samples) // frame
+    frames = samples[:count * frame].reshape(count, frame)
+    return 20 * np.log10(np.sqrt(np.mean(frames ** 2, axis=1)) + 1e-10)
+
+
+def trim_silence(samples, rate):
+    """Drop leading and trailing silence, keeping ``SILENCE_PAD`` seconds around the sound."""
+    levels = frame_levels(samples, rate)
+    loud = np.flatnonzero(levels > levels.max() - SILENCE_DB)
+    # A recording without any signal at all has nothing to analyse
+    if not len(loud) or levels.max() < -90:
+        return samples[:0]
+    frame = max(1, int(rate * FRAME_SECONDS))
+    pad = int(SILENCE_PAD * rate)
+    start = max(0, loud[0] * frame - pad)
+    end = min(len(samples), (loud[-1] + 1) * frame + pad)
+    return samples[start:end]
+
+
+def split_segments(samples, rate, segment_seconds=None):
+    """Cut ``samples`` into ``(offset_seconds, samples)`` pieces of about ``segment_seconds``.
+
+    Each cut is moved to the quietest frame within ``SEGMENT_SEARCH_SECONDS``
+    of its nominal position so a vocal burst is not split in two.
+    """
+    segment_seconds = SEGMENT_SECONDS if segment_seconds is None else segment_seconds
+    duration = len(samples) / rate
+    if segment_seconds <= 0 or duration <= segment_seconds * 1.25:
+        return [(0.0, samples)]
+    frame = max(1, int(rate * FRAME_SECONDS))
+    levels = frame_levels(samples, rate)
+    search = int(SEGMENT_SEARCH_SECONDS / FRAME_SECONDS)
+    cuts = [0]
+    for nominal in np.arange(segment_seconds, duration - segment_seconds / 4, segment_seconds):
+        centre = int(nominal / FRAME_SECONDS)
+        low, high = max(cuts[-1] // frame + 1, centre - search), min(len(levels), centre + search + 1)
+        if low >= high:
+            continue
+        cuts.append((low + int(np.argmin(levels[low:high]))) * frame)
+    cuts.append(len(samples))
+    return [(start / rate, samples[start:end]) for start, end in zip(cuts, cuts[1:]) if end > start]
+
+
+def encode_wav(samples, rate):
+    """16-bit mono PCM WAV bytes for ``samples`` in [-1, 1]."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as recording:
+        recording.setnchannels(1)
+        recording.setsampwidth(2)
+        recording.setframerate(rate)
+        recording.writeframes((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def prepare_recording(audio, segment_seconds=None):
+    """Decode, downmix, resample, trim and split a recording for upload.
+
+    CPU-bound; async code should call ``prepare`` instead.
+    """
+    mono, rate = decode(audio)
+    mono, rate = resample(mono, rate, TARGET_RATE)
+    trimmed = trim_silence(mono, rate)
+    segments = [(offset, encode_wav(piece, rate)) for offset, piece in split_segments(trimmed, rate, segment_seconds)
+                if len(piece)]
+    return PreparedRecording(
+        segments=segments,
+        rate=rate,
+        duration=len(trimmed) / rate,
+        trimmed_seconds=(len(mono) - len(trimmed)) / rate
+    )
+
+
+async def prepare(audio):
+    """``prepare_recording`` in a worker thread, at most ``PREPROCESS_CONCURRENCY`` at a time."""
+    async with _preprocess_slots:
+        return await asyncio.to_thread(prepare_recording, audio)
@@ -0,0 +1,239 @@
+"""Priority scheduling of calls to the Hume API.
+
+Interactive speech and background emotion analysis share one Hume quota and
+the same pooled connections. ``UpstreamScheduler`` admits every upstream
+call before it is sent. A token bucket holds the request rate to
+``HUME_RATE_LIMIT``, and free connection slots of an endpoint go to the most
+urgent waiting call. Waiting calls sit in one bounded queue per priority
+class, and classes are served strictly in the order of ``PRIORITIES``.
+
+New work is refused with ``Overloaded`` when its class's queue is full or it
+has waited ``HUME_QUEUE_MAX_WAIT`` seconds. The routes turn that into a fast
+429 with ``Retry-After`` rather than queueing without bound. Calls following
+up on work already started, such as job status polls, wait their turn but
+are never refused, and neither is background work that clears
+``shed_load``.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import time
+from collections import deque
+
+import hume_metrics
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, most urgent first: speech being played, then text emotion, then recordings
+PRIORITIES = ("tts", "text", "audio")
+
+# Cleared by background work, which waits for capacity instead of being refused
+shed_load = contextvars.ContextVar('hume_shed_load', default=True)
+
+
+def default_config():
+    """Scheduler settings, read from the environment when the client is built."""
+    return {
+        # Requests per second allowed to Hume across all endpoints, and how many may be sent at once
+        "rate": float(os.getenv('HUME_RATE_LIMIT', 50)),
+        "burst": float(os.getenv('HUME_RATE_BURST', 50)),
+        # Calls that may wait per priority class before new ones are refused
+        "queue_limits": {
+            "tts": int(os.getenv('HUME_QUEUE_LIMIT_TTS', 64)),
+            "text": int(os.getenv('HUME_QUEUE_LIMIT_TEXT', 64)),
+            "audio": int(os.getenv('HUME_QUEUE_LIMIT_AUDIO', 16)),
+        },
+        # Seconds new work may wait for admission before it is refused; 0 waits as long as it takes
+        "max_wait": float(os.getenv('HUME_QUEUE_MAX_WAIT', 10)),
+    }
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing more work than the scheduler allows."""
+
+    def __init__(self, priority, retry_after):
+        super().__init__(f"Too many '{priority}' calls waiting for Hume; retry in {retry_after:.0f} seconds")
+        self.priority = priority
+        self.retry_after = retry_after
+        self.status = 429
+
+
+class _Waiter:
+    __slots__ = ("future", "endpoint", "enqueued")
+
+    def __init__(self, future, endpoint, enqueued):
+        self.future = future
+        self.endpoint = endpoint
+        self.enqueued = enqueued
+
+
+class UpstreamScheduler:
+    """Token bucket and per-class queues in front of the Hume endpoints.
+
+    ``slots`` maps each endpoint to the connections it may use at once; a
+    call holds its slot from ``acquire`` until ``release``. A ``rate`` of 0
+    disables rate limiting, leaving only the connection slots. Must be used
+    from a single event loop.
+    """
+
+    def __init__(self, slots, rate, burst, queue_limits, max_wait=0, clock=time.monotonic):
+        self.slots = dict(slots)
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.queue_limits = queue_limits
+        self.max_wait = max_wait
+        self.clock = clock
+        self._tokens = self.burst
+        self._refilled = clock()
+        self._queues = {priority: deque() for priority in PRIORITIES}
+        self._in_flight = dict.fromkeys(self.slots, 0)
+        self._wakeup = None
+        self._dispatcher = None
+        self.counters = {
+            priority: {"admitted": 0, "rejected": 0, "timed_out": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            for priority in PRIORITIES
+        }
+
+    def _refill(self):
+        if self.rate <= 0:
+            return
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def _has_token(self):
+        return self.rate <= 0 or self._tokens >= 1
+
+    def _has_slot(self, endpoint):
+        return self._in_flight[endpoint] < self.slots[endpoint]
+
+    def _admit(self, priority, endpoint, enqueued):
+        if self.rate > 0:
+            self._tokens -= 1
+        self._in_flight[endpoint] += 1
+        waited = self.clock() - enqueued
+        counters = self.counters[priority]
+        counters["admitted"] += 1
+        counters["wait_seconds"] += waited
+        counters["max_wait_seconds"] = max(counters["max_wait_seconds"], waited)
+        hume_metrics.SCHEDULER_WAIT_SECONDS.observe(waited, priority=priority)
+
+    def _set_depth(self, priority):
+        hume_metrics.SCHEDULER_QUEUE_DEPTH.set(len(self._queues[priority]), priority=priority)
+
+    def retry_after(self, priority):
+        """Whole seconds after which a new ``priority`` call would likely be admitted."""
+        ahead = sum(len(self._queues[p]) for p in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if self.rate <= 0:
+            return 1
+        return max(1, math.ceil((ahead + 1 - self._tokens) / self.rate))
+
+    def _reject(self, priority, reason):
+        self.counters[priority]["rejected" if reason == "queue_full" else "timed_out"] += 1
+        hume_metrics.SCHEDULER_REJECTED.inc(priority=priority, reason=reason)
+        logger.warning("Refusing '%s' call to Hume (%s, %s queued)", priority, reason, len(self._queues[priority]))
+        return Overloaded(priority, self.retry_after(priority))
+
+    async def acquire(self, priority, endpoint, shed=True):
+        """Wait until a ``priority`` call to ``endpoint`` may be sent; pair with ``release``.
+
+        With ``shed`` the call is refused with ``Overloaded`` when its queue
+        is full or it waits longer than ``max_wait``.
+        """
+        self._refill()
+        more_urgent = PRIORITIES[:PRIORITIES.index(priority) + 1]
+        if not any(self._queues[p] for p in more_urgent) and self._has_token() and self._has_slot(endpoint):
+            self._admit(priority, endpoint, self.clock())
+            return
+
+        queue = self._queues[priority]
+        if shed and len(queue) >= self.queue_limits[priority]:
+            raise self._reject(priority, "queue_full")
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), endpoint, self.clock())
+        queue.append(waiter)
+        self._set_depth(priority)
+        self._wake()
+        try:
+            if shed and self.max_wait > 0:
+                await asyncio.wait_for(waiter.future, self.max_wait)
+            else:
+                await waiter.future
+        except BaseException as e:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Admitted just as the caller gave up; hand the slot on
+                self.release(endpoint)
+            else:
+                waiter.future.cancel()
+                try:
+                    queue.remove(waiter)
+                except ValueError:
+                    pass
+                self._set_depth(priority)
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._reject(priority, "max_wait") from None
+            raise
+
+    def release(self, endpoint):
+        """Give back the connection slot taken by ``acquire``."""
+        self._in_flight[endpoint] -= 1
+        if self._wakeup is not None and any(self._queues.values()):
+            self._wakeup.set()
+
+    def _wake(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        self._wakeup.set()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def _next(self):
+        """The most urgent waiter whose endpoint has a free slot, removed from its queue."""
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            for waiter in queue:
+                if not waiter.future.done() and self._has_slot(waiter.endpoint):
+                    queue.remove(waiter)
+                    self._set_depth(priority)
+                    return priority, waiter
+        return None
+
+    async def _dispatch(self):
+        while any(self._queues.values()):
+            self._refill()
+            chosen = self._next() if self._has_token() else None
+            if chosen is not None:
+                priority, waiter = chosen
+                self._admit(priority, waiter.endpoint, waiter.enqueued)
+                waiter.future.set_result(None)
+                continue
+
+            # Sleep until a token is due, or until a slot is released or a call arrives
+            delay = None if self._has_token() else (1 - self._tokens) / self.rate
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self):
+        self._refill()
+        classes = {}
+        for priority in PRIORITIES:
+            counters = self.counters[priority]
+            classes[priority] = dict(
+                admitted=counters["admitted"],
+                rejected=counters["rejected"],
+                timed_out=counters["timed_out"],
+                queued=len(self._queues[priority]),
+                queue_limit=self.queue_limits[priority],
+                average_wait=round(counters["wait_seconds"] / counters["admitted"], 4) if counters["admitted"] else 0.0,
+                max_wait=round(counters["max_wait_seconds"], 4)
+            )
+        return {
+            "rate": self.rate,
+            "tokens": round(self._tokens, 2) if self.rate > 0 else None,
+            "in_flight": dict(self._in_flight),
+            "classes": classes
+        }
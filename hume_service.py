@@ -0,0 +1,904 @@
+"""Shared core of the Hume TTS and emotion server.
+
+Everything both serving modes need lives here: the TTS and emotion caches,
+the batch job tracker and coalescers, the durable job store, voice and
+fallback selection, synthesis, emotion analysis, asynchronous jobs and the
+``/api/respond`` pipeline. The Flask app in ``hume_tts_server`` and the ASGI
+app in ``hume_asgi`` import it and add only their HTTP layer, so neither
+mode builds the other's framework, and a worker process loads the caches
+once.
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+import re
+import time
+from hume_http import CircuitOpen, HumeAPIError, get_client
+from hume_jobs import (
+    BURST_MODELS,
+    TEXT_GRANULARITIES,
+    EmotionCoalescer,
+    JobTracker,
+    extract_burst_segments,
+    fetch_predictions,
+    language_models,
+    run_text_job,
+    split_text_predictions
+)
+from hume_aggregate import InvalidOptions, parse_options, summarize
+from hume_cache import EmotionResultCache, TTSAudioCache
+from hume_job_store import COMPLETED, FAILED, RUNNING, JobStore, job_body, sse_event
+from hume_audio import NATIVE_FORMAT, WAV_FORMAT, join_mp3, strip_id3, transcode, transcoding_available
+from hume_deadline import DeadlineExceeded, within
+from hume_scheduler import Overloaded, shed_load
+import hume_metrics
+from hume_logging import configure_logging, log_raw
+
+# Load environment variables; python-dotenv is only imported when there is a file to read
+if os.path.exists(".env.local"):
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=".env.local")
+
+# Configure logging; records are written by a background listener thread
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Without the Hume API key the server still starts, but /api/ready reports it as not ready
+if not os.getenv('NEXT_PUBLIC_HUME_API_KEY'):
+    logger.error("NEXT_PUBLIC_HUME_API_KEY not found in environment variables")
+
+logger.info("Starting Hume TTS and Emotion Detection server on port %s", os.getenv('PORT', 5001))
+
+# Synthesized clips are cached by (text, description, voice, format)
+TTS_OUTPUT_FORMAT = "mp3"
+tts_cache = TTSAudioCache()
+
+# Pre-synthesized script lines from hume_warmup.py, if a bundle has been built
+tts_cache.load_bundle()
+
+# Size of the chunks relayed to the client in streaming TTS mode
+TTS_STREAM_CHUNK_SIZE = int(os.getenv('HUME_TTS_STREAM_CHUNK_SIZE', 16 * 1024))
+
+# Synthesize lines of several sentences one sentence at a time; ?sentences=0|1 overrides per request
+TTS_SPLIT_SENTENCES = os.getenv('HUME_TTS_SPLIT_SENTENCES', '0') == '1'
+
+# Sentences of one line synthesized at the same time
+TTS_SENTENCE_CONCURRENCY = int(os.getenv('HUME_TTS_SENTENCE_CONCURRENCY', 4))
+
+# Sentences shorter than this many characters are spoken together with a neighbour
+TTS_SENTENCE_MIN_CHARS = int(os.getenv('HUME_TTS_SENTENCE_MIN_CHARS', 40))
+
+# One tracker watches every outstanding Hume batch job
+job_tracker = JobTracker(get_client)
+hume_metrics.REGISTRY.register(hume_metrics.Gauge(
+    'hume_jobs_outstanding', 'Batch jobs submitted and not yet finished',
+    callback=lambda: job_tracker.stats()["outstanding"]
+))
+
+# Shared secret expected on Hume completion callbacks, if any
+HUME_CALLBACK_TOKEN = os.getenv('HUME_CALLBACK_TOKEN')
+
+# Concurrent /api/emotion requests are packed into shared Hume jobs, one stream per granularity
+emotion_coalescers = {
+    granularity: EmotionCoalescer(job_tracker, language_models(granularity)) for granularity in TEXT_GRANULARITIES
+}
+emotion_coalescer = emotion_coalescers["utterance"]
+
+# Emotion results for repeated text and audio, persisted across restarts
+emotion_cache = EmotionResultCache()
+
+# Recordings up to this size are hashed before upload so they can hit the cache
+EMOTION_CACHE_AUDIO_MAX_BYTES = int(float(os.getenv('HUME_EMOTION_CACHE_AUDIO_MAX_MB', 2)) * 1024 * 1024)
+
+# Token required by the admin endpoints; without one they only answer local requests
+HUME_ADMIN_TOKEN = os.getenv('HUME_ADMIN_TOKEN')
+
+# Largest number of texts accepted by /api/emotion/batch in one request
+EMOTION_BATCH_MAX_TEXTS = int(os.getenv('HUME_EMOTION_BATCH_MAX_TEXTS', 50))
+
+# Largest audio upload accepted by /api/emotion/audio, enforced while streaming
+AUDIO_MAX_UPLOAD_BYTES = int(float(os.getenv('HUME_AUDIO_MAX_UPLOAD_MB', 25)) * 1024 * 1024)
+
+# Trim, downmix, resample and split recordings before upload; ?preprocess=0|1 overrides per request
+AUDIO_PREPROCESS = os.getenv('HUME_AUDIO_PREPROCESS', '0') == '1'
+
+# Asynchronous emotion jobs, persisted so a restarted server resumes them
+job_store = JobStore()
+
+# Resume jobs a previous run left unfinished at start; with several workers only one of them does
+RESUME_JOBS = os.getenv('HUME_RESUME_JOBS', '1') == '1'
+
+# How long an asynchronous job may wait on Hume, much longer than a held-open request
+ASYNC_JOB_TIMEOUT = float(os.getenv('HUME_ASYNC_JOB_TIMEOUT', 300))
+
+# Synthesize the neutral take of a /api/respond line while its emotion is being analysed
+RESPOND_SPECULATE = os.getenv('HUME_RESPOND_SPECULATE', '1') == '1'
+
+# Pregenerated hume_tts_<emotion>.wav clips, played when a line cannot be synthesized in time
+FALLBACK_CLIP_DIR = os.getenv('HUME_FALLBACK_CLIP_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hume_output'))
+_fallback_clips = {}
+
+# Voice mappings for different characters
+voice_mappings = {
+    "Minister Santos": "ee96fb5f-ec1a-4f41-a9ba-6d119e64c8fd",
+    "Dr. Chen": "5bb7de05-c8fe-426a-8fcc-ba4fc4ce9f9c",
+    "Mayor Okonjo": "b89de4b1-3df6-4e4f-a054-9aed4351092d",
+    "Ms. Patel": "d8ab67c6-953d-4bd8-9370-8fa53a0f1453"
+}
+
+# Emotion descriptions for TTS
+emotion_descriptions = {
+    "neutral": "neutral",
+    "anger": "angry",
+    "compassion": "compassionate",
+    "frustration": "frustrated",
+    "enthusiasm": "enthusiastic",
+    "concern": "concerned"
+}
+
+# Voice emotion for each Hume emotion label; labels not listed are spoken neutrally
+hume_emotion_voices = {
+    **dict.fromkeys(("Anger", "Contempt", "Disgust"), "anger"),
+    **dict.fromkeys(("Sympathy", "Empathic Pain", "Love", "Sadness"), "compassion"),
+    **dict.fromkeys(("Annoyance", "Disappointment", "Disapproval"), "frustration"),
+    **dict.fromkeys(("Enthusiasm", "Joy", "Excitement", "Interest", "Determination", "Triumph", "Pride",
+                     "Surprise (positive)"), "enthusiasm"),
+    **dict.fromkeys(("Anxiety", "Distress", "Fear", "Horror", "Doubt", "Surprise (negative)"), "concern"),
+}
+
+# Map speaking rates for different emotions
+speaking_rates = {
+    "neutral": 1.0,
+    "anger": 1.2,
+    "compassion": 0.9,
+    "frustration": 1.1,
+    "enthusiasm": 1.15,
+    "concern": 0.95
+}
+
+# Map pitch for different emotions
+pitch_mapping = {
+    "neutral": 0,
+    "anger": 0.5,
+    "compassion": -0.2,
+    "frustration": 0.3,
+    "enthusiasm": 0.4,
+    "concern": -0.3
+}
+
+# Map intensity for different emotions
+intensity_mapping = {
+    "neutral": 0.5,
+    "anger": 0.8,
+    "compassion": 0.7,
+    "frustration": 0.7,
+    "enthusiasm": 0.8,
+    "concern": 0.6
+}
+
+def resolve_voice(agent_name, emotion):
+    """Return the TTS description and voice id for an agent speaking with ``emotion``."""
+    description = emotion_descriptions.get(emotion, emotion_descriptions['neutral'])
+    voice_id = voice_mappings.get(agent_name, voice_mappings['Minister Santos'])
+    return description, voice_id
+
+def build_tts_payload(text, description, voice_id):
+    # Only text, description and voice are supported; speaking_rate, pitch and intensity are not
+    return {
+        "utterances": [
+            {
+                "text": text,
+                "description": description,
+                "voice": {
+                    "id": voice_id,
+                    "provider": "HUME_AI"
+                }
+            }
+        ],
+        "format": {
+            "type": TTS_OUTPUT_FORMAT
+        }
+    }
+
+# A sentence runs to terminal punctuation and any closing quotes or brackets, then whitespace or the end
+SENTENCE_PATTERN = re.compile(r'\S.*?(?:[.!?…]+["\'”’)\]]*(?=\s|$)|$)', re.S)
+
+def split_sentences(text, min_chars=None):
+    """``text`` as sentence-sized utterances, in order.
+    
+    A sentence shorter than ``min_chars`` is joined to the one after it (the
+    last one to the one before), since a few words make a poor utterance.
+    """
+    min_chars = TTS_SENTENCE_MIN_CHARS if min_chars is None else min_chars
+    pieces = []
+    for match in SENTENCE_PATTERN.finditer(text):
+        sentence = match.group().strip()
+        if pieces and len(pieces[-1]) < min_chars:
+            pieces[-1] = f"{pieces[-1]} {sentence}"
+        else:
+            pieces.append(sentence)
+    if len(pieces) > 1 and len(pieces[-1]) < min_chars:
+        pieces[-2:] = [f"{pieces[-2]} {pieces[-1]}"]
+    return pieces
+
+def wants_sentences(value, text):
+    """Whether a line is synthesized by sentence: per the ``sentences`` parameter and only if it has several."""
+    if value is None:
+        value = TTS_SPLIT_SENTENCES
+    return value in (True, '1', 'true') and len(split_sentences(text)) > 1
+
+async def stream_speech(text, description, voice_id):
+    """Yield audio chunks from Hume's streaming TTS endpoint as they arrive."""
+    client = get_client()
+    async with client.request(
+        "tts",
+        "POST",
+        "/v0/tts/stream/file",
+        json=build_tts_payload(text, description, voice_id)
+    ) as response:
+        if response.status != 200:
+            error_text = await response.text()
+            logger.error("Hume streaming TTS API error: %s", error_text)
+            raise HumeAPIError(response.status, error_text)
+        
+        async for chunk in response.content.iter_chunked(TTS_STREAM_CHUNK_SIZE):
+            yield chunk
+
+async def synthesize_speech(text, description, voice_id):
+    """Synthesize one utterance with Hume's buffered TTS endpoint and return the audio bytes."""
+    try:
+        client = get_client()
+        
+        # Prepare the request payload
+        payload = build_tts_payload(text, description, voice_id)
+        
+        log_raw(logger, "TTS request payload", payload)
+        
+        # Make direct HTTP request to Hume API over the pooled session
+        async with client.request(
+            "tts",
+            "POST",
+            "/v0/tts",
+            headers={"Accept": "application/json"},
+            json=payload
+        ) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error("Hume TTS API error: %s", error_text)
+                raise Exception(f"Hume API returned status {response.status}: {error_text}")
+            
+            # Get response content type
+            content_type = response.headers.get('Content-Type', '')
+            logger.debug("Response content type: %s", content_type)
+            
+            if 'application/json' in content_type:
+                # Parse JSON response
+                response_json = await response.json()
+                
+                # Extract audio data from response
+                if "generations" in response_json and len(response_json["generations"]) > 0:
+                    audio_base64 = response_json["generations"][0]["audio"]
+                    logger.debug("Found audio in generations[0].audio")
+                    with hume_metrics.STAGE_SECONDS.time(stage="base64_decode"):
+                        return base64.b64decode(audio_base64)
+                elif "utterances" in response_json and len(response_json["utterances"]) > 0:
+                    audio_base64 = response_json["utterances"][0]["audio"]
+                    logger.debug("Found audio in utterances[0].audio")
+                    with hume_metrics.STAGE_SECONDS.time(stage="base64_decode"):
+                        return base64.b64decode(audio_base64)
+                else:
+                    raise Exception(f"Could not find audio data in response: {list(response_json.keys())}")
+            else:
+                # Assume binary audio data
+                audio_data = await response.read()
+                logger.debug("Received binary audio data, size: %s bytes", len(audio_data))
+                return audio_data
+                
+    except (CircuitOpen, Overloaded):
+        # Refused before reaching Hume, so not a failed API call; the handler decides what to answer
+        raise
+    except Exception as e:
+        logger.error("Error in direct TTS API call: %s", e)
+        raise e
+
+def fallback_reason(error):
+    """Reason label for a request answered with a fallback instead of Hume's result."""
+    if isinstance(error, CircuitOpen):
+        return "circuit_open"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline"
+    return "overloaded" if isinstance(error, Overloaded) else "error"
+
+async def fallback_speech(emotion, audio_format):
+    """The pregenerated clip for ``emotion``, or the neutral one, and the format it is served in.
+    
+    Clips are WAV; they are transcoded when the client asked for another
+    encoding and ffmpeg is available.
+    """
+    path = os.path.join(FALLBACK_CLIP_DIR, f'hume_tts_{emotion}.wav')
+    if not os.path.exists(path):
+        emotion, path = 'neutral', os.path.join(FALLBACK_CLIP_DIR, 'hume_tts_neutral.wav')
+    key = (emotion, audio_format.key)
+    if key not in _fallback_clips:
+        with open(path, 'rb') as f:
+            clip, clip_format = f.read(), WAV_FORMAT
+        if not audio_format.native and transcoding_available():
+            clip, clip_format = await transcode(clip, audio_format), audio_format
+        _fallback_clips[key] = (clip, clip_format)
+    return _fallback_clips[key]
+
+def overloaded_body(error):
+    """Body and headers of the 429 sent when the upstream scheduler refuses work."""
+    return {'error': str(error), 'retryAfter': error.retry_after}, {'Retry-After': str(error.retry_after)}
+
+def text_granularity(data):
+    """The language model granularity a request asks for; utterance by default."""
+    granularity = data.get('granularity', 'utterance')
+    if granularity not in TEXT_GRANULARITIES:
+        raise InvalidOptions(f"Unknown granularity {granularity!r}; expected one of {', '.join(TEXT_GRANULARITIES)}")
+    return granularity
+
+async def analyze_texts_cached(texts, granularity="utterance", upstream=True):
+    """Segment predictions for each text, submitting only cache misses upstream.
+    
+    Without ``upstream`` nothing is submitted and misses get an empty list.
+    """
+    models = language_models(granularity)
+    keys = [emotion_cache.text_key(text, models) for text in texts]
+    per_text = [await asyncio.to_thread(emotion_cache.get, key) for key in keys]
+    
+    missing = list(dict.fromkeys(text for text, cached in zip(texts, per_text) if cached is None))
+    if missing and not upstream:
+        per_text = [cached if cached is not None else [] for cached in per_text]
+    elif missing:
+        response_data = await run_text_job(job_tracker, missing, models)
+        fetched = dict.fromkeys(missing, [])
+        try:
+            fetched = dict(zip(missing, split_text_predictions(response_data, len(missing))))
+        except Exception as e:
+            logger.error("Error processing batch emotions: %s", e)
+        
+        for index, text in enumerate(texts):
+            if per_text[index] is None:
+                per_text[index] = fetched[text]
+                # Empty results usually mean the prediction could not be parsed; retry next time
+                if fetched[text]:
+                    await asyncio.to_thread(emotion_cache.put, keys[index], "text", fetched[text])
+    
+    logger.info("Batch of %s texts: %s answered from cache", len(texts), len(texts) - len(missing))
+    return per_text
+
+async def detect_text_emotion(text, granularity="utterance"):
+    """Segment predictions for one text and where they came from (hit, inflight or miss)."""
+    # Repeated lines come from the cache; others are coalesced into shared jobs
+    cache_key = emotion_cache.text_key(text, language_models(granularity))
+    
+    async def analyze():
+        # Fail fast rather than wait out the coalescing window while Hume is failing
+        get_client().breakers["batch"].check()
+        return await emotion_coalescers[granularity].analyze(text)
+    
+    return await emotion_cache.get_or_create(cache_key, "text", analyze)
+
+async def synthesize_sentences(text, description, voice_id):
+    """Yield the native clip of each sentence of ``text`` in order, as soon as it is ready.
+    
+    Up to ``TTS_SENTENCE_CONCURRENCY`` sentences are synthesized at once and
+    each is cached under its own key, so a sentence repeated in another line
+    is a cache hit. Closing the generator cancels the sentences not started.
+    """
+    semaphore = asyncio.Semaphore(TTS_SENTENCE_CONCURRENCY)
+    
+    async def sentence_clip(sentence):
+        async with semaphore:
+            return await synthesize_in_format(sentence, description, voice_id, NATIVE_FORMAT)
+    
+    tasks = [asyncio.ensure_future(sentence_clip(sentence)) for sentence in split_sentences(text)]
+    for task in tasks:
+        # Failures after the first are not awaited once the generator stops
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+    try:
+        for task in tasks:
+            audio, _ = await task
+            yield audio
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def synthesize_joined(text, description, voice_id):
+    """One native clip of ``text`` joined from its sentences, synthesized in parallel."""
+    return join_mp3([audio async for audio in synthesize_sentences(text, description, voice_id)])
+
+async def stream_and_cache_sentences(cache_key, text, description, voice_id):
+    """Relay each sentence's clip once it and those before it are ready; cache the joined clip at the end."""
+    received = []
+    async for audio in synthesize_sentences(text, description, voice_id):
+        audio = strip_id3(audio) if received else audio
+        received.append(audio)
+        yield audio
+    
+    await tts_cache.store(cache_key, b''.join(received))
+
+async def synthesize_in_format(text, description, voice_id, audio_format, sentences=False):
+    """Clip in ``audio_format`` and where it came from (memory, disk, bundle, inflight or miss).
+    
+    Transcoded variants are cached under their own key, next to the native
+    clip they are made from, so each format is synthesized and encoded once.
+    With ``sentences`` a missing native clip is joined from separately
+    synthesized sentences.
+    """
+    native_key = tts_cache.key(text, description, voice_id, TTS_OUTPUT_FORMAT)
+    synthesize = synthesize_joined if sentences else synthesize_speech
+    
+    async def native_clip():
+        return await tts_cache.get_or_create(native_key, lambda: synthesize(text, description, voice_id))
+    
+    if audio_format.native:
+        return await native_clip()
+    
+    async def transcoded_clip():
+        audio, _ = await native_clip()
+        return await transcode(audio, audio_format)
+    
+    return await tts_cache.get_or_create(tts_cache.key(text, description, voice_id, audio_format.key), transcoded_clip)
+
+async def stream_and_cache_speech(cache_key, text, description, voice_id):
+    """Relay streaming TTS chunks and cache the clip once it has been fully received."""
+    received = []
+    async for chunk in stream_speech(text, description, voice_id):
+        received.append(chunk)
+        yield chunk
+    
+    # Only complete clips are cached; a disconnect closes the generator before this point
+    await tts_cache.store(cache_key, b''.join(received))
+
+def audio_job_form(content, filename, content_type):
+    """Multipart body starting a burst job on ``content`` (bytes or an async chunk iterator)."""
+    import aiohttp
+
+    form_data = aiohttp.FormData()
+    form_data.add_field('file', content, filename=filename, content_type=content_type)
+    
+    # Add the models configuration as JSON
+    form_data.add_field('json', 
+                        json.dumps(job_tracker.with_callback({
+                            "models": BURST_MODELS
+                        })))
+    return form_data
+
+def audio_model_config(preprocess):
+    """Model configuration an audio cache key is built from; preprocessing settings change the result."""
+    import hume_preprocess
+
+    return {"models": BURST_MODELS, "preprocess": hume_preprocess.settings()} if preprocess else BURST_MODELS
+
+async def analyze_audio_upload(audio_upload, cache_key=None, preprocess=False):
+    """Burst segments for a streaming upload, where they came from (hit, inflight or miss) and the upload mode.
+    
+    ``audio_upload`` is a ``StreamingUpload`` or ``AsyncStreamingUpload`` already
+    opened on its file field. Without a ``cache_key`` the result is never cached.
+    With one, the analysis is shared with identical requests and outlives a
+    caller whose deadline passes, so the (small) recording is read in full
+    before it starts and the shared work never touches this request's body.
+    Otherwise the upload is piped to Hume as it arrives (mode ``raw``). With
+    ``preprocess`` it is read into memory and prepared by ``hume_preprocess``
+    first (``preprocessed``); long recordings are analysed as parallel
+    jobs whose bursts are joined on one timeline (``segmented``).
+    """
+    # NumPy comes with hume_preprocess, so servers that never preprocess do not load it
+    import hume_preprocess
+
+    mode = "preprocessed" if preprocess else "raw"
+    filename, content_type = audio_upload.filename, audio_upload.content_type
+    if cache_key:
+        received = bytearray()
+        async for chunk in audio_upload.aiter_chunks():
+            received += chunk
+        audio_content = bytes(received)
+        
+        async def buffered_chunks():
+            yield audio_content
+    
+    # Shared analysis reads only the buffered copy; an unshared one streams the request body itself
+    chunks = buffered_chunks if cache_key else audio_upload.aiter_chunks
+    
+    async def submit_audio(content, filename, content_type, offset=0.0):
+        # Start the job and let the shared tracker report its completion
+        response_data = await job_tracker.run(data=audio_job_form(content, filename, content_type))
+        
+        # Log the raw response for debugging
+        log_raw(logger, "Raw audio response", response_data)
+        
+        # Extract the bursts from the response, falling back to neutral
+        try:
+            return extract_burst_segments(response_data, offset)
+        except Exception as e:
+            logger.error("Error processing audio emotions: %s", e)
+            return []
+    
+    async def counted(chunks):
+        async for chunk in chunks:
+            hume_metrics.AUDIO_UPLOAD_BYTES.inc(len(chunk), mode="raw")
+            yield chunk
+    
+    async def analyze_prepared():
+        nonlocal mode
+        audio = bytearray()
+        async for chunk in chunks():
+            audio += chunk
+        try:
+            with hume_metrics.STAGE_SECONDS.time(stage="preprocess"):
+                prepared = await hume_preprocess.prepare(audio)
+        except hume_preprocess.UnsupportedAudio as e:
+            logger.info("Uploading %s unprocessed: %s", filename, e)
+            mode = "raw"
+            hume_metrics.AUDIO_UPLOAD_BYTES.inc(len(audio), mode=mode)
+            return await submit_audio(bytes(audio), filename, content_type)
+        
+        if not prepared.segments:
+            logger.debug("Recording %s is silent; nothing to analyse", filename)
+            return []
+        
+        mode = "segmented" if len(prepared.segments) > 1 else "preprocessed"
+        logger.debug("Prepared %s: %.1f seconds in %s segments, %.1f seconds of silence trimmed, %s -> %s bytes",
+                     filename, prepared.duration, len(prepared.segments), prepared.trimmed_seconds,
+                     len(audio), sum(len(wav) for _, wav in prepared.segments))
+        for _, wav in prepared.segments:
+            hume_metrics.AUDIO_UPLOAD_BYTES.inc(len(wav), mode=mode)
+        
+        # Segments are independent jobs, so they are analysed concurrently
+        name = os.path.splitext(filename or 'audio')[0]
+        per_segment = await asyncio.gather(*(
+            submit_audio(wav, f"{name}-{index}.wav", 'audio/wav', offset)
+            for index, (offset, wav) in enumerate(prepared.segments)
+        ))
+        return [burst for bursts in per_segment for burst in bursts]
+    
+    async def analyze_audio():
+        # Do not read or preprocess a recording Hume would be refused anyway
+        get_client().breakers["batch"].check()
+        started = time.perf_counter()
+        try:
+            logger.debug("Starting audio analysis job...")
+            if preprocess:
+                emotions = await analyze_prepared()
+            else:
+                # Pipe the upload straight into the outgoing multipart request
+                emotions = await submit_audio(counted(chunks()), filename, content_type)
+            logger.debug("Got audio results")
+        except Exception as e:
+            # Report the size limit rather than the aborted upstream upload it caused
+            if not cache_key and audio_upload.error:
+                raise audio_upload.error
+            logger.error("Error in Hume API call for audio: %s", e)
+            raise e
+        hume_metrics.AUDIO_ANALYSIS_SECONDS.observe(time.perf_counter() - started, mode=mode)
+        return emotions
+    
+    try:
+        if cache_key:
+            emotions, source = await emotion_cache.get_or_create(cache_key, "audio", analyze_audio)
+        else:
+            emotions, source = await analyze_audio(), "miss"
+        return emotions, source, mode
+    finally:
+        hume_metrics.STAGE_SECONDS.observe(audio_upload.read_seconds, stage="upload_read")
+
+def text_job_request(data):
+    """The stored request of an asynchronous text job, from a ``/api/emotion/jobs`` body.
+    
+    The body takes ``text`` or ``texts`` plus the options of the synchronous
+    routes; raises ``InvalidOptions`` if it is not usable.
+    """
+    single = 'texts' not in data
+    texts = [data.get('text')] if single else data.get('texts')
+    if not isinstance(texts, list) or not texts:
+        raise InvalidOptions('text or a non-empty texts list is required')
+    if not all(isinstance(text, str) and text for text in texts):
+        raise InvalidOptions('Every text must be a non-empty string')
+    if len(texts) > EMOTION_BATCH_MAX_TEXTS:
+        raise InvalidOptions(f'At most {EMOTION_BATCH_MAX_TEXTS} texts are allowed per job')
+    return {"texts": texts, "single": single, "granularity": text_granularity(data), "options": parse_options(data)}
+
+def audio_job_request(audio_sha256, filename, content_type, preprocess, options):
+    """The stored request of an asynchronous audio job; the recording itself is spooled separately."""
+    return {
+        "filename": filename,
+        "content_type": content_type,
+        "preprocess": preprocess,
+        "options": options,
+        "cache_key": emotion_cache.audio_key(audio_sha256, audio_model_config(preprocess))
+    }
+
+async def run_text_emotion_job(job):
+    """Run or resume an asynchronous text job and return its result.
+    
+    Cached texts are answered from the emotion cache and the rest share one
+    Hume job. Its id is stored before waiting, so after a restart the job is
+    awaited again rather than resubmitted.
+    """
+    texts = job.request["texts"]
+    models = language_models(job.request["granularity"])
+    keys = [emotion_cache.text_key(text, models) for text in texts]
+    upstream = job.upstream
+    if upstream is None:
+        cached = await asyncio.to_thread(lambda: [emotion_cache.get(key) for key in keys])
+        missing = [index for index, value in enumerate(cached) if value is None]
+        upstream = []
+        if missing:
+            job_id = await job_tracker.submit(payload={"text": [texts[index] for index in missing], "models": models})
+            upstream.append({"id": job_id, "inputs": missing})
+        await job_store.update(job.token, RUNNING, upstream=upstream)
+    
+    per_text = {}
+    for entry in upstream:
+        await job_tracker.wait(entry["id"], ASYNC_JOB_TIMEOUT)
+        predictions = await fetch_predictions(get_client(), entry["id"])
+        for index, segments in zip(entry["inputs"], split_text_predictions(predictions, len(entry["inputs"]))):
+            per_text[index] = segments
+            if segments:
+                await asyncio.to_thread(emotion_cache.put, keys[index], "text", segments)
+    for index, key in enumerate(keys):
+        if index not in per_text:
+            per_text[index] = await asyncio.to_thread(emotion_cache.get, key) or []
+    
+    results = [summarize(per_text[index], **job.request["options"]) for index in range(len(texts))]
+    return results[0] if job.request["single"] else {"results": results}
+
+async def run_audio_emotion_job(job):
+    """Run or resume an asynchronous audio job and return its result.
+    
+    The spooled recording is preprocessed like a synchronous upload, every
+    piece is submitted, and the job ids are stored before the upload is
+    dropped; after a restart only the waiting is repeated.
+    """
+    import hume_preprocess
+
+    request = job.request
+    upstream = job.upstream
+    if upstream is None:
+        cached = await asyncio.to_thread(emotion_cache.get, request["cache_key"])
+        if cached is not None:
+            return summarize(cached, **request["options"])
+        audio = await asyncio.to_thread(job_store.read_upload, job.token)
+        if audio is None:
+            raise RuntimeError("The recording was lost before it reached Hume")
+        
+        mode = "raw"
+        pieces = [(0.0, audio, request["filename"], request["content_type"])]
+        if request["preprocess"]:
+            try:
+                with hume_metrics.STAGE_SECONDS.time(stage="preprocess"):
+                    prepared = await hume_preprocess.prepare(audio)
+                mode = "segmented" if len(prepared.segments) > 1 else "preprocessed"
+                name = os.path.splitext(request["filename"] or 'audio')[0]
+                pieces = [(offset, wav, f"{name}-{index}.wav", 'audio/wav')
+                          for index, (offset, wav) in enumerate(prepared.segments)]
+            except hume_preprocess.UnsupportedAudio as e:
+                logger.info("Uploading %s unprocessed: %s", request["filename"], e)
+        for _, content, _, _ in pieces:
+            hume_metrics.AUDIO_UPLOAD_BYTES.inc(len(content), mode=mode)
+        
+        job_ids = await asyncio.gather(*(
+            job_tracker.submit(data=audio_job_form(content, filename, content_type))
+            for _, content, filename, content_type in pieces
+        ))
+        upstream = [{"id": job_id, "offset": piece[0]} for job_id, piece in zip(job_ids, pieces)]
+        await job_store.update(job.token, RUNNING, upstream=upstream)
+        job_store.drop_upload(job.token)
+    
+    async def bursts(entry):
+        await job_tracker.wait(entry["id"], ASYNC_JOB_TIMEOUT)
+        return extract_burst_segments(await fetch_predictions(get_client(), entry["id"], "audio"), entry["offset"])
+    
+    segments = [burst for piece in await asyncio.gather(*(bursts(entry) for entry in upstream)) for burst in piece]
+    if segments:
+        await asyncio.to_thread(emotion_cache.put, request["cache_key"], "audio", segments)
+    return summarize(segments, **request["options"])
+
+# Background tasks running asynchronous jobs; referenced so they are not garbage collected
+_running_jobs = set()
+
+async def run_emotion_job(job):
+    # Work for asynchronous jobs is not attributed to the route that queued it,
+    # and waits for Hume capacity rather than being refused under load
+    hume_metrics.current_route.set("async_jobs")
+    shed_load.set(False)
+    runner = run_text_emotion_job if job.kind == "text" else run_audio_emotion_job
+    try:
+        result = await runner(job)
+    except Exception as e:
+        logger.error("Asynchronous %s job %s failed: %s", job.kind, job.token, e)
+        job_store.drop_upload(job.token)
+        await job_store.update(job.token, FAILED, error=str(e))
+        return
+    logger.info("Asynchronous %s job %s completed", job.kind, job.token)
+    await job_store.update(job.token, COMPLETED, result=result)
+
+def start_emotion_job(job):
+    """Run ``job`` in the background on the current event loop."""
+    task = asyncio.ensure_future(run_emotion_job(job))
+    _running_jobs.add(task)
+    task.add_done_callback(_running_jobs.discard)
+
+async def queue_emotion_job(kind, job_request, upload=None, spooled=None):
+    """Store a new asynchronous job, start it and return it as first stored."""
+    token = await asyncio.to_thread(job_store.create, kind, job_request, upload, spooled)
+    job = await asyncio.to_thread(job_store.get, token)
+    start_emotion_job(job)
+    return job
+
+async def resume_emotion_jobs():
+    """Restart every job left queued or running by a previous process."""
+    jobs = await asyncio.to_thread(job_store.unfinished)
+    for job in jobs:
+        start_emotion_job(job)
+    job_store.counters["resumed"] += len(jobs)
+    if jobs:
+        logger.info("Resumed %s asynchronous emotion jobs", len(jobs))
+
+def accepted_body(job):
+    """Body of the 202 response to a job submission."""
+    return dict(
+        job_body(job),
+        statusUrl=f"/api/emotion/jobs/{job.token}",
+        eventsUrl=f"/api/emotion/jobs/{job.token}/events"
+    )
+
+async def job_events(token):
+    """Server-Sent Events for a job: one event per status, named after it, until it finishes."""
+    async for job in job_store.watch(token):
+        yield b': keep-alive\n\n' if job is None else sse_event(job.status, job_body(job))
+
+# Sent with every event stream so proxies pass events through as they happen
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def voice_emotion(dominant_emotion):
+    """The ``emotion_descriptions`` key a line is spoken with, from its dominant Hume emotion.
+    
+    Hume labels are mapped through ``hume_emotion_voices``, so ``Sympathy`` is
+    spoken with compassion; labels it does not list, such as ``Boredom``, are
+    spoken neutrally. A description key such as ``neutral`` is kept as is.
+    """
+    if dominant_emotion in hume_emotion_voices:
+        return hume_emotion_voices[dominant_emotion]
+    emotion = (dominant_emotion or 'neutral').lower()
+    return emotion if emotion in emotion_descriptions else 'neutral'
+
+def multipart_part(boundary, headers, first=False):
+    """Delimiter and headers opening one part of a ``multipart/mixed`` body."""
+    lines = ([] if first else ['']) + [f'--{boundary}'] + [f'{name}: {value}' for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('utf-8')
+
+def remaining_budget(budget, started):
+    """Seconds left of ``budget`` since the monotonic time ``started``, or None without a budget."""
+    return None if budget is None else max(0.0, budget - (time.monotonic() - started))
+
+async def respond_parts(text, agent_name, audio_format, granularity, options, budget, boundary, sentences=False):
+    """The ``/api/respond`` body for one agent line: its emotion, then its speech.
+    
+    Yields a ``multipart/mixed`` body. The first part is JSON with the
+    emotion summary and the voice emotion it maps to, sent as soon as the
+    analysis is done. The second part is the audio, relayed as Hume
+    produces it. While a line's emotion is not cached, its neutral take is
+    synthesized during the analysis and kept if the line turns out neutral.
+    ``budget`` covers the whole pipeline: a late analysis speaks the line
+    neutrally, and late speech is replaced by the fallback clip. With
+    ``sentences`` the speech is synthesized sentence by sentence.
+    """
+    started = time.monotonic()
+    speculative = None
+    if RESPOND_SPECULATE:
+        emotion_key = emotion_cache.text_key(text, language_models(granularity))
+        if await asyncio.to_thread(emotion_cache.get, emotion_key) is None:
+            neutral_description, neutral_voice_id = resolve_voice(agent_name, 'neutral')
+            speculative = asyncio.ensure_future(
+                synthesize_in_format(text, neutral_description, neutral_voice_id, audio_format, sentences)
+            )
+            # A discarded take may fail without anyone awaiting it
+            speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+    
+    fallback = None
+    try:
+        predictions, emotion_source = await within(detect_text_emotion(text, granularity), budget)
+    except (CircuitOpen, DeadlineExceeded) as e:
+        logger.warning("Speaking line neutrally: %s", e)
+        predictions, emotion_source, fallback = [], "miss", fallback_reason(e)
+        hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+    
+    result = summarize(predictions, **options)
+    emotion = voice_emotion(result['dominantEmotion'])
+    description, voice_id = resolve_voice(agent_name, emotion)
+    speculation = "none"
+    if speculative is not None:
+        speculation = "used" if emotion == 'neutral' else "discarded"
+        hume_metrics.RESPOND_SPECULATION.inc(outcome=speculation)
+    metadata = dict(result, emotion=emotion, description=description, agentName=agent_name,
+                    emotionCache=emotion_source, speculation=speculation)
+    if fallback:
+        metadata["fallback"] = fallback
+    yield multipart_part(boundary, {'Content-Type': 'application/json'}, first=True) + json.dumps(metadata).encode('utf-8')
+    
+    stream = None
+    speech_fallback = None
+    try:
+        if speculation == "used":
+            # Shielded so a spent budget leaves the take running into the cache
+            audio, tts_source = await within(asyncio.shield(speculative), remaining_budget(budget, started))
+        elif audio_format.native:
+            cache_key = tts_cache.key(text, description, voice_id, TTS_OUTPUT_FORMAT)
+            audio, tts_source = await tts_cache.lookup(cache_key)
+            if audio is None:
+                # Relay the speech as it is produced; the budget bounds the time to its first chunk
+                relay = stream_and_cache_sentences if sentences else stream_and_cache_speech
+                stream, tts_source = relay(cache_key, text, description, voice_id), "miss"
+                try:
+                    audio = await within(stream.__anext__(), remaining_budget(budget, started))
+                except StopAsyncIteration:
+                    audio = b''
+        else:
+            audio, tts_source = await within(
+                synthesize_in_format(text, description, voice_id, audio_format, sentences), remaining_budget(budget, started)
+            )
+    except Exception as e:
+        # The emotion part is already sent, so any failure is answered with the fallback clip
+        logger.warning("Serving fallback speech for %s: %s", emotion, e)
+        if stream is not None:
+            await stream.aclose()
+            stream = None
+        speech_fallback = fallback_reason(e)
+        audio, audio_format = await fallback_speech(emotion, audio_format)
+        tts_source = "fallback"
+        hume_metrics.FALLBACK_RESPONSES.inc(reason=speech_fallback)
+    
+    headers = {
+        'Content-Type': audio_format.mimetype,
+        'Content-Disposition': f"inline; filename={agent_name.replace(' ', '_').lower()}_{emotion}.{audio_format.extension}",
+        'X-TTS-Cache': tts_source
+    }
+    if speech_fallback:
+        headers['X-Fallback'] = speech_fallback
+    try:
+        yield multipart_part(boundary, headers) + audio
+        if stream is not None:
+            async for chunk in stream:
+                yield chunk
+    finally:
+        if stream is not None:
+            await stream.aclose()
+    yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+def entries_limit(value, default=50, maximum=1000):
+    """Number of cache entries to list for a ``limit`` query parameter, clamped to 1..maximum.
+
+    Raises ValueError for a value that is not an integer.
+    """
+    if value is None or not value.strip():
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError(f"limit must be an integer, not {value!r}") from None
+    return min(max(limit, 1), maximum)
+
+def readiness():
+    """Body and status of ``/api/ready``: the app is built, and ready once it can call Hume."""
+    checks = {"apiKey": bool(os.getenv('NEXT_PUBLIC_HUME_API_KEY'))}
+    ready = all(checks.values())
+    body = {"ready": ready, "checks": checks, "pid": os.getpid(), "startupSeconds": round(STARTUP_SECONDS or 0, 4)}
+    return body, 200 if ready else 503
+
+# Time spent importing the server and building its app, reported by /api/ready and /metrics
+STARTUP_SECONDS = None
+hume_metrics.REGISTRY.register(hume_metrics.Gauge(
+    'hume_startup_seconds', 'Time spent importing the server and building the app',
+    callback=lambda: STARTUP_SECONDS or 0
+))
+
+def app_built(started):
+    """Record the time since ``started`` (a ``perf_counter`` reading) as the cold start of a serving mode."""
+    global STARTUP_SECONDS
+    STARTUP_SECONDS = time.perf_counter() - started
+    logger.info("Server built in %.3f seconds", STARTUP_SECONDS)
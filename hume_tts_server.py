@@ -1,218 +1,155 @@
-from flask import Flask, request, jsonify, send_file
+import time
+
+# Cold start is measured from the first import of this module; see /api/ready
+_import_started = time.perf_counter()
+
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
-from hume import AsyncHumeClient
-from hume.tts import PostedUtterance
-import asyncio
-import base64
-import json
+import hmac
 import os
-import tempfile
-import time
+import secrets
 import logging
-import aiohttp
-from dotenv import load_dotenv
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from hume_http import CircuitOpen, get_client, iterate_async, run_async
+from hume_aggregate import InvalidOptions, parse_options, summarize
+from hume_job_store import job_body
+from hume_audio import FormatError, audio_response, negotiate
+from hume_deadline import DeadlineExceeded, InvalidDeadline, parse_budget, within
+from hume_scheduler import Overloaded
+import hume_metrics
+from hume_logging import log_raw
+from hume_upload import StreamingUpload, UploadTooLarge
+from hume_service import (
+    AUDIO_MAX_UPLOAD_BYTES,
+    AUDIO_PREPROCESS,
+    EMOTION_BATCH_MAX_TEXTS,
+    EMOTION_CACHE_AUDIO_MAX_BYTES,
+    HUME_ADMIN_TOKEN,
+    HUME_CALLBACK_TOKEN,
+    RESUME_JOBS,
+    SSE_HEADERS,
+    TTS_OUTPUT_FORMAT,
+    accepted_body,
+    analyze_audio_upload,
+    analyze_texts_cached,
+    app_built,
+    audio_job_request,
+    audio_model_config,
+    detect_text_emotion,
+    emotion_cache,
+    emotion_coalescer,
+    entries_limit,
+    fallback_reason,
+    fallback_speech,
+    job_events,
+    job_store,
+    job_tracker,
+    overloaded_body,
+    queue_emotion_job,
+    readiness,
+    resolve_voice,
+    respond_parts,
+    resume_emotion_jobs,
+    stream_and_cache_sentences,
+    stream_and_cache_speech,
+    synthesize_in_format,
+    text_granularity,
+    text_job_request,
+    tts_cache,
+    wants_sentences
 )
-logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv(dotenv_path=".env.local") 
-
-# Get Hume API key
-HUME_API_KEY = os.getenv('NEXT_PUBLIC_HUME_API_KEY')
-if not HUME_API_KEY:
-    raise ValueError("NEXT_PUBLIC_HUME_API_KEY not found in environment variables")
-
-logger.info(f"Starting Hume TTS and Emotion Detection server on port 5001")
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-# Voice mappings for different characters
-voice_mappings = {
-    "Minister Santos": "ee96fb5f-ec1a-4f41-a9ba-6d119e64c8fd",
-    "Dr. Chen": "5bb7de05-c8fe-426a-8fcc-ba4fc4ce9f9c",
-    "Mayor Okonjo": "b89de4b1-3df6-4e4f-a054-9aed4351092d",
-    "Ms. Patel": "d8ab67c6-953d-4bd8-9370-8fa53a0f1453"
-}
+@app.before_request
+def start_request_metrics():
+    # Everything recorded while serving this request is labelled with its route
+    g.metrics_route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    hume_metrics.current_route.set(g.metrics_route)
+    hume_metrics.REQUESTS_IN_FLIGHT.inc(route=g.metrics_route)
 
-# Emotion descriptions for TTS
-emotion_descriptions = {
-    "neutral": "neutral",
-    "anger": "angry",
-    "compassion": "compassionate",
-    "frustration": "frustrated",
-    "enthusiasm": "enthusiastic",
-    "concern": "concerned"
-}
+@app.after_request
+def record_request_metrics(response):
+    route = g.metrics_route
+    handled = time.perf_counter()
+    hume_metrics.REQUEST_SECONDS.observe(handled - g.metrics_started, route=route)
+    hume_metrics.REQUESTS.inc(route=route, status=response.status_code)
+    # The body is written after this hook returns; streamed bodies take as long as the upstream
+    response.call_on_close(lambda: hume_metrics.STAGE_SECONDS.observe(
+        time.perf_counter() - handled, route=route, stage="response_write"
+    ))
+    return response
 
-# Map speaking rates for different emotions
-speaking_rates = {
-    "neutral": 1.0,
-    "anger": 1.2,
-    "compassion": 0.9,
-    "frustration": 1.1,
-    "enthusiasm": 1.15,
-    "concern": 0.95
-}
+@app.teardown_request
+def finish_request_metrics(exc):
+    if 'metrics_route' in g:
+        hume_metrics.REQUESTS_IN_FLIGHT.dec(route=g.metrics_route)
 
-# Map pitch for different emotions
-pitch_mapping = {
-    "neutral": 0,
-    "anger": 0.5,
-    "compassion": -0.2,
-    "frustration": 0.3,
-    "enthusiasm": 0.4,
-    "concern": -0.3
-}
-
-# Map intensity for different emotions
-intensity_mapping = {
-    "neutral": 0.5,
-    "anger": 0.8,
-    "compassion": 0.7,
-    "frustration": 0.7,
-    "enthusiasm": 0.8,
-    "concern": 0.6
-}
+def read_json():
+    """The JSON object in the request body, or ``{}`` when the body is missing, malformed or not an object."""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else {}
 
 @app.route('/api/emotion', methods=['POST'])
 def detect_emotion():
     start_time = time.time()
     try:
         # Get request data
-        data = request.json
+        data = read_json()
         text = data.get('text')
         
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         
-        logger.info(f"Detecting emotion for text: {text[:50]}...")
-        
-        # Define async function to detect emotion using Hume SDK
-        async def detect_emotion_async():
-            try:
-                # Configure language model directly in the request
-                logger.info(f"Starting language analysis job with text: {text[:50]}...")
-                
-                # Create a new client for each request to avoid event loop issues
-                client = AsyncHumeClient(api_key=HUME_API_KEY)
-                
-                # Start a batch job with text input and direct model configuration
-                job_id = await client.expression_measurement.batch.start_inference_job(
-                    text=[text],
-                    models={
-                        "language": {
-                            "granularity": "utterance",
-                            "identify_speakers": False,
-                            "sentiment": {},  # Enable sentiment analysis
-                            "toxicity": {}    # Enable toxicity analysis
-                        }
-                    }
-                )
-                
-                logger.info(f"Job started with ID: {job_id}")
-                
-                # Poll for job completion
-                max_retries = 15
-                retry_count = 0
-                status = None
-                
-                while status != "COMPLETED" and retry_count < max_retries:
-                    await asyncio.sleep(1)
-                    
-                    job_details = await client.expression_measurement.batch.get_job_details(job_id)
-                    status = job_details.state.status
-                    logger.info(f"Job status: {status}, retry: {retry_count+1}/{max_retries}")
-                    
-                    if status == "FAILED":
-                        logger.error(f"Job failed: {job_details.state.failure_reason}")
-                        raise Exception(f"Job failed: {job_details.state.failure_reason}")
-                    
-                    if status != "COMPLETED":
-                        retry_count += 1
-                
-                if status != "COMPLETED":
-                    raise Exception(f"Job did not complete after {max_retries} retries")
-                
-                # Get results
-                logger.info(f"Fetching results for job: {job_id}")
-                results = await client.expression_measurement.batch.get_job_predictions(id=job_id)
-                
-                logger.info(f"Got results: {results}")
-                return results
-                
-            except Exception as e:
-                logger.error(f"Error in Hume API call: {str(e)}")
-                raise e
-        
-        # Create a new event loop for each request
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+        # Granularity, aggregation options and latency budget; unknown values are the client's mistake
         try:
-            # Run the async function in the new loop
-            response_data = loop.run_until_complete(detect_emotion_async())
-        finally:
-            # Always close the loop when done to prevent resource leaks
-            loop.close()
-        
-        # Process the emotion response
-        emotions = []
-        dominant_emotion = "neutral"
+            granularity = text_granularity(data)
+            options = parse_options(data)
+            budget = parse_budget(request.headers.get('X-Deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Log the raw response for debugging
-        logger.info(f"Raw response: {response_data}")
+        logger.info("Detecting emotion for text: %s...", text[:50])
         
-        # Extract emotions from the response
+        # A failing Hume or a spent budget gets an immediate neutral answer instead of an error
+        fallback = None
         try:
-            if response_data and len(response_data) > 0:
-                # Get the first prediction
-                prediction = response_data[0]
-                
-                # Extract language results
-                language_results = prediction.results.predictions[0].models.language
-                
-                # Get emotions from grouped predictions
-                if hasattr(language_results, 'grouped_predictions') and len(language_results.grouped_predictions) > 0:
-                    emotion_predictions = language_results.grouped_predictions[0].predictions[0].emotions
-                    
-                    # Convert to list of dictionaries for JSON serialization
-                    emotions_list = []
-                    for emotion in emotion_predictions:
-                        emotions_list.append({
-                            'name': emotion.name,
-                            'score': emotion.score
-                        })
-                    
-                    # Sort emotions by score
-                    sorted_emotions = sorted(emotions_list, key=lambda x: x['score'], reverse=True)
-                    emotions = sorted_emotions
-                    
-                    # Use the actual top emotion name as the dominant emotion
-                    if emotions:
-                        logger.info(f"Top detected emotion: {emotions[0]['name']} with score {emotions[0]['score']}")
-                        dominant_emotion = emotions[0]["name"]
-        except Exception as e:
-            logger.error(f"Error processing emotions: {str(e)}")
-            # Continue with neutral emotion as fallback
-        
-        result = {
-            "emotions": emotions,
-            "dominantEmotion": dominant_emotion
-        }
-        
-        logger.info(f"Emotion detection completed in {time.time() - start_time:.2f} seconds")
-        logger.info(f"Dominant emotion: {dominant_emotion}")
-        return jsonify(result)
+            emotion_predictions, cache_source = run_async(within(detect_text_emotion(text, granularity), budget))
+        except (CircuitOpen, DeadlineExceeded) as e:
+            logger.warning("Answering emotion request with a fallback: %s", e)
+            emotion_predictions, cache_source, fallback = [], "miss", fallback_reason(e)
+        
+        # Log the raw response for debugging
+        log_raw(logger, "Raw emotion predictions", emotion_predictions)
+        
+        result = summarize(emotion_predictions, **options)
+        if fallback:
+            result["fallback"] = fallback
+            hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+        elif not emotion_predictions:
+            hume_metrics.FALLBACK_RESPONSES.inc(reason="empty")
+        
+        elapsed = time.time() - start_time
+        logger.info("Emotion detection completed in %.2f seconds: %s (cache %s)", elapsed, result['dominantEmotion'], cache_source,
+                    extra={"duration": elapsed, "dominant_emotion": result['dominantEmotion'], "cache": cache_source})
+        response = jsonify(result)
+        response.headers['X-Emotion-Cache'] = cache_source
+        if fallback:
+            response.headers['X-Fallback'] = fallback
+        return response
+        
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return jsonify(body), 429, headers
         
     except Exception as e:
-        logger.error(f"Error in emotion detection: {str(e)}")
-        logger.info(f"Failed emotion detection time: {time.time() - start_time:.2f} seconds")
+        logger.error("Error in emotion detection: %s", e)
+        logger.info("Failed emotion detection time: %.2f seconds", time.time() - start_time)
+        hume_metrics.FALLBACK_RESPONSES.inc(reason="error")
         
         # Return a fallback neutral emotion
         return jsonify({
@@ -221,12 +158,74 @@ def detect_emotion():
             "error": str(e)
         }), 500
 
-@app.route('/api/tts', methods=['POST'])
-def text_to_speech():
+@app.route('/api/emotion/batch', methods=['POST'])
+def detect_emotion_batch():
     start_time = time.time()
+    texts = []
     try:
         # Get request data
-        data = request.json
+        data = read_json()
+        texts = data.get('texts')
+        
+        if not isinstance(texts, list) or not texts:
+            return jsonify({'error': 'texts must be a non-empty list'}), 400
+        if not all(isinstance(text, str) and text for text in texts):
+            return jsonify({'error': 'Every entry in texts must be a non-empty string'}), 400
+        if len(texts) > EMOTION_BATCH_MAX_TEXTS:
+            return jsonify({'error': f'At most {EMOTION_BATCH_MAX_TEXTS} texts are allowed per batch'}), 400
+        try:
+            granularity = text_granularity(data)
+            options = parse_options(data)
+            budget = parse_budget(request.headers.get('X-Deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        logger.info("Detecting emotion for a batch of %s texts", len(texts))
+        
+        # Cached texts are answered directly; the rest share a single Hume job
+        fallback = None
+        try:
+            per_text = run_async(within(analyze_texts_cached(texts, granularity), budget))
+        except (CircuitOpen, DeadlineExceeded) as e:
+            # Keep what the cache knows and answer the rest as neutral
+            logger.warning("Answering batch emotion request with fallbacks: %s", e)
+            fallback = fallback_reason(e)
+            per_text = run_async(analyze_texts_cached(texts, granularity, upstream=False))
+        results = [summarize(emotion_predictions, **options) for emotion_predictions in per_text]
+        empty = sum(1 for emotion_predictions in per_text if not emotion_predictions)
+        if empty:
+            hume_metrics.FALLBACK_RESPONSES.inc(empty, reason=fallback or "empty")
+        
+        logger.info("Batch emotion detection of %s texts completed in %.2f seconds", len(texts), time.time() - start_time)
+        if fallback:
+            response = jsonify({"results": results, "fallback": fallback})
+            response.headers['X-Fallback'] = fallback
+            return response
+        return jsonify({"results": results})
+        
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return jsonify(body), 429, headers
+        
+    except Exception as e:
+        logger.error("Error in batch emotion detection: %s", e)
+        logger.info("Failed batch emotion detection time: %.2f seconds", time.time() - start_time)
+        
+        # Return a fallback neutral emotion for every text
+        texts = texts if isinstance(texts, list) else []
+        hume_metrics.FALLBACK_RESPONSES.inc(len(texts), reason="error")
+        return jsonify({
+            "results": [{"emotions": [], "dominantEmotion": "neutral"} for _ in texts],
+            "error": str(e)
+        }), 500
+
+@app.route('/api/tts', methods=['GET', 'POST'])
+def text_to_speech():
+    start_time = time.time()
+    try:
+        # Get request data; GET takes the same fields as query parameters so an audio element can load the URL
+        data = read_json() if request.method == 'POST' else request.args
         text = data.get('text')
         emotion = data.get('emotion', 'neutral').lower()  # Normalize to lowercase
         agent_name = data.get('agentName', 'Minister Santos')  # Match frontend parameter name
@@ -234,315 +233,232 @@ def text_to_speech():
         if not text:
             return jsonify({'error': 'Text is required'}), 400
         
-        logger.info(f"Generating speech for {agent_name} with emotion {emotion}")
+        # Output encoding from the format/bitrate parameters or the Accept header
+        try:
+            audio_format = negotiate(
+                request.headers.get('Accept'),
+                data.get('format', request.args.get('format')),
+                data.get('bitrate', request.args.get('bitrate'))
+            )
+            budget = parse_budget(request.headers.get('X-Deadline'))
+        except FormatError as e:
+            return jsonify({'error': str(e)}), e.status
+        except InvalidDeadline as e:
+            return jsonify({'error': str(e)}), 400
+        
+        logger.info("Generating speech for %s with emotion %s", agent_name, emotion)
         
         # Map emotions to descriptions
-        description = emotion_descriptions.get(emotion, emotion_descriptions['neutral'])
-        voice_id = voice_mappings.get(agent_name, voice_mappings['Minister Santos'])
-        
-        logger.info(f"Using voice ID: {voice_id} for agent: {agent_name}")
-        logger.info(f"Using description: {description}")
-        
-        # Define async function to generate speech using direct HTTP request
-        async def generate_speech_direct():
-            try:
-                # Create a new client for each request to avoid event loop issues
-                client = AsyncHumeClient(api_key=HUME_API_KEY)
-                
-                # Prepare the request payload - removing unsupported parameters
-                payload = {
-                    "utterances": [
-                        {
-                            "text": text,
-                            "description": description,
-                            "voice": {
-                                "id": voice_id,
-                                "provider": "HUME_AI"
-                            }
-                            # Removed speaking_rate, pitch, and intensity as they're not supported
-                        }
-                    ]
-                }
-                
-                logger.info(f"TTS request payload: {json.dumps(payload)[:200]}...")
-                
-                # Make direct HTTP request to Hume API
-                async with aiohttp.ClientSession() as session:
-                    async with session.post(
-                        "https://api.hume.ai/v0/tts",
-                        headers={
-                            "X-Hume-Api-Key": HUME_API_KEY,
-                            "Content-Type": "application/json",
-                            "Accept": "application/json"
-                        },
-                        json=payload
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Hume TTS API error: {error_text}")
-                            raise Exception(f"Hume API returned status {response.status}: {error_text}")
-                        
-                        # Get response content type
-                        content_type = response.headers.get('Content-Type', '')
-                        logger.info(f"Response content type: {content_type}")
-                        
-                        if 'application/json' in content_type:
-                            # Parse JSON response
-                            response_json = await response.json()
-                            logger.info(f"TTS response keys: {list(response_json.keys()) if isinstance(response_json, dict) else 'Not a dict'}")
-                            
-                            # Extract audio data from response
-                            if "generations" in response_json and len(response_json["generations"]) > 0:
-                                audio_base64 = response_json["generations"][0]["audio"]
-                                logger.info(f"Found audio in generations[0].audio")
-                                return base64.b64decode(audio_base64)
-                            elif "utterances" in response_json and len(response_json["utterances"]) > 0:
-                                audio_base64 = response_json["utterances"][0]["audio"]
-                                logger.info(f"Found audio in utterances[0].audio")
-                                return base64.b64decode(audio_base64)
-                            else:
-                                raise Exception(f"Could not find audio data in response: {list(response_json.keys())}")
-                        else:
-                            # Assume binary audio data
-                            audio_data = await response.read()
-                            logger.info(f"Received binary audio data, size: {len(audio_data)} bytes")
-                            return audio_data
-                        
-            except Exception as e:
-                logger.error(f"Error in direct TTS API call: {str(e)}")
-                raise e
-        
-        # Create a new event loop for each request
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
+        description, voice_id = resolve_voice(agent_name, emotion)
+        logger.debug("Using voice ID %s and description %s for agent %s", voice_id, description, agent_name)
         
+        download_name = f"{agent_name.replace(' ', '_').lower()}_{emotion}"
+        
+        # Streaming mode relays audio to the client as Hume produces it; other formats need the whole clip
+        stream = data.get('stream', request.args.get('stream', '')) in (True, '1', 'true')
+        # Lines of several sentences can be synthesized sentence by sentence in parallel, relaying each in order
+        sentences = wants_sentences(data.get('sentences', request.args.get('sentences')), text)
+        fallback = None
         try:
-            # Run the async function in the new loop
-            audio_data = loop.run_until_complete(generate_speech_direct())
-        finally:
-            # Always close the loop when done to prevent resource leaks
-            loop.close()
-        
-        # Create temporary file
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp3', delete=False)
-        temp_file_path = temp_file.name
-        temp_file.close()  # Close the file handle before writing
-        
-        # Write audio data to file
-        with open(temp_file_path, 'wb') as f:
-            f.write(audio_data)
-        
-        logger.info(f"TTS request completed in {time.time() - start_time:.2f} seconds")
-        
-        # Return audio file
-        return send_file(
-            temp_file_path,
-            mimetype='audio/mpeg',
-            as_attachment=True,
-            download_name=f"{agent_name.replace(' ', '_').lower()}_{emotion}.mp3"
+            if (stream or sentences) and audio_format.native:
+                cache_key = tts_cache.key(text, description, voice_id, TTS_OUTPUT_FORMAT)
+                audio_data, cache_source = run_async(tts_cache.lookup(cache_key))
+                if audio_data is None:
+                    relay = stream_and_cache_sentences if sentences else stream_and_cache_speech
+                    speech = relay(cache_key, text, description, voice_id)
+                    return stream_tts_response(speech, f"{download_name}.mp3", start_time, budget)
+            else:
+                # Serve repeated lines from the cache; identical concurrent requests share one synthesis
+                audio_data, cache_source = run_async(within(
+                    synthesize_in_format(text, description, voice_id, audio_format, sentences), budget
+                ))
+        except (CircuitOpen, DeadlineExceeded) as e:
+            # Play the pregenerated clip for this emotion rather than keep the player waiting
+            logger.warning("Serving fallback speech for %s: %s", emotion, e)
+            fallback = fallback_reason(e)
+            audio_data, audio_format = run_async(fallback_speech(emotion, audio_format))
+            cache_source = "fallback"
+            hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+        
+        elapsed = time.time() - start_time
+        logger.info("TTS request completed in %.2f seconds (cache %s, time to first byte %.3f seconds)", elapsed, cache_source, elapsed,
+                    extra={"duration": elapsed, "ttfb": elapsed, "cache": cache_source, "format": audio_format.key})
+        
+        # Return audio straight from memory, or the requested byte range of it
+        status, body, headers = audio_response(
+            audio_data, audio_format, download_name, request.headers.get('Range'), request.headers.get('If-Range')
         )
+        response = Response(body, status=status, headers=headers)
+        response.headers['X-TTS-Cache'] = cache_source
+        if fallback:
+            response.headers['X-Fallback'] = fallback
+        return response
+        
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return jsonify(body), 429, headers
         
     except Exception as e:
-        logger.error(f"Error in TTS: {str(e)}")
-        logger.info(f"Failed TTS request time: {time.time() - start_time:.2f} seconds")
+        logger.error("Error in TTS: %s", e)
+        logger.info("Failed TTS request time: %.2f seconds", time.time() - start_time)
+        return jsonify({'error': str(e)}), 500
+
+def stream_tts_response(speech, download_name, start_time, budget=None):
+    """Relay the chunks of the ``speech`` async generator to the client with chunked transfer.
+    
+    ``budget`` bounds the time to the first chunk; once audio flows it is not cut off.
+    """
+    # Pull the first chunk before sending headers so upstream errors still become a 500 or a fallback
+    try:
+        first_chunk = run_async(within(speech.__anext__(), budget))
+    except StopAsyncIteration:
+        first_chunk = b''
+    except BaseException:
+        run_async(speech.aclose())
+        raise
+    chunks = iterate_async(speech)
+    
+    def generate():
+        logger.info("TTS time to first byte: %.3f seconds (streaming)", time.time() - start_time)
+        yield first_chunk
+        yield from chunks
+        logger.info("Streaming TTS request completed in %.2f seconds", time.time() - start_time)
+    
+    response = Response(generate(), mimetype='audio/mpeg')
+    response.headers['Content-Disposition'] = f'inline; filename={download_name}'
+    response.headers['X-TTS-Format'] = TTS_OUTPUT_FORMAT
+    response.headers['X-TTS-Cache'] = 'miss'
+    return response
+
+@app.route('/api/respond', methods=['POST'])
+def respond():
+    start_time = time.time()
+    try:
+        data = read_json()
+        text = data.get('text')
+        agent_name = data.get('agentName', 'Minister Santos')
+        
+        if not text:
+            return jsonify({'error': 'Text is required'}), 400
+        
+        # Emotion options as for /api/emotion, output encoding as for /api/tts
+        try:
+            granularity = text_granularity(data)
+            options = parse_options(data)
+            audio_format = negotiate(None, data.get('format'), data.get('bitrate'))
+            budget = parse_budget(request.headers.get('X-Deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return jsonify({'error': str(e)}), 400
+        except FormatError as e:
+            return jsonify({'error': str(e)}), e.status
+        sentences = wants_sentences(data.get('sentences'), text)
+        
+        logger.info("Responding as %s: %s...", agent_name, text[:50])
+        
+        # Run the analysis before sending headers so its failures still get a status code
+        boundary = secrets.token_hex(16)
+        parts = respond_parts(text, agent_name, audio_format, granularity, options, budget, boundary, sentences)
+        try:
+            emotion_part = run_async(parts.__anext__())
+        except BaseException:
+            run_async(parts.aclose())
+            raise
+        chunks = iterate_async(parts)
+        
+        def generate():
+            logger.info("Respond emotion sent after %.3f seconds", time.time() - start_time)
+            yield emotion_part
+            yield from chunks
+            logger.info("Respond request completed in %.2f seconds", time.time() - start_time)
+        
+        return Response(generate(), content_type=f'multipart/mixed; boundary={boundary}')
+        
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return jsonify(body), 429, headers
+        
+    except Exception as e:
+        logger.error("Error in respond pipeline: %s", e)
+        logger.info("Failed respond request time: %.2f seconds", time.time() - start_time)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/emotion/audio', methods=['POST'])
 def detect_emotion_from_audio():
     start_time = time.time()
     try:
-        # Check if file was uploaded
-        if 'audio' not in request.files:
+        # Reject oversized uploads up front when the client declares a length
+        if request.content_length and request.content_length > AUDIO_MAX_UPLOAD_BYTES:
+            return jsonify({'error': f'Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes'}), 413
+        
+        # Parse the multipart body incrementally instead of spooling it through request.files
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
             return jsonify({'error': 'No audio file provided'}), 400
         
-        audio_file = request.files['audio']
+        audio_upload = StreamingUpload(request.stream, boundary, 'audio', AUDIO_MAX_UPLOAD_BYTES)
+        if not audio_upload.open():
+            return jsonify({'error': 'No audio file provided'}), 400
         
-        if audio_file.filename == '':
+        if not audio_upload.filename:
             return jsonify({'error': 'No selected file'}), 400
         
-        # Save the uploaded file temporarily
-        temp_audio_file = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
-        temp_audio_path = temp_audio_file.name
-        audio_file.save(temp_audio_path)
-        
-        logger.info(f"Detecting emotion from audio file: {audio_file.filename}")
-        
-        # Define async function to detect emotion from audio using direct HTTP requests
-        async def detect_audio_emotion_async():
-            try:
-                # Configure burst model for audio analysis
-                logger.info(f"Starting audio analysis job...")
-                
-                # Read the file content
-                with open(temp_audio_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # Use aiohttp to make a direct HTTP request to the Hume API
-                async with aiohttp.ClientSession() as session:
-                    # Create form data with the file
-                    form_data = aiohttp.FormData()
-                    form_data.add_field('file', 
-                                        file_content,
-                                        filename=os.path.basename(temp_audio_path),
-                                        content_type='audio/wav')
-                    
-                    # Add the models configuration as JSON
-                    form_data.add_field('json', 
-                                        json.dumps({
-                                            "models": {
-                                                "burst": {}  # Only use burst model for audio
-                                            }
-                                        }))
-                    
-                    # Make the request to start a job
-                    async with session.post(
-                        'https://api.hume.ai/v0/batch/jobs',
-                        headers={'X-Hume-Api-Key': HUME_API_KEY},
-                        data=form_data
-                    ) as response:
-                        if response.status != 200:
-                            error_text = await response.text()
-                            logger.error(f"Hume API error: {error_text}")
-                            raise Exception(f"Hume API returned status {response.status}: {error_text}")
-                        
-                        job_response = await response.json()
-                        job_id = job_response.get('job_id')
-                        
-                        if not job_id:
-                            raise Exception("No job_id returned from Hume API")
-                        
-                        logger.info(f"Audio job started with ID: {job_id}")
-                        
-                        # Poll for job completion
-                        max_retries = 15
-                        retry_count = 0
-                        job_complete = False
-                        
-                        while not job_complete and retry_count < max_retries:
-                            # Wait before checking status
-                            await asyncio.sleep(1)
-                            
-                            # Check job status
-                            status_url = f"https://api.hume.ai/v0/batch/jobs/{job_id}"
-                            async with session.get(
-                                status_url,
-                                headers={'X-Hume-Api-Key': HUME_API_KEY}
-                            ) as status_response:
-                                if status_response.status != 200:
-                                    error_text = await status_response.text()
-                                    logger.error(f"Error checking job status: {error_text}")
-                                    raise Exception(f"Error checking job status: {status_response.status}")
-                                
-                                status_data = await status_response.json()
-                                status = status_data.get('state', {}).get('status')
-                                logger.info(f"Audio job status: {status}, retry: {retry_count+1}/{max_retries}")
-                                
-                                if status == "COMPLETED":
-                                    job_complete = True
-                                    break
-                                elif status == "FAILED":
-                                    failure_reason = status_data.get('state', {}).get('failure_reason', 'Unknown')
-                                    logger.error(f"Audio job failed: {failure_reason}")
-                                    raise Exception(f"Audio job failed: {failure_reason}")
-                                
-                                retry_count += 1
-                        
-                        if not job_complete:
-                            raise Exception(f"Audio job did not complete after {max_retries} retries")
-                        
-                        # Get results
-                        predictions_url = f"https://api.hume.ai/v0/batch/jobs/{job_id}/predictions"
-                        async with session.get(
-                            predictions_url,
-                            headers={'X-Hume-Api-Key': HUME_API_KEY}
-                        ) as predictions_response:
-                            if predictions_response.status != 200:
-                                error_text = await predictions_response.text()
-                                logger.error(f"Error getting predictions: {error_text}")
-                                raise Exception(f"Error getting predictions: {predictions_response.status}")
-                            
-                            predictions = await predictions_response.json()
-                            logger.info(f"Got audio results")
-                            return predictions
-                
-            except Exception as e:
-                logger.error(f"Error in Hume API call for audio: {str(e)}")
-                raise e
-            finally:
-                # Clean up the temporary file
-                try:
-                    os.unlink(temp_audio_path)
-                except Exception as e:
-                    logger.error(f"Error removing temporary audio file: {str(e)}")
-        
-        # Run the async function
         try:
-            loop = asyncio.get_event_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
+            options = parse_options(request.args)
+            budget = parse_budget(request.headers.get('X-Deadline'))
+        except (InvalidOptions, InvalidDeadline) as e:
+            return jsonify({'error': str(e)}), 400
         
-        response_data = loop.run_until_complete(detect_audio_emotion_async())
+        logger.info("Detecting emotion from audio file: %s", audio_upload.filename)
+        preprocess = request.args.get('preprocess', '1' if AUDIO_PREPROCESS else '0') in ('1', 'true')
         
-        # Process the emotion response
-        emotions = []
-        dominant_emotion = "neutral"
+        # Small recordings are hashed up front so repeats can be answered from the cache
+        audio_cache_key = None
+        if audio_upload.buffer_up_to(EMOTION_CACHE_AUDIO_MAX_BYTES):
+            audio_cache_key = emotion_cache.audio_key(audio_upload.sha256(), audio_model_config(preprocess))
         
-        # Log the raw response for debugging
-        logger.info(f"Raw audio response: {response_data}")
-        
-        # Extract emotions from the response
+        # Run on the shared event loop so pooled connections are reused
+        fallback = None
         try:
-            if response_data:
-                logger.info(f"Processing audio emotion data")
-                
-                # The response is already a list of dictionaries
-                if isinstance(response_data, list) and len(response_data) > 0:
-                    prediction = response_data[0]
-                    
-                    # Extract emotions from the nested structure
-                    try:
-                        # Navigate through the response structure
-                        burst_data = prediction.get('results', {}).get('predictions', [{}])[0].get('models', {}).get('burst', {})
-                        
-                        if burst_data and 'grouped_predictions' in burst_data:
-                            # Get the first group of predictions
-                            grouped_predictions = burst_data['grouped_predictions']
-                            if grouped_predictions and len(grouped_predictions) > 0:
-                                # Get the first prediction in the group
-                                predictions = grouped_predictions[0].get('predictions', [])
-                                if predictions and len(predictions) > 0:
-                                    # Get the emotions from the first prediction
-                                    emotion_list = predictions[0].get('emotions', [])
-                                    
-                                    # Sort emotions by score
-                                    sorted_emotions = sorted(emotion_list, key=lambda x: x.get('score', 0), reverse=True)
-                                    emotions = sorted_emotions  # This contains all emotions
-                                    
-                                    # Log the emotions
-                                    if emotions:
-                                        logger.info(f"Found {len(emotions)} audio emotions")
-                                        dominant_emotion = emotions[0].get("name", "Neutral")
-                                        logger.info(f"Top detected audio emotion: {dominant_emotion} with score {emotions[0].get('score')}")
-                    except Exception as e:
-                        logger.error(f"Error extracting emotions from burst data: {str(e)}")
-                        logger.error(f"Response structure: {prediction.keys() if isinstance(prediction, dict) else 'Not a dict'}")
-        except Exception as e:
-            logger.error(f"Error processing audio emotions: {str(e)}")
-            # Continue with neutral emotion as fallback
-        
-        result = {
-            "emotions": emotions,  # This will include all emotions sorted by score
-            "dominantEmotion": dominant_emotion
-        }
-        
-        logger.info(f"Audio emotion detection completed in {time.time() - start_time:.2f} seconds")
-        logger.info(f"Dominant audio emotion: {dominant_emotion}")
-        return jsonify(result)
+            emotion_list, cache_source, upload_mode = run_async(within(analyze_audio_upload(audio_upload, audio_cache_key, preprocess), budget))
+        except (CircuitOpen, DeadlineExceeded) as e:
+            logger.warning("Answering audio emotion request with a fallback: %s", e)
+            emotion_list, cache_source, upload_mode, fallback = [], "miss", "none", fallback_reason(e)
+        finally:
+            # A missed deadline cancels the upload to Hume; wait out any body read it left running
+            audio_upload.close()
+        
+        result = summarize(emotion_list, **options)
+        if fallback:
+            result["fallback"] = fallback
+            hume_metrics.FALLBACK_RESPONSES.inc(reason=fallback)
+        elif not emotion_list:
+            hume_metrics.FALLBACK_RESPONSES.inc(reason="empty")
+        
+        elapsed = time.time() - start_time
+        logger.info("Audio emotion detection completed in %.2f seconds: %s (cache %s, %s upload)", elapsed, result['dominantEmotion'], cache_source, upload_mode,
+                    extra={"duration": elapsed, "dominant_emotion": result['dominantEmotion'], "cache": cache_source, "upload_mode": upload_mode})
+        response = jsonify(result)
+        response.headers['X-Emotion-Cache'] = cache_source
+        response.headers['X-Audio-Upload-Mode'] = upload_mode
+        if fallback:
+            response.headers['X-Fallback'] = fallback
+        return response
+        
+    except UploadTooLarge as e:
+        logger.error("Rejected audio upload: %s", e)
+        return jsonify({'error': str(e)}), 413
+        
+    except Overloaded as e:
+        # Hume's quota is taken by more urgent work; tell the client when to come back
+        body, headers = overloaded_body(e)
+        return jsonify(body), 429, headers
         
     except Exception as e:
-        logger.error(f"Error in audio emotion detection: {str(e)}")
-        logger.info(f"Failed audio emotion detection time: {time.time() - start_time:.2f} seconds")
+        logger.error("Error in audio emotion detection: %s", e)
+        logger.info("Failed audio emotion detection time: %.2f seconds", time.time() - start_time)
+        hume_metrics.FALLBACK_RESPONSES.inc(reason="error")
         
         # Return a fallback neutral emotion
         return jsonify({
@@ -551,9 +467,156 @@ def detect_emotion_from_audio():
             "error": str(e)
         }), 500
 
+@app.route('/api/emotion/jobs', methods=['POST'])
+def submit_emotion_job():
+    # Queue the analysis and answer at once; the result is fetched or streamed later
+    try:
+        job_request = text_job_request(read_json())
+    except InvalidOptions as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job = run_async(queue_emotion_job("text", job_request))
+    logger.info("Queued asynchronous emotion job %s for %s texts", job.token, len(job_request["texts"]))
+    response = jsonify(accepted_body(job))
+    response.headers['Location'] = f"/api/emotion/jobs/{job.token}"
+    return response, 202
+
+@app.route('/api/emotion/audio/jobs', methods=['POST'])
+def submit_audio_emotion_job():
+    try:
+        if request.content_length and request.content_length > AUDIO_MAX_UPLOAD_BYTES:
+            return jsonify({'error': f'Audio upload exceeds {AUDIO_MAX_UPLOAD_BYTES} bytes'}), 413
+        
+        boundary = request.mimetype_params.get('boundary')
+        if request.mimetype != 'multipart/form-data' or not boundary:
+            return jsonify({'error': 'No audio file provided'}), 400
+        
+        audio_upload = StreamingUpload(request.stream, boundary, 'audio', AUDIO_MAX_UPLOAD_BYTES)
+        if not audio_upload.open():
+            return jsonify({'error': 'No audio file provided'}), 400
+        
+        if not audio_upload.filename:
+            return jsonify({'error': 'No selected file'}), 400
+        
+        try:
+            options = parse_options(request.args)
+        except InvalidOptions as e:
+            return jsonify({'error': str(e)}), 400
+        preprocess = request.args.get('preprocess', '1' if AUDIO_PREPROCESS else '0') in ('1', 'true')
+        
+        # The recording is spooled to disk as it arrives so the job survives a restart before it reaches Hume
+        spooled, audio_sha256, audio_size = job_store.spool(audio_upload)
+        job_request = audio_job_request(audio_sha256, audio_upload.filename, audio_upload.content_type, preprocess, options)
+        job = run_async(queue_emotion_job("audio", job_request, spooled=spooled))
+        logger.info("Queued asynchronous audio emotion job %s for %s (%s bytes)", job.token, audio_upload.filename, audio_size)
+        response = jsonify(accepted_body(job))
+        response.headers['Location'] = f"/api/emotion/jobs/{job.token}"
+        return response, 202
+        
+    except UploadTooLarge as e:
+        logger.error("Rejected audio upload: %s", e)
+        return jsonify({'error': str(e)}), 413
+        
+    except Exception as e:
+        logger.error("Error queueing audio emotion job: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/emotion/jobs/<token>', methods=['GET'])
+def get_emotion_job(token):
+    job = job_store.get(token)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job_body(job))
+
+@app.route('/api/emotion/jobs/<token>/events', methods=['GET'])
+def emotion_job_events(token):
+    if job_store.get(token) is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    # Each subscriber holds a request thread here; ASGI mode holds only a coroutine
+    return Response(iterate_async(job_events(token)), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+@app.route('/api/hume/callback', methods=['POST'])
+def hume_job_callback():
+    # Hume calls this when a job submitted with callback_url finishes
+    if HUME_CALLBACK_TOKEN and not hmac.compare_digest(request.args.get('token', ''), HUME_CALLBACK_TOKEN):
+        return jsonify({'error': 'Invalid callback token'}), 403
+    
+    data = read_json()
+    job_id = data.get('job_id')
+    if not job_id:
+        return jsonify({'error': 'job_id is required'}), 400
+    
+    status = data.get('status', 'COMPLETED')
+    failure_reason = data.get('failure_reason') or data.get('message')
+    
+    async def notify():
+        return job_tracker.notify(job_id, status, failure_reason)
+    
+    known = run_async(notify())
+    return jsonify({'received': True, 'known': known})
+
+def admin_authorized():
+    if HUME_ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), HUME_ADMIN_TOKEN)
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+@app.route('/api/admin/emotion-cache', methods=['GET', 'DELETE'])
+def admin_emotion_cache():
+    if not admin_authorized():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    kind = request.args.get('kind')
+    if kind not in (None, 'text', 'audio'):
+        return jsonify({'error': 'kind must be text or audio'}), 400
+    
+    # DELETE flushes the cache, optionally only one kind of entry
+    if request.method == 'DELETE':
+        removed = emotion_cache.flush(kind)
+        logger.info("Flushed %s emotion cache entries (kind: %s)", removed, kind or 'all')
+        return jsonify({'flushed': removed})
+    
+    try:
+        limit = entries_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({
+        'stats': emotion_cache.stats(),
+        'entries': emotion_cache.entries(kind, limit)
+    })
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Per-stage latency histograms and per-route counters for Prometheus to scrape
+    return Response(hume_metrics.REGISTRY.render(), content_type=hume_metrics.CONTENT_TYPE)
+
+@app.route('/api/stats', methods=['GET'])
+def upstream_stats():
+    # Connection reuse counters for the shared Hume client pool and cache counters
+    return jsonify({
+        "http": get_client().stats(),
+        "scheduler": get_client().scheduler.stats(),
+        "tts_cache": tts_cache.stats(),
+        "emotion_coalescer": emotion_coalescer.stats(),
+        "jobs": job_tracker.stats(),
+        "async_jobs": job_store.stats(),
+        "emotion_cache": emotion_cache.stats()
+    })
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    # Readiness probe for load balancers and the multi-worker entry point
+    body, status = readiness()
+    return jsonify(body), status
+
+# Time spent importing this module and building the app, reported by /api/ready and /metrics
+app_built(_import_started)
+
 if __name__ == '__main__':
     # Get port from environment variable for production environments
     port = int(os.environ.get('PORT', 5001))
     # Set debug to False in production
     debug = os.environ.get('FLASK_ENV', 'production') != 'production'
+    # Pick up asynchronous jobs a previous run left unfinished
+    if RESUME_JOBS:
+        run_async(resume_emotion_jobs())
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,221 @@
+"""Streaming readers for multipart uploads that never touch disk.
+
+Flask's ``request.files`` spools large uploads to temporary files and hands
+back a fully buffered copy. These readers instead parse the raw request body
+incrementally and yield the bytes of a single file field chunk by chunk, so
+they can be piped straight into an outgoing request with bounded memory.
+``StreamingUpload`` reads a blocking WSGI stream; ``AsyncStreamingUpload``
+reads an async iterator of body chunks, as provided by ASGI servers.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+
+from werkzeug.sansio.multipart import NEED_DATA, Data, Epilogue, File, MultipartDecoder
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised while reading once the request body exceeds the size limit."""
+
+    def __init__(self, max_bytes):
+        super().__init__(f"Upload exceeds the maximum size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+class _MultipartFileReader:
+    """I/O-free part shared by the readers: decoding, size limit and hashing."""
+
+    def __init__(self, boundary, field_name, max_bytes):
+        self.field_name = field_name
+        self.max_bytes = max_bytes
+        self.filename = None
+        self.content_type = None
+        self.bytes_read = 0
+        # Time spent waiting on the client for body bytes
+        self.read_seconds = 0.0
+        self.error = None
+        self.complete = False
+        self._decoder = MultipartDecoder(boundary.encode('latin-1'))
+        self._finished = False
+        self._buffered = []
+
+    def _feed(self, data):
+        """Pass raw body bytes to the decoder; empty data marks the end of the body."""
+        if not data:
+            self._finished = True
+            self._decoder.receive_data(None)
+            return
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_bytes:
+            self.error = UploadTooLarge(self.max_bytes)
+            raise self.error
+        self._decoder.receive_data(data)
+
+    def _event(self):
+        event = self._decoder.next_event()
+        if event is NEED_DATA and self._finished:
+            return Epilogue(data=b'')
+        return event
+
+    def _match_file(self, event):
+        if isinstance(event, File) and event.name == self.field_name:
+            self.filename = event.filename
+            self.content_type = event.headers.get('Content-Type', 'application/octet-stream')
+            return True
+        return False
+
+    def sha256(self):
+        """Digest of the buffered content; only meaningful once ``complete``."""
+        digest = hashlib.sha256()
+        for chunk in self._buffered:
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+class StreamingUpload(_MultipartFileReader):
+    """Incrementally extracts one file field from a blocking request stream.
+
+    Call ``open`` to read up to the start of the field, then iterate to receive
+    its content. At most ``chunk_size`` bytes of the body are held at a time,
+    and ``UploadTooLarge`` is raised as soon as more than ``max_bytes`` have
+    been read, without buffering the rest.
+    """
+
+    def __init__(self, stream, boundary, field_name, max_bytes, chunk_size=DEFAULT_CHUNK_SIZE):
+        super().__init__(boundary, field_name, max_bytes)
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.closed = False
+        self._read_lock = threading.Lock()
+        self._content = self._iter_content()
+
+    def _next_event(self):
+        while True:
+            event = self._event()
+            if event is not NEED_DATA:
+                return event
+            started = time.perf_counter()
+            data = self.stream.read(self.chunk_size)
+            self.read_seconds += time.perf_counter() - started
+            self._feed(data)
+
+    def open(self):
+        """Skip ahead to the target file field; return False if it is missing."""
+        while True:
+            event = self._next_event()
+            if isinstance(event, Epilogue):
+                return False
+            if self._match_file(event):
+                return True
+
+    def _iter_content(self):
+        while True:
+            event = self._next_event()
+            if not isinstance(event, Data):
+                break
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                break
+        self.complete = True
+
+    def buffer_up_to(self, limit):
+        """Read ahead up to ``limit`` bytes of the file; return True if it all fit.
+
+        Buffered chunks are replayed first when the upload is iterated, so
+        small files can be hashed before anything is sent upstream.
+        """
+        size = sum(len(chunk) for chunk in self._buffered)
+        for chunk in self._content:
+            self._buffered.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                return False
+        return self.complete
+
+    def __iter__(self):
+        while self._buffered:
+            yield self._buffered.pop(0)
+        yield from self._content
+
+    def _next_chunk(self, chunks):
+        with self._read_lock:
+            return None if self.closed else next(chunks, None)
+
+    async def aiter_chunks(self):
+        """Async view of the file content; blocking reads run in a worker thread."""
+        chunks = iter(self)
+        while True:
+            chunk = await asyncio.to_thread(self._next_chunk, chunks)
+            if chunk is None:
+                return
+            yield chunk
+
+    def close(self):
+        """Stop reading the stream, first waiting for a read a cancelled ``aiter_chunks`` left running.
+
+        Call it before the request is answered: the WSGI input is not valid after that.
+        """
+        with self._read_lock:
+            self.closed = True
+
+
+class AsyncStreamingUpload(_MultipartFileReader):
+    """Async counterpart of ``StreamingUpload`` fed by an async iterator of body chunks."""
+
+    def __init__(self, body_chunks, boundary, field_name, max_bytes):
+        super().__init__(boundary, field_name, max_bytes)
+        self._body = body_chunks.__aiter__()
+        self._content = self._iter_content()
+
+    async def _next_event(self):
+        while True:
+            event = self._event()
+            if event is not NEED_DATA:
+                return event
+            started = time.perf_counter()
+            try:
+                data = await self._body.__anext__()
+            except StopAsyncIteration:
+                data = b''
+            self.read_seconds += time.perf_counter() - started
+            self._feed(data)
+
+    async def open(self):
+        """Skip ahead to the target file field; return False if it is missing."""
+        while True:
+            event = await self._next_event()
+            if isinstance(event, Epilogue):
+                return False
+            if self._match_file(event):
+                return True
+
+    async def _iter_content(self):
+        while True:
+            event = await self._next_event()
+            if not isinstance(event, Data):
+                break
+            if event.data:
+                yield event.data
+            if not event.more_data:
+                break
+        self.complete = True
+
+    async def buffer_up_to(self, limit):
+        """Read ahead up to ``limit`` bytes of the file; return True if it all fit."""
+        size = sum(len(chunk) for chunk in self._buffered)
+        async for chunk in self._content:
+            self._buffered.append(chunk)
+            size += len(chunk)
+            if size > limit:
+                return False
+        return self.complete
+
+    async def aiter_chunks(self):
+        while self._buffered:
+            yield self._buffered.pop(0)
+        async for chunk in self._content:
+            yield chunk
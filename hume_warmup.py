@@ -0,0 +1,185 @@
+"""Pre-synthesize the game's scripted agent lines into a TTS cache bundle.
+
+Scripted lines are extracted from the frontend sources and synthesized for
+every voice in ``voice_mappings`` with the emotion the game plays them with,
+so the first player to hear a line never waits on cold synthesis. The server
+loads the resulting bundle at startup (see ``TTSAudioCache.load_bundle``).
+
+Re-runs are incremental: a clip is only synthesized when its cache key, which
+covers the text, description, voice and format, is missing from the bundle.
+Clips for lines that no longer exist are removed.
+
+Usage:
+    python hume_warmup.py [--bundle DIR] [--concurrency N] [--all-emotions] [--dry-run]
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+
+from hume_cache import DEFAULT_BUNDLE_DIR, TTSAudioCache, read_bundle_manifest, write_bundle_manifest
+from hume_http import get_client
+from hume_service import TTS_OUTPUT_FORMAT, emotion_descriptions, synthesize_speech, voice_mappings
+
+logger = logging.getLogger('hume_warmup')
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+AGENT_ENGINE_PATH = os.path.join(ROOT_DIR, 'src', 'lib', 'ai-negotiation', 'agent-engine.ts')
+NEGOTIATION_PAGE_PATH = os.path.join(ROOT_DIR, 'src', 'app', 'stakeholder-negotiation', 'page.tsx')
+
+STRING_LITERAL = re.compile(r'"((?:[^"\\]|\\.)*)"')
+
+
+def _read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def _block(source, start_marker):
+    """Return the text between ``start_marker`` and its matching closing bracket."""
+    start = source.index(start_marker) + len(start_marker) - 1
+    opening = source[start]
+    closing = {'{': '}', '[': ']'}[opening]
+    depth = 0
+    for index in range(start, len(source)):
+        if source[index] == opening:
+            depth += 1
+        elif source[index] == closing:
+            depth -= 1
+            if depth == 0:
+                return source[start:index + 1]
+    raise ValueError(f"Unbalanced block after {start_marker!r}")
+
+
+def extract_script_lines():
+    """Return ``(agent_name, text, emotion)`` for every scripted agent line.
+
+    Covers the stance fallback responses and the per-agent fallback template in
+    agent-engine.ts; both are always spoken with the neutral emotion.
+    """
+    agent_engine = _read(AGENT_ENGINE_PATH)
+    agent_names = list(voice_mappings)
+    if os.path.exists(NEGOTIATION_PAGE_PATH):
+        pool = _block(_read(NEGOTIATION_PAGE_PATH), 'const agentProfilePool: AgentProfile[] = [')
+        agent_names += re.findall(r'name:\s*"([^"]+)"', pool)
+    agent_names = list(dict.fromkeys(agent_names))
+
+    lines = []
+    fallback_responses = _block(agent_engine, 'const fallbackResponses = {')
+    for text in STRING_LITERAL.findall(fallback_responses):
+        # Any agent can be given any stance, so every agent may say every fallback
+        lines.extend((agent_name, text.replace('\\"', '"'), 'neutral') for agent_name in agent_names)
+
+    for template in re.findall(r'const fallbackMessage = `([^`]*)`', agent_engine):
+        for agent_name in agent_names:
+            lines.append((agent_name, template.replace('${agentName}', agent_name), 'neutral'))
+    return lines
+
+
+def plan_clips(lines, all_emotions=False):
+    """Map cache key to clip metadata, one entry per distinct voice/text/emotion."""
+    clips = {}
+    for agent_name, text, emotion in lines:
+        emotions = list(emotion_descriptions) if all_emotions else [emotion]
+        for clip_emotion in emotions:
+            description = emotion_descriptions.get(clip_emotion, emotion_descriptions['neutral'])
+            voice_id = voice_mappings.get(agent_name, voice_mappings['Minister Santos'])
+            key = TTSAudioCache.key(text, description, voice_id, TTS_OUTPUT_FORMAT)
+            clips.setdefault(key, {
+                "agent": agent_name,
+                "text": text,
+                "emotion": clip_emotion,
+                "description": description,
+                "voice_id": voice_id,
+                "format": TTS_OUTPUT_FORMAT,
+                "file": f"{key}.{TTS_OUTPUT_FORMAT}"
+            })
+    return clips
+
+
+def _is_current(bundle_dir, entry):
+    path = os.path.join(bundle_dir, entry["file"])
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest() == entry.get("sha256")
+    except FileNotFoundError:
+        return False
+
+
+async def synthesize_clips(bundle_dir, manifest, pending, concurrency):
+    """Synthesize ``pending`` clips with at most ``concurrency`` requests in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def synthesize(key, clip):
+        nonlocal failures
+        async with semaphore:
+            try:
+                audio = await synthesize_speech(clip["text"], clip["description"], clip["voice_id"])
+            except Exception as e:
+                failures += 1
+                logger.error("Failed to synthesize %s: %s... (%s)", clip['agent'], clip['text'][:50], e)
+                return
+        with open(os.path.join(bundle_dir, clip["file"]), 'wb') as f:
+            f.write(audio)
+        manifest["entries"][key] = dict(clip, bytes=len(audio), sha256=hashlib.sha256(audio).hexdigest())
+        logger.info("Synthesized %s (%s): %s...", clip['agent'], clip['emotion'], clip['text'][:50])
+
+    try:
+        await asyncio.gather(*(synthesize(key, clip) for key, clip in pending.items()))
+    finally:
+        await get_client().close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-synthesize scripted agent lines into a TTS cache bundle")
+    parser.add_argument('--bundle', default=os.getenv('HUME_TTS_BUNDLE_DIR', DEFAULT_BUNDLE_DIR),
+                        help="Bundle directory the server loads at startup")
+    parser.add_argument('--concurrency', type=int, default=4, help="Maximum concurrent synthesis requests")
+    parser.add_argument('--all-emotions', action='store_true',
+                        help="Synthesize every line in every emotion, not just the one it is played with")
+    parser.add_argument('--keep-stale', action='store_true', help="Keep clips for lines no longer in the script")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be synthesized")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    clips = plan_clips(extract_script_lines(), args.all_emotions)
+    manifest = read_bundle_manifest(args.bundle)
+    entries = manifest["entries"]
+
+    pending = {key: clip for key, clip in clips.items() if key not in entries or not _is_current(args.bundle, entries[key])}
+    stale = [key for key in entries if key not in clips]
+    logger.info("%s clips in script: %s up to date, %s to synthesize, %s stale",
+                len(clips), len(clips) - len(pending), len(pending), len(stale))
+    if args.dry_run:
+        for clip in pending.values():
+            print(f"{clip['voice_id']}  {clip['emotion']:<12} {clip['text']}")
+        return
+
+    os.makedirs(args.bundle, exist_ok=True)
+    if not args.keep_stale:
+        for key in stale:
+            entry = entries.pop(key)
+            try:
+                os.unlink(os.path.join(args.bundle, entry["file"]))
+            except FileNotFoundError:
+                pass
+
+    failures = 0
+    if pending:
+        failures = asyncio.run(synthesize_clips(args.bundle, manifest, pending, args.concurrency))
+    manifest["format"] = TTS_OUTPUT_FORMAT
+    write_bundle_manifest(args.bundle, manifest)
+
+    logger.info("Bundle %s holds %s clips; %s failed; finished in %.2f seconds",
+                args.bundle, len(entries), failures, time.time() - start_time)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
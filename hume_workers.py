@@ -0,0 +1,164 @@
+"""Preforked multi-worker entry point for the Hume server.
+
+The master process binds the listening socket and imports the heavy
+libraries (Starlette and uvicorn or Flask, aiohttp, NumPy) once, then forks
+``--workers`` processes. Each worker builds the app and accepts connections
+on the inherited socket, and the library pages stay shared copy-on-write,
+so an extra worker costs little more than its own request state. Workers
+that exit are restarted.
+
+The workers run with ``HUME_CACHE_SHARED=1``: they read and write one
+on-disk TTS cache and one SQLite emotion cache, and their private memory
+tiers are off unless sized explicitly (see ``hume_cache``). A clip or an
+emotion result produced by any worker is a cache hit for all of them, and
+adding workers multiplies neither memory nor cache misses. Only the first
+worker resumes asynchronous jobs a previous run left unfinished.
+
+Usage:
+    python hume_workers.py --workers 4               # ASGI workers on $PORT (default 5001)
+    python hume_workers.py --workers 4 --mode flask  # Flask development servers instead
+"""
+import argparse
+import contextlib
+import importlib
+import logging
+import os
+import signal
+import socket
+import time
+
+from hume_logging import TEXT_FORMAT, stop_logging
+
+logger = logging.getLogger('hume_workers')
+
+# Imported by the master so every worker shares them instead of importing its own copy
+PRELOAD_MODULES = {
+    "asgi": ("starlette.applications", "uvicorn", "aiohttp", "numpy"),
+    "flask": ("flask", "flask_cors", "werkzeug.serving", "aiohttp", "numpy"),
+}
+
+# A worker exiting sooner than this after its start is restarted only after the same delay
+RESTART_DELAY = 1.0
+
+
+def default_workers():
+    """``HUME_WORKERS``, else ``WEB_CONCURRENCY`` as set by the platform, else the CPU count."""
+    return int(os.getenv('HUME_WORKERS') or os.getenv('WEB_CONCURRENCY') or os.cpu_count() or 2)
+
+
+def bind(host, port, backlog=2048):
+    """The listening socket every worker accepts connections on."""
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def preload(mode):
+    started = time.perf_counter()
+    for name in PRELOAD_MODULES[mode]:
+        importlib.import_module(name)
+    logger.info("Preloaded %s in %.3f seconds", ", ".join(PRELOAD_MODULES[mode]), time.perf_counter() - started)
+
+
+def run_worker(mode, sock, host, resume):
+    """Build the app in this (forked) process and serve ``sock`` until told to stop."""
+    # The master's handlers would forward signals to workers this process does not have
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    if not resume:
+        os.environ['HUME_RESUME_JOBS'] = '0'
+
+    if mode == "asgi":
+        import uvicorn
+        from hume_asgi import app
+
+        # Without uvicorn's own logging config its loggers go through the queue handler too
+        uvicorn.Server(uvicorn.Config(app, log_config=None)).run(sockets=[sock])
+    else:
+        from werkzeug.serving import make_server
+        from hume_http import run_async
+        from hume_service import RESUME_JOBS, resume_emotion_jobs
+        from hume_tts_server import app
+
+        if RESUME_JOBS:
+            run_async(resume_emotion_jobs())
+        make_server(host, sock.getsockname()[1], app, threaded=True, fd=sock.fileno()).serve_forever()
+
+
+def serve(mode, host, port, workers):
+    """Fork ``workers`` processes serving ``mode`` on one socket and keep them running."""
+    os.environ.setdefault('HUME_CACHE_SHARED', '1')
+    sock = bind(host, port)
+    preload(mode)
+
+    children = {}
+    stopping = False
+
+    def spawn(index, resume):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(mode, sock, host, resume)
+            except BaseException:
+                logger.exception("Worker %s failed", index)
+                code = 1
+            finally:
+                # os._exit skips atexit, so flush the worker's queued log records here
+                stop_logging()
+                os._exit(code)
+        children[pid] = (index, time.monotonic())
+        logger.info("Started worker %s (pid %s)", index, pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            with contextlib.suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    logger.info("Serving %s workers in %s mode on %s:%s", workers, mode, host, port)
+    for index in range(workers):
+        spawn(index, resume=index == 0)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        index, started = children.pop(pid, (None, None))
+        if index is None or stopping:
+            continue
+        # Jobs the worker was running are resumed by the next full restart, not by its replacement
+        logger.warning("Worker %s (pid %s) exited with code %s; restarting it",
+                       index, pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - started < RESTART_DELAY:
+            time.sleep(RESTART_DELAY)
+        if not stopping:
+            spawn(index, resume=False)
+    logger.info("All workers stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Hume server as preforked workers sharing one cache")
+    parser.add_argument('--workers', type=int, default=default_workers(), help="Worker processes to fork")
+    parser.add_argument('--mode', default='asgi', choices=sorted(PRELOAD_MODULES), help="Serving mode of each worker")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5001)), help="Port to listen on")
+    args = parser.parse_args()
+    if not hasattr(os, 'fork'):
+        parser.error("Preforked workers need os.fork; run hume_asgi.py or hume_tts_server.py instead")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    # No listener thread in the master: threads do not survive fork, and workers configure their own logging
+    logging.basicConfig(level=os.getenv('HUME_LOG_LEVEL', 'INFO').upper(), format=TEXT_FORMAT)
+    serve(args.mode, args.host, args.port, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -108,6 +108,44 @@ export const detectEmotionWithHumeServer = async (text: string): Promise<Emotion
   }
 };
 
+/**
+ * Detect emotions for several texts at once using Hume AI (server-side version).
+ * All texts are analysed in a single Hume job.
+ * @param texts Texts to analyze for emotions
+ * @returns Detected emotion type for each text, in input order
+ */
+export const detectEmotionsWithHumeServerBatch = async (texts: string[]): Promise<EmotionType[]> => {
+  if (texts.length === 0) {
+    return [];
+  }
+
+  try {
+    // Call our Python server's batch emotion detection endpoint
+    const humeResponse = await fetch('http://localhost:5001/api/emotion/batch', {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json'
+      },
+      body: JSON.stringify({
+        texts
+      })
+    });
+
+    if (!humeResponse.ok) {
+      console.error('Hume API error details:', await humeResponse.text());
+      return texts.map(() => 'Neutral');
+    }
+
+    const humeData = await humeResponse.json();
+
+    // Return the raw emotion from Hume for each text
+    return humeData.results.map((result: { dominantEmotion: EmotionType }) => result.dominantEmotion);
+  } catch (error) {
+    console.error('Error detecting emotions with Hume:', error);
+    return texts.map(() => 'Neutral');
+  }
+};
+
 /**
  * Generate a response from an AI agent based on their stance, selected policies, and conversation context
  * @param agentName Name of the agent
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The server modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the caches and job store that importing hume_service creates out of the working tree
+_cache_dir = tempfile.mkdtemp(prefix='hume-tests-')
+os.environ.setdefault('HUME_TTS_CACHE_DIR', os.path.join(_cache_dir, 'tts'))
+os.environ.setdefault('HUME_EMOTION_CACHE_DB', os.path.join(_cache_dir, 'emotions.sqlite3'))
+os.environ.setdefault('HUME_ASYNC_JOB_DB', os.path.join(_cache_dir, 'jobs.sqlite3'))
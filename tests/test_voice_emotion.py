@@ -0,0 +1,37 @@
+import pytest
+
+from hume_fake_api import EMOTION_NAMES
+from hume_service import emotion_descriptions, hume_emotion_voices, voice_emotion
+
+
+@pytest.mark.parametrize("label, emotion", [
+    ("Sympathy", "compassion"),
+    ("Empathic Pain", "compassion"),
+    ("Annoyance", "frustration"),
+    ("Disappointment", "frustration"),
+    ("Anxiety", "concern"),
+    ("Distress", "concern"),
+    ("Fear", "concern"),
+    ("Joy", "enthusiasm"),
+    ("Excitement", "enthusiasm"),
+    ("Interest", "enthusiasm"),
+    ("Anger", "anger"),
+    ("Boredom", "neutral"),
+    ("Calmness", "neutral"),
+])
+def test_hume_labels_map_to_voice_emotions(label, emotion):
+    assert voice_emotion(label) == emotion
+
+
+def test_every_voice_emotion_is_reachable_from_hume_labels():
+    reachable = {voice_emotion(label) for label in EMOTION_NAMES}
+    assert reachable == set(emotion_descriptions)
+
+
+def test_mapped_labels_are_hume_labels():
+    assert set(hume_emotion_voices) <= set(EMOTION_NAMES)
+
+
+@pytest.mark.parametrize("value", [None, "", "neutral", "Unknown"])
+def test_missing_or_unknown_emotions_are_neutral(value):
+    assert voice_emotion(value) == "neutral"